@@ -3,8 +3,7 @@
 from random import randint
 from backend.player import Player
 from backend.game import Game
-from backend.properties import Property
-from backend.properties import get_properties
+from backend.portfolio import portfolio
 from backend.cards import get_card_details
 
 LAST_CHANCE_INDEX_IN_TABLE = 29
@@ -59,15 +58,10 @@ def activate_card(player_id, game_id, card_landed_on):
 
     # If it's a "pay_per_house" type of chance card
     elif card_type == "pay_per_house":
-        # Variable to store total houses owned (hotels are worth four houses)
-        total_houses = 0
-        # Get a *list* of all properties owned by the current player
-        this_player_properties = get_properties(player_id)
-        # Go through each property
-        for property_position in this_player_properties:
-            with Property(game_id, property_position) as property_:
-                total_houses += property_.houses
-                total_houses += (property_.hotels * 4)
+        # Total houses owned (hotels are worth four houses), from the
+        # player's portfolio
+        holdings = portfolio(player_id, game_id)
+        total_houses = holdings['houses'] + holdings['hotels'] * 4
         # The card_value here indicates how much to pay for a single house
         to_pay = total_houses * card_value
         with Player(player_id) as player:
@@ -4,11 +4,13 @@
 import json
 import sys
 import cgitb
-import backend.game
+import backend.game_pool
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('allocate_game_id')
 def request_game_id(source=sys.stdin, output=sys.stdout):
     """Entry point for the client creating game on server, server responds
     with games id.
@@ -17,5 +19,5 @@ def request_game_id(source=sys.stdin, output=sys.stdout):
     output.write('Content-Type: application/json\n\n')
     request = json.load(source)
     host_id = request["host_id"]
-    game_id = backend.game.create_game(host_id)
+    game_id = backend.game_pool.allocate_game(host_id)
     json.dump({"game_id": game_id}, output)
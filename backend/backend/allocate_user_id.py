@@ -5,10 +5,12 @@ import json
 import sys
 import cgitb
 import backend.player
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('allocate_user_id')
 def request_user_id(source=sys.stdin, output=sys.stdout):
     """Entry point for the client sending username to server, server responds
     with clients username & id.
@@ -0,0 +1,330 @@
+"""Archival of finished games, so the tables the pages query stay small.
+
+Games that have finished, and lobbies that have been waiting for longer than
+a TTL, are moved out of ``games``, ``playing_in``, ``departures``,
+``properties``, ``players`` and ``rolls`` into gzipped json-lines files, one
+line per game. Games are archived in small batches, each read and deleted in
+its own short transaction (so the pages are never kept waiting on a long
+lock) and written to its own file. A game's players are archived with it,
+including those who went bankrupt, if they aren't in any other game. Entries in
+``lobby_log`` older than the TTL are deleted at the same time. A game's
+``standings`` are deleted with it, and rebuilt when it's restored. Its
+spectator and hint files are removed too (see backend.spectate.forget_game()).
+
+Run from cron (or by hand) with::
+
+    python -m backend.archive archive [--ttl 86400] [--batch 50]
+    python -m backend.archive restore GAME_ID
+
+Files are written to ``MONOPOLY_ARCHIVE_DIR`` (by default
+``/tmp/monopoly-archive``).
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import time
+
+import backend.config
+import backend.lobby
+import backend.spectate
+import backend.standings
+import backend.storage
+
+DEFAULT_DIRECTORY = '/tmp/monopoly-archive'
+
+# How long a lobby may wait for players before it's archived, in seconds.
+DEFAULT_TTL = 24 * 60 * 60
+
+# The tables a game's rows are archived from, in the order they're restored.
+TABLES = ('games', 'players', 'rolls', 'playing_in', 'departures',
+          'properties')
+
+
+def directory():
+    """Return the directory archives are written to."""
+    return backend.config.get('ARCHIVE_DIR', DEFAULT_DIRECTORY)
+
+
+def _placeholders(values):
+    """Return the placeholders for an IN list.
+
+    >>> _placeholders([1, 2, 3])
+    '(%s, %s, %s)'
+    """
+    return '({})'.format(', '.join(['%s'] * len(values)))
+
+
+def archivable_games(cursor, ttl, now=None):
+    """Return the ids of the games that should be archived.
+
+    Arguments:
+        cursor: The cursor to query with.
+        ttl: How long, in seconds, before a waiting lobby is archived.
+        now: The current unix time.
+    """
+    now = time.time() if now is None else now
+    cursor.execute('SELECT `id` FROM `games` WHERE `state` = "finished";')
+    finished = [row['id'] for row in cursor.fetchall()]
+    cursor.execute('SELECT `id` FROM `games` WHERE `state` = "waiting" '
+                   'AND `updated_at` < %s;', (int(now - ttl),))
+    return finished + [row['id'] for row in cursor.fetchall()]
+
+
+def _select(cursor, query, ids):
+    cursor.execute(query.format(_placeholders(ids)), tuple(ids))
+    return cursor.fetchall()
+
+
+def read_games(cursor, game_ids):
+    """Read every row belonging to some games.
+
+    Returns:
+        A dictionary mapping each game id to a dictionary of its rows by
+        table, and the ids of the players who are in none of the other
+        games.
+    """
+    games = {game_id: {table: [] for table in TABLES}
+             for game_id in game_ids}
+    for row in _select(cursor, 'SELECT * FROM `games` WHERE `id` IN {};',
+                       game_ids):
+        games[row['id']]['games'].append(row)
+    for table in ('playing_in', 'departures', 'properties'):
+        for row in _select(cursor, 'SELECT * FROM `' + table + '` '
+                           'WHERE `game_id` IN {};', game_ids):
+            games[row['game_id']][table].append(row)
+
+    members = {}
+    for game_id, rows in games.items():
+        for row in rows['playing_in'] + rows['departures']:
+            members[row['player_id']] = game_id
+    if not members:
+        return games, []
+    players = list(members)
+    elsewhere = set()
+    for table in ('playing_in', 'departures'):
+        cursor.execute('SELECT `player_id` FROM `' + table + '` '
+                       'WHERE `player_id` IN {} AND `game_id` NOT IN {};'
+                       .format(_placeholders(players),
+                               _placeholders(game_ids)),
+                       tuple(players) + tuple(game_ids))
+        elsewhere.update(row['player_id'] for row in cursor.fetchall())
+    players = [player for player in players if player not in elsewhere]
+    if players:
+        for row in _select(cursor, 'SELECT * FROM `players` '
+                           'WHERE `id` IN {};', players):
+            games[members[row['id']]]['players'].append(row)
+        for row in _select(cursor, 'SELECT * FROM `rolls` '
+                           'WHERE `id` IN {};', players):
+            games[members[row['id']]]['rolls'].append(row)
+    return games, players
+
+
+def delete_games(cursor, versions, player_ids):
+    """Delete some games, and the players only in them.
+
+    Arguments:
+        cursor: The cursor to delete with.
+        versions: A dictionary mapping the ids of the games to the versions
+            they were read at.
+        player_ids: The ids of the players to delete.
+
+    Returns:
+        bool: False if any of the games has changed since it was read (every
+            write to a game bumps its version, such as a player joining a
+            lobby), in which case nothing should be committed.
+    """
+    game_ids = sorted(versions)
+    deleted = cursor.execute(
+        'DELETE FROM `games` WHERE ' + ' OR '.join(
+            ['(`id` = %s AND `version` = %s)'] * len(game_ids)) + ';',
+        tuple(value for game_id in game_ids
+              for value in (game_id, versions[game_id])))
+    if deleted != len(game_ids):
+        return False
+    for table in ('playing_in', 'departures', 'properties', 'standings'):
+        cursor.execute('DELETE FROM `' + table + '` WHERE `game_id` IN ' +
+                       _placeholders(game_ids) + ';', tuple(game_ids))
+    if player_ids:
+        for table in ('rolls', 'players'):
+            cursor.execute('DELETE FROM `' + table + '` WHERE `id` IN ' +
+                           _placeholders(player_ids) + ';', tuple(player_ids))
+    return True
+
+
+def write_archive(filename, lines):
+    """Write lines to a gzipped file, and sync it to disk."""
+    with open(filename, 'wb') as archive:
+        archive.write(gzip.compress(''.join(lines).encode('utf-8')))
+        archive.flush()
+        os.fsync(archive.fileno())
+
+
+def archive_batch(conn, filename, game_ids):
+    """Archive some games in a single transaction, to a file of their own.
+
+    The rows are written (and synced) to a temporary file before the deletes
+    are committed, and the file is only renamed to filename once they have
+    been. A crash can leave a game in both the database and a temporary file
+    but never in neither, and a batch that is rolled back leaves nothing in
+    the archive.
+
+    Returns:
+        int: how many games were archived.
+    """
+    temporary = filename + '.tmp'
+    committed = False
+    conn.begin()
+    try:
+        with conn.cursor() as cursor:
+            games, players = read_games(cursor, game_ids)
+            game_ids = [game_id for game_id in game_ids
+                        if games[game_id]['games']]
+            if not game_ids:
+                conn.rollback()
+                return 0
+            write_archive(temporary, [
+                json.dumps({'game_id': game_id, 'tables': games[game_id]},
+                           sort_keys=True) + '\n' for game_id in game_ids])
+            if not delete_games(cursor, {
+                    game_id: games[game_id]['games'][0]['version']
+                    for game_id in game_ids}, players):
+                conn.rollback()
+                return 0
+            for game_id in game_ids:
+                if games[game_id]['games'][0]['state'] == 'waiting':
+                    backend.lobby.record_change(cursor, game_id, 'removed')
+        conn.commit()
+        committed = True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if not committed and os.path.exists(temporary):
+            os.remove(temporary)
+    os.rename(temporary, filename)
+    for game_id in game_ids:
+        backend.spectate.forget_game(game_id)
+    return len(game_ids)
+
+
+def archive_games(ttl=DEFAULT_TTL, batch=50, path=None):
+    """Archive every finished game and abandoned lobby.
+
+    Arguments:
+        ttl: How long, in seconds, before a waiting lobby is archived.
+        batch: How many games to archive in each transaction.
+        path: The directory to write the archive to.
+
+    Returns:
+        int: how many games were archived.
+    """
+    path = directory() if path is None else path
+    os.makedirs(path, exist_ok=True)
+    prefix = os.path.join(path, 'games.{}.{}'.format(
+        time.strftime('%Y%m%dT%H%M%S', time.gmtime()), os.getpid()))
+    conn = backend.storage.make_connection()
+    archived = 0
+    try:
+        with conn.cursor() as cursor:
+            game_ids = archivable_games(cursor, ttl)
+            # Clients that haven't caught up with the lobby by now are sent
+            # the whole of it instead.
+            conn.begin()
+            cursor.execute('DELETE FROM `lobby_log` WHERE `created_at` < %s;',
+                           (int(time.time() - ttl),))
+        conn.commit()
+        if not game_ids:
+            return 0
+        for start in range(0, len(game_ids), batch):
+            archived += archive_batch(
+                conn, '{}.{:06d}.jsonl.gz'.format(prefix, start // batch),
+                game_ids[start:start + batch])
+        return archived
+    finally:
+        conn.close()
+
+
+def find_game(game_id, path=None):
+    """Find a game in the archive.
+
+    Returns:
+        A dictionary of the game's rows by table, or None if it isn't there.
+    """
+    path = directory() if path is None else path
+    for filename in sorted(glob.glob(os.path.join(path, '*.jsonl.gz')),
+                           reverse=True):
+        with gzip.open(filename, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                entry = json.loads(line)
+                if entry['game_id'] == game_id:
+                    return entry['tables']
+    return None
+
+
+def restore_game(game_id, path=None):
+    """Put an archived game back into the database.
+
+    Returns:
+        bool: False if the game isn't in the archive, or is already in the
+            database.
+    """
+    tables = find_game(game_id, path)
+    if tables is None:
+        return False
+    conn = backend.storage.make_connection()
+    try:
+        conn.begin()
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT `id` FROM `games` WHERE `id` = %s;',
+                           (game_id,))
+            if cursor.fetchone() is not None:
+                return False
+            for table in TABLES:
+                # Archives written before departures was added don't have it.
+                rows = tables.get(table, [])
+                if not rows:
+                    continue
+                columns = sorted(rows[0])
+                cursor.executemany(
+                    'INSERT INTO `{}` ({}) VALUES {};'.format(
+                        table, ', '.join('`{}`'.format(column)
+                                         for column in columns),
+                        _placeholders(columns)),
+                    [tuple(row[column] for column in columns)
+                     for row in rows])
+            backend.standings.rebuild(cursor, game_id)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def main():
+    """Archive games, or restore one."""
+    parser = argparse.ArgumentParser(
+        description='Move finished games out of the database, or back in.')
+    parser.add_argument('--directory', default=directory())
+    commands = parser.add_subparsers(dest='command')
+    archive_parser = commands.add_parser('archive', help='archive games')
+    archive_parser.add_argument('--ttl', type=int, default=DEFAULT_TTL,
+                                help='seconds before a lobby is abandoned')
+    archive_parser.add_argument('--batch', type=int, default=50)
+    restore_parser = commands.add_parser('restore', help='restore a game')
+    restore_parser.add_argument('game_id', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'archive':
+        print('Archived {} games'.format(
+            archive_games(args.ttl, args.batch, args.directory)))
+    elif args.command == 'restore':
+        if not restore_game(args.game_id, args.directory):
+            parser.exit(1, 'Game {} not restored\n'.format(args.game_id))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Module enabling clients to make several moves in one request.
+
+A turn usually takes several requests (rolling, buying, building, mortgaging
+and ending the turn), each paying for its own process and connections. The
+``batch`` page takes a list of actions instead, runs each through the page
+that normally handles it, and returns all of their results. The actions are
+run in one transaction (see backend.storage.transaction()): if any of them
+fails, none of them are committed.
+
+The request is::
+
+    {"actions": [{"action": "roll_dice", "request": {"user_id": 3}},
+                 {"action": "buy_property", "request": {...}}, ...]}
+
+and the response is ``{"results": [<result of each action>, ...]}``, or, if
+an action failed, ``{"error": {"index": <i>, "action": <name>, "message":
+<message>}}``.
+"""
+
+import sys
+import io
+import inspect
+import json
+import cgitb
+
+import backend.storage
+from backend.buy_house import add_house, build_houses
+from backend.charge_rent import charge_rent
+from backend.increment_turn import increment_turn
+from backend.jail import go_to_jail, pay_to_leave_jail
+from backend.properties import buy_property
+from backend.property_state import mortgage_properties, property_state
+from backend.roll_die import player_roll_dice
+from backend.entry_point import entry_point
+
+cgitb.enable()
+
+# The pages that can be used in a batch, by their names in pages.py.
+ACTIONS = {
+    'roll_dice': player_roll_dice,
+    'buy_property': buy_property,
+    'buy_house': add_house,
+    'build_houses': build_houses,
+    'property_state': property_state,
+    'mortgage_properties': mortgage_properties,
+    'charge_rent': charge_rent,
+    'increment_turn': increment_turn,
+    'go_to_jail': go_to_jail,
+    'leave_jail': pay_to_leave_jail,
+}
+
+# The most actions accepted in one batch.
+MAX_ACTIONS = 20
+
+
+class ActionError(Exception):
+    """Raised when an action in a batch fails."""
+    def __init__(self, index, action, message):
+        super().__init__(message)
+        self.index = index
+        self.action = action
+        self.message = message
+
+
+def response_body(response):
+    """Return the json body of a page's response, without its headers.
+
+    >>> response_body('Content-Type: text/plain\\n\\n"Property bought"')
+    'Property bought'
+    >>> response_body('') is None
+    True
+    """
+    body = response.split('\n\n', 1)[1] if '\n\n' in response else response
+    return json.loads(body) if body.strip() else None
+
+
+def run_action(action, request):
+    """Run one action through the page that handles it.
+
+    Arguments:
+        action: The name of the page.
+        request: The request the page would normally be sent.
+
+    Returns:
+        The json body of the page's response.
+    """
+    handler = ACTIONS[action]
+    output = io.StringIO()
+    if 'source' in inspect.signature(handler).parameters:
+        handler(io.StringIO(json.dumps(request)), output)
+    else:
+        handler(**request)
+    return response_body(output.getvalue())
+
+
+def run_batch(actions):
+    """Run some actions in a single transaction.
+
+    Arguments:
+        actions: A list of dictionaries, each with the 'action' to run and
+            the 'request' to run it with.
+
+    Returns:
+        A list of the results of the actions.
+
+    Raises:
+        ActionError: if an action fails (after everything has been rolled
+            back).
+
+    >>> run_batch([{'action': 'sell_station', 'request': {}}])
+    Traceback (most recent call last):
+    ...
+    backend.batch.ActionError: unknown action 'sell_station'
+    """
+    if len(actions) > MAX_ACTIONS:
+        raise ActionError(None, None, 'too many actions')
+    for index, item in enumerate(actions):
+        if item.get('action') not in ACTIONS:
+            raise ActionError(index, item.get('action'),
+                              'unknown action {!r}'.format(
+                                  item.get('action')))
+    results = []
+    with backend.storage.transaction():
+        for index, item in enumerate(actions):
+            try:
+                result = run_action(item['action'], item.get('request', {}))
+            except Exception as error:  # pylint: disable=broad-except
+                raise ActionError(index, item['action'],
+                                  '{}: {}'.format(type(error).__name__,
+                                                  error)) from error
+            # Pages that refuse a move say so with an error response.
+            if isinstance(result, dict) and 'error' in result:
+                raise ActionError(index, item['action'], result['error'])
+            results.append(result)
+    return results
+
+
+@entry_point('batch')
+def batch(source=sys.stdin, output=sys.stdout):
+    """Entry point for the service of making several moves at once.
+    """
+    output.write('Content-Type: application/json\n\n')
+    request = json.load(source)
+    try:
+        json.dump({'results': run_batch(request['actions'])}, output)
+    except ActionError as error:
+        json.dump({'error': {'index': error.index, 'action': error.action,
+                             'message': error.message}}, output)
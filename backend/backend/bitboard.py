@@ -0,0 +1,194 @@
+"""A compact encoding of who owns, has mortgaged and has built on what.
+
+The 40 squares of the board are the bits of an int, so a set of squares is
+one number:
+
+- each player has a mask of the properties they own;
+- one mask holds the mortgaged properties;
+- the building level of every square (0 to 4 houses, or 5 for a hotel; see
+  backend.board) is packed into three bits each, in one int.
+
+Comparing two boards, or hashing one, is then a few integer operations, and
+the squares that differ between two boards are found by XOR-ing them
+(changed()).
+
+Boards are built from a game's snapshot (backend.snapshot), and its encode()d
+form is sent as part of it.
+"""
+
+import backend.board
+
+# The bits used for the building level of each square.
+LEVEL_BITS = 3
+LEVEL_MASK = (1 << LEVEL_BITS) - 1
+
+
+def mask(squares):
+    """Return the mask of some positions.
+
+    >>> bin(mask([1, 3]))
+    '0b1010'
+    """
+    result = 0
+    for position in squares:
+        result |= 1 << position
+    return result
+
+
+def positions(mask_):
+    """Return the positions in a mask, in order.
+
+    >>> positions(0b1010)
+    [1, 3]
+    """
+    result = []
+    while mask_:
+        low = mask_ & -mask_
+        result.append(low.bit_length() - 1)
+        mask_ ^= low
+    return result
+
+
+def level_squares(levels):
+    """Return the mask of the squares with a building level set in some
+    packed levels.
+
+    >>> positions(level_squares((5 << 3) | (1 << 9)))
+    [1, 3]
+    """
+    result = 0
+    while levels:
+        low = (levels & -levels).bit_length() - 1
+        square = low // LEVEL_BITS
+        result |= 1 << square
+        levels &= ~(LEVEL_MASK << (square * LEVEL_BITS))
+    return result
+
+
+class Bitboard(object):
+    """The ownership, mortgages and buildings of one game's properties.
+
+    Arguments:
+        owners: A dictionary mapping each player id to the mask of the
+            properties they own.
+        mortgaged: The mask of the mortgaged properties.
+        levels: The building levels, packed LEVEL_BITS to a square.
+
+    >>> board = Bitboard.from_properties([
+    ...     {'position': 1, 'owner': 7, 'mortgaged': False, 'houses': 2,
+    ...      'hotels': 0},
+    ...     {'position': 3, 'owner': 7, 'mortgaged': False, 'houses': 0,
+    ...      'hotels': 1},
+    ...     {'position': 5, 'owner': 8, 'mortgaged': True, 'houses': 0,
+    ...      'hotels': 0},
+    ...     {'position': 6, 'owner': None, 'mortgaged': False, 'houses': 0,
+    ...      'hotels': 0}])
+    >>> board.owner(3), board.owner(6), board.level(1), board.level(3)
+    (7, None, 2, 5)
+    >>> board.is_mortgaged(5)
+    True
+    >>> other = Bitboard(dict(board.owners), board.mortgaged, board.levels)
+    >>> other == board, hash(other) == hash(board)
+    (True, True)
+    >>> other.transfer(6, 8)
+    >>> other.set_level(1, 3)
+    >>> other == board, positions(board.changed(other))
+    (False, [1, 6])
+    >>> board.encode() == {'owners': {'7': 'a', '8': '20'},
+    ...                    'mortgaged': '20', 'levels': 'a10'}
+    True
+    """
+    __slots__ = ('owners', 'mortgaged', 'levels')
+
+    def __init__(self, owners=None, mortgaged=0, levels=0):
+        self.owners = {player_id: owned
+                       for player_id, owned in (owners or {}).items()
+                       if owned}
+        self.mortgaged = mortgaged
+        self.levels = levels
+
+    @classmethod
+    def from_properties(cls, properties):
+        """Build a board from a snapshot's list of properties."""
+        board = cls()
+        for prop in properties:
+            if prop['owner'] is not None:
+                board.transfer(prop['position'], prop['owner'])
+            if prop['mortgaged']:
+                board.mortgaged |= 1 << prop['position']
+            board.set_level(prop['position'], backend.board.level(
+                prop['houses'], prop['hotels']))
+        return board
+
+    def owned(self):
+        """Return the mask of every owned property."""
+        result = 0
+        for owned in self.owners.values():
+            result |= owned
+        return result
+
+    def owner(self, position):
+        """Return the id of the owner of a property, or None."""
+        bit = 1 << position
+        for player_id, owned in self.owners.items():
+            if owned & bit:
+                return player_id
+        return None
+
+    def transfer(self, position, player_id):
+        """Give a property to a player, or to nobody if player_id is
+        None."""
+        bit = 1 << position
+        for owner in list(self.owners):
+            self.owners[owner] &= ~bit
+            if not self.owners[owner]:
+                del self.owners[owner]
+        if player_id is not None:
+            self.owners[player_id] = self.owners.get(player_id, 0) | bit
+
+    def is_mortgaged(self, position):
+        """Return True if a property is mortgaged."""
+        return bool(self.mortgaged >> position & 1)
+
+    def level(self, position):
+        """Return the building level of a property."""
+        return self.levels >> (position * LEVEL_BITS) & LEVEL_MASK
+
+    def set_level(self, position, level):
+        """Set the building level of a property."""
+        shift = position * LEVEL_BITS
+        self.levels = (self.levels & ~(LEVEL_MASK << shift)) | (level << shift)
+
+    def changed(self, other):
+        """Return the mask of the properties whose owner, mortgage or
+        buildings differ between two boards."""
+        result = self.mortgaged ^ other.mortgaged
+        for player_id in set(self.owners) | set(other.owners):
+            result |= (self.owners.get(player_id, 0) ^
+                       other.owners.get(player_id, 0))
+        return result | level_squares(self.levels ^ other.levels)
+
+    def key(self):
+        """Return a tuple identifying the board, for comparing and
+        hashing."""
+        return (tuple(sorted(self.owners.items())), self.mortgaged,
+                self.levels)
+
+    def __eq__(self, other):
+        return isinstance(other, Bitboard) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def encode(self):
+        """Return the board for sending as json, with each number in hex
+        (as the level and mask ints are too big for JavaScript numbers)."""
+        return {
+            'owners': {str(player_id): '{:x}'.format(owned)
+                       for player_id, owned in self.owners.items()},
+            'mortgaged': '{:x}'.format(self.mortgaged),
+            'levels': '{:x}'.format(self.levels),
+        }
@@ -0,0 +1,324 @@
+"""The layout of the board, and the rules for building on it.
+
+The colour groups are fixed, so they're kept here rather than looked up:
+whether a player has a monopoly, or is building evenly, can then be checked
+against a game's properties once they've been read with a single query.
+
+apply_changes() builds, sells and mortgages any number of a player's
+properties at once, checking the rules against the layout the changes would
+leave, and writes everything (with the change to the player's balance) in
+one transaction.
+"""
+
+import backend.game
+import backend.standings
+import backend.storage
+from backend.levels import HOTEL, buildings, level
+
+# The positions of the properties in each colour group.
+GROUPS = {
+    'brown': (1, 3),
+    'light_blue': (6, 8, 9),
+    'pink': (11, 13, 14),
+    'orange': (16, 18, 19),
+    'red': (21, 23, 24),
+    'yellow': (26, 27, 29),
+    'green': (31, 32, 34),
+    'dark_blue': (37, 39),
+}
+
+# The colour group of each property position.
+GROUP_OF = {position: group
+            for group, positions in GROUPS.items()
+            for position in positions}
+
+RAILROADS = (5, 15, 25, 35)
+UTILITIES = (12, 28)
+
+
+class BoardError(Exception):
+    """Raised when some changes would break the rules."""
+
+
+def has_monopoly(properties, player_id, group):
+    """Return True if a player owns every property in a colour group.
+
+    Arguments:
+        properties: A dictionary of a game's properties by position, each
+            with its 'owner' (None if unowned).
+        player_id: The id of the player.
+        group: The name of the colour group.
+
+    >>> properties = {1: {'owner': 7}, 3: {'owner': 7}, 6: {'owner': 7},
+    ...               8: {'owner': None}, 9: {'owner': 7}}
+    >>> has_monopoly(properties, 7, 'brown')
+    True
+    >>> has_monopoly(properties, 7, 'light_blue')
+    False
+    """
+    return all(properties[position]['owner'] == player_id
+               for position in GROUPS[group])
+
+
+def check_group(after, player_id, group):
+    """Check the buildings and mortgages of a colour group, as some changes
+    would leave it, against the rules (see plan_changes()).
+
+    Raises:
+        BoardError: if the group breaks the rules.
+    """
+    group_levels = [after[position]['level'] for position in GROUPS[group]]
+    if not any(group_levels):
+        return
+    if not has_monopoly(after, player_id, group):
+        raise BoardError("player {} doesn't own a monopoly of {}".format(
+            player_id, group))
+    if any(after[position]['mortgaged'] for position in GROUPS[group]):
+        raise BoardError("{} has buildings, so can't be "
+                         "mortgaged".format(group))
+    if max(group_levels) - min(group_levels) > 1:
+        raise BoardError('houses in {} must be built evenly'.format(group))
+
+
+def change_cost(old, new):
+    """Return the change to a player's balance made by changing a property's
+    buildings and mortgage from old to new.
+
+    >>> old = {'level': 0, 'mortgaged': False, 'price': 60,
+    ...        'house_price': 50}
+    >>> change_cost(old, {'level': 2, 'mortgaged': False})
+    -100
+    >>> change_cost(dict(old, level=2), {'level': 0, 'mortgaged': True})
+    80
+    """
+    built = new['level'] - old['level']
+    if built > 0:
+        delta = -built * old['house_price']
+    else:
+        delta = -built * old['house_price'] // 2
+    if new['mortgaged'] != old['mortgaged']:
+        value = old['price'] // 2
+        delta += value if new['mortgaged'] else -value
+    return delta
+
+
+def plan_changes(properties, player_id, levels=None, mortgages=None):
+    """Check some changes to a player's properties against the rules, and
+    work out what they cost.
+
+    The rules are checked against the layout the changes would leave, so
+    the changes can be listed in any order:
+
+    - a player can only change properties they own;
+    - only properties in a colour group can be built on, from no houses up
+      to a hotel (HOTEL);
+    - a player can only build on a group they have a monopoly of, and
+      none of which is mortgaged;
+    - buildings in a group must be even: no property may have more than
+      one house more than another;
+    - a property can only be mortgaged if there are no buildings in its
+      group.
+
+    Houses cost their house price, and sell for half of it. Mortgaging a
+    property pays out half of its price, and paying it off costs the same.
+
+    Arguments:
+        properties: A dictionary of a game's properties by position, each
+            a dictionary with 'owner' (None if unowned), 'level',
+            'mortgaged', 'price' and 'house_price'. It isn't changed.
+        player_id: The id of the player making the changes.
+        levels: A dictionary mapping positions to the building level they
+            should have.
+        mortgages: A dictionary mapping positions to whether they should be
+            mortgaged.
+
+    Returns:
+        (dict, int): the new 'level' and 'mortgaged' of each property that
+            changes, by position, and the change to the player's balance.
+
+    Raises:
+        BoardError: if the changes break the rules.
+
+    >>> def owned(price=60, house_price=50, level_=0, mortgaged=False):
+    ...     return {'owner': 7, 'level': level_, 'mortgaged': mortgaged,
+    ...             'price': price, 'house_price': house_price}
+    >>> properties = {1: owned(), 3: owned(), 5: owned(200, 0)}
+    >>> plan_changes(properties, 7, levels={1: 2, 3: 1}) == (
+    ...     {1: {'level': 2, 'mortgaged': False},
+    ...      3: {'level': 1, 'mortgaged': False}}, -150)
+    True
+    >>> plan_changes(properties, 7, levels={1: 2})
+    Traceback (most recent call last):
+    ...
+    backend.board.BoardError: houses in brown must be built evenly
+    >>> plan_changes(properties, 7, levels={1: 1, 3: 1}, mortgages={5: True})
+    ... # doctest: +ELLIPSIS
+    ({...}, 0)
+    >>> plan_changes(properties, 7, levels={1: 1, 3: 1},
+    ...              mortgages={3: True})
+    Traceback (most recent call last):
+    ...
+    backend.board.BoardError: brown has buildings, so can't be mortgaged
+    >>> properties[3]['owner'] = 8
+    >>> plan_changes(properties, 7, levels={1: 1})
+    Traceback (most recent call last):
+    ...
+    backend.board.BoardError: player 7 doesn't own a monopoly of brown
+    """
+    levels = levels or {}
+    mortgages = mortgages or {}
+    after = {position: dict(properties[position])
+             for position in properties}
+    for position in set(levels) | set(mortgages):
+        if position not in after or after[position]['owner'] != player_id:
+            raise BoardError('player {} does not own property {}'.format(
+                player_id, position))
+    for position, new_level in levels.items():
+        if position not in GROUP_OF:
+            raise BoardError('property {} cannot be built on'.format(
+                position))
+        if not 0 <= new_level <= HOTEL:
+            raise BoardError('{} is not a building level'.format(new_level))
+        after[position]['level'] = new_level
+    for position, mortgaged in mortgages.items():
+        after[position]['mortgaged'] = bool(mortgaged)
+
+    groups = set(GROUP_OF[position] for position in set(levels) |
+                 set(mortgages) if position in GROUP_OF)
+    for group in sorted(groups):
+        check_group(after, player_id, group)
+
+    changes = {}
+    delta = 0
+    for position in sorted(set(levels) | set(mortgages)):
+        old, new = properties[position], after[position]
+        if (old['level'], old['mortgaged']) == (new['level'],
+                                                new['mortgaged']):
+            continue
+        delta += change_cost(old, new)
+        changes[position] = {'level': new['level'],
+                             'mortgaged': new['mortgaged']}
+    return changes, delta
+
+
+def asset_changes(properties, changes):
+    """Return the change in the value of a player's assets (see
+    backend.standings.asset_value()) made by some changes.
+
+    >>> properties = {1: {'level': 0, 'mortgaged': False, 'price': 60,
+    ...                   'house_price': 50},
+    ...               5: {'level': 0, 'mortgaged': False, 'price': 200,
+    ...                   'house_price': 0}}
+    >>> asset_changes(properties, {1: {'level': 2, 'mortgaged': False},
+    ...                            5: {'level': 0, 'mortgaged': True}})
+    0
+    """
+    total = 0
+    for position, change in changes.items():
+        prop = properties[position]
+        total += (backend.standings.asset_value(
+            prop['price'], prop['house_price'], change['level'],
+            change['mortgaged']) - backend.standings.asset_value(
+                prop['price'], prop['house_price'], prop['level'],
+                prop['mortgaged']))
+    return total
+
+
+def read_properties(cursor, game_id):
+    """Read all of a game's properties, with their prices.
+
+    Returns:
+        A dictionary of properties by position, in the form plan_changes()
+        takes.
+    """
+    cursor.execute('SELECT `properties`.*, '
+                   '`property_values`.`purchase_price`, '
+                   '`property_values`.`house_price` '
+                   'FROM `properties` INNER JOIN `property_values` '
+                   'ON `properties`.`property_position` = '
+                   '`property_values`.`property_position` '
+                   'WHERE `properties`.`game_id` = %s;', (game_id,))
+    return {row['property_position']: {
+        'owner': row['player_id'] if row['state'] == 'owned' else None,
+        'level': level(row['house_count'], row['hotel_count']),
+        'mortgaged': row['mortgaged'] == 'mortgaged',
+        'price': row['purchase_price'],
+        'house_price': row['house_price'],
+    } for row in cursor.fetchall()}
+
+
+def apply_changes(game_id, player_id, levels=None, mortgages=None):
+    """Build, sell and mortgage any number of a player's properties at once.
+
+    Arguments:
+        game_id: The id of the game.
+        player_id: The id of the player.
+        levels: A dictionary mapping positions to the building level they
+            should have.
+        mortgages: A dictionary mapping positions to whether they should be
+            mortgaged.
+
+    Returns:
+        (dict, int): the changed properties, as returned by plan_changes(),
+            and the player's new balance.
+
+    Raises:
+        BoardError: if the changes break the rules, the player can't afford
+            them, or the properties changed while they were being made;
+            nothing is written.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        conn.begin()
+        with conn.cursor() as cursor:
+            properties = read_properties(cursor, game_id)
+            cursor.execute('SELECT `balance` FROM `players` '
+                           'WHERE `id` = %s;', (player_id,))
+            balance = cursor.fetchone()['balance']
+            changes, delta = plan_changes(properties, player_id, levels,
+                                          mortgages)
+            if balance + delta < 0:
+                raise BoardError('player {} cannot afford {}'.format(
+                    player_id, -delta))
+            if changes:
+                # Only matches properties that haven't changed since they
+                # were read.
+                updated = cursor.executemany(
+                    'UPDATE `properties` '
+                    'SET `house_count` = %s, `hotel_count` = %s, '
+                    '`mortgaged` = %s '
+                    'WHERE `game_id` = %s AND `property_position` = %s '
+                    'AND `player_id` = %s AND `house_count` = %s '
+                    'AND `hotel_count` = %s AND `mortgaged` = %s;',
+                    [buildings(change['level']) +
+                     ('mortgaged' if change['mortgaged'] else 'unmortgaged',
+                      game_id, position, player_id) +
+                     buildings(properties[position]['level']) +
+                     ('mortgaged' if properties[position]['mortgaged']
+                      else 'unmortgaged',)
+                     for position, change in sorted(changes.items())])
+                if updated != len(changes):
+                    raise BoardError('the properties changed, try again')
+                cursor.execute('UPDATE `players` '
+                               'SET `balance` = `balance` + %s '
+                               'WHERE `id` = %s;', (delta, player_id))
+                backend.standings.adjust(cursor, game_id, {player_id: (
+                    delta, asset_changes(properties, changes))})
+                backend.game.touch_game(cursor, game_id)
+        conn.commit()
+    finally:
+        conn.close()
+    return changes, balance + delta
+
+
+def read_positions(changes):
+    """Return a dictionary from a json request with positions as its keys
+    (which json makes strings) keyed by int instead.
+
+    >>> read_positions({'1': 5, '3': 4})
+    {1: 5, 3: 4}
+    >>> read_positions(None)
+    {}
+    """
+    return {int(position): value
+            for position, value in (changes or {}).items()}
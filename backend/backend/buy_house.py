@@ -4,13 +4,16 @@ import sys
 import json
 import cgitb
 
+import backend.board
 from backend.player import Player
 from backend.properties import Property, get_position_by_name
 from backend.game import get_games
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('buy_house')
 def add_house(source=sys.stdin, output=sys.stdout):
     """Adds a house to a property.
     """
@@ -40,3 +43,25 @@ def add_house(source=sys.stdin, output=sys.stdout):
                 player.balance -= prop.house_price
 
     json.dump({"house_number": houses, "property_position": position}, output)
+
+
+@entry_point('build_houses')
+def build_houses(source=sys.stdin, output=sys.stdout):
+    """Builds or sells any number of houses and hotels at once.
+
+    The request has the player_id, the game_id and ``levels``, mapping the
+    positions to change to the number of houses they should have (5 being
+    a hotel). Everything is checked against the building rules (see
+    backend.board) and written together, or not at all. Returns the
+    changed properties and the player's new balance, or an error.
+    """
+    output.write('Content-Type: application/json\n\n')
+    request = json.load(source)
+    try:
+        changes, balance = backend.board.apply_changes(
+            request['game_id'], request['player_id'],
+            levels=backend.board.read_positions(request.get('levels')))
+    except backend.board.BoardError as error:
+        json.dump({'error': str(error)}, output)
+        return
+    json.dump({'properties': changes, 'balance': balance}, output)
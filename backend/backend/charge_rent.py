@@ -5,11 +5,13 @@
 import cgitb
 from backend.player import Player
 from backend.game import get_games
-from backend.properties import Property
+import backend.rent
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('charge_rent')
 def charge_rent(player_id):
     """Entry point for a player to be charged
        rent and property owner gains rent amount
@@ -25,15 +27,16 @@ def charge_rent(player_id):
             if player.username in games[game]:
                 game_id = game
                 break
+        dice = sum(player.rolls[-1]) if player.rolls else 0
 
-        # Accesses owner and rent of property; if the games's
-        # current turn's player doesn't own it, charge the player
-        # and increase the property owner's balance
-        with Property(position, game_id) as property_:
-            owner_id = property_.owner
-            rent = property_.rent
-
+        # Works out the owner and rent of the property from the game's
+        # ownership, read once; if the games's current turn's player
+        # doesn't own it, charge the player and increase the property
+        # owner's balance
+        engine = backend.rent.load_engine(game_id)
+        owner_id = engine.owner(position)
+        if owner_id is not None and owner_id != player_id:
+            rent = engine.rent(position, dice)
             with Player(owner_id) as owner:
-                if owner.uid != player_id:
-                    player.balance -= rent
-                    owner.balance += rent
+                player.balance -= rent
+                owner.balance += rent
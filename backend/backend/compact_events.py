@@ -0,0 +1,231 @@
+"""A compact encoding of a game's events, for the clients that ask for it.
+
+The events of backend.events.GameEvents (format 1) carry names alongside
+ids (``propertyOwnerChanges`` sends the property's name and both owners'
+names with every change), and fields the client can work out for itself
+(the change in a balance, the square a player moved from). Each kind of
+change is also an event of its own.
+
+A client that opens the stream with ``format=2`` is sent, instead:
+
+dictionary
+    ``{"format": 2, "players": {"<id>": "<username>", …},
+    "properties": {"<position>": "<name>", …}}``: the names behind the ids,
+    sent before the first delta (the properties only then) and again, with
+    just the new players, when someone joins. A client that started from
+    the game_snapshot page already has the names, and is only sent players
+    who join.
+delta
+    Everything that changed in a batch, as one event with the game's
+    version as its id, holding only the keys that changed, each a flat
+    list of numbers:
+
+    - ``t``: the id of the player whose turn it is.
+    - ``b``: ``[<id>, <balance>, …]``.
+    - ``m``: ``[<id>, <square>, …]``.
+    - ``j``: ``[<id>, 1 if in jail else 0, …]``.
+    - ``p``: ``[<square>, <owner id, or 0>, <level>, <1 if mortgaged else
+      0>, …]``, for each property whose owner, buildings (0 to 4 houses, 5
+      for a hotel) or mortgage changed.
+    - ``l``: ``[<id>, …]``, the players who have left.
+    - ``s``: the game's state, and ``w``, the id of the winner (or null),
+      once it has finished.
+
+Any other value of ``format`` gets format 1, so old clients are unaffected.
+"""
+
+import backend.bitboard
+import backend.events
+
+VERBOSE, COMPACT = 1, 2
+
+FORMATS = (VERBOSE, COMPACT)
+
+
+def negotiate(value):
+    """Return the format of events to send for the format a client asked
+    for.
+
+    >>> negotiate('2'), negotiate(None), negotiate('9'), negotiate('x')
+    (2, 1, 1, 1)
+    """
+    try:
+        requested = int(value)
+    except (TypeError, ValueError):
+        return VERBOSE
+    return requested if requested in FORMATS else VERBOSE
+
+
+def make_events(event_format):
+    """Return the object that works out a client's events in a format."""
+    if event_format == COMPACT:
+        return CompactEvents()
+    return backend.events.GameEvents()
+
+
+def pairs(old, new):
+    """Return the entries of new that differ from old, as a flat list of
+    keys and values.
+
+    >>> pairs({7: 10, 8: 20}, {7: 10, 8: 25, 9: 0})
+    [8, 25, 9, 0]
+    """
+    result = []
+    for key in sorted(new):
+        if old.get(key) != new[key]:
+            result.extend((key, new[key]))
+    return result
+
+
+class CompactEvents(object):  # pylint: disable=too-many-instance-attributes
+    """What a client has been sent about a game, in the compact format.
+
+    It has the same methods as backend.events.GameEvents.
+
+    >>> import io
+    >>> events = CompactEvents()
+    >>> snapshot = {'version': 4, 'state': 'playing', 'current_turn': 0,
+    ...             'players': [{'id': 7, 'username': 'Alex',
+    ...                          'jail_state': 'not_in_jail',
+    ...                          'board_position': 0, 'balance': 1500,
+    ...                          'turn_position': 0}],
+    ...             'properties': [{'position': 1, 'name': 'Old Kent Road',
+    ...                             'owner': None, 'mortgaged': False,
+    ...                             'houses': 0, 'hotels': 0}]}
+    >>> output = io.StringIO()
+    >>> events.update(output, snapshot)
+    >>> print(output.getvalue().strip())
+    id: 4
+    event: dictionary
+    data: {"format":2,"players":{"7":"Alex"},\
+"properties":{"1":"Old Kent Road"}}
+    <BLANKLINE>
+    event: delta
+    data: {"b":[7,1500],"j":[7,0],"m":[7,0],"s":"playing","t":7}
+    >>> snapshot['players'][0].update(balance=1440, board_position=1)
+    >>> snapshot['properties'][0]['owner'] = 7
+    >>> snapshot['version'] = 5
+    >>> output = io.StringIO()
+    >>> events.update(output, snapshot)
+    >>> print(output.getvalue().strip())
+    id: 5
+    event: delta
+    data: {"b":[7,1440],"m":[7,1],"p":[1,7,0,0]}
+
+    A version that changes nothing the client is sent sends nothing at all:
+
+    >>> snapshot['version'] = 6
+    >>> output = io.StringIO()
+    >>> events.update(output, snapshot)
+    >>> output.getvalue()
+    ''
+    """
+    def __init__(self):
+        self.version = None
+        self.board = None
+        self.last_game_state = None
+        self.turn = None
+        self.players = {}
+        self.balances = {}
+        self.positions = {}
+        self.jailed = {}
+        # Whether the client has the names of the properties.
+        self.has_properties = False
+
+    @property
+    def finished(self):
+        """True once the game has finished, or everyone has left it."""
+        return self.last_game_state == 'finished' or (
+            self.version is not None and not self.players)
+
+    def _read(self, snapshot):
+        """Return the details of a snapshot that events are sent about."""
+        details = {'players': {}, 'balances': {}, 'positions': {},
+                   'jailed': {}, 'turn': None}
+        for player in snapshot['players']:
+            uid = player['id']
+            details['players'][uid] = player['username']
+            details['balances'][uid] = player['balance']
+            details['positions'][uid] = player['board_position']
+            details['jailed'][uid] = int(player['jail_state'] == 'in_jail')
+            if player['turn_position'] == snapshot['current_turn']:
+                details['turn'] = uid
+        details['board'] = backend.bitboard.Bitboard.from_properties(
+            snapshot['properties'])
+        return details
+
+    def _keep(self, snapshot, details):
+        self.version = snapshot['version']
+        self.last_game_state = snapshot['state']
+        self.board = details['board']
+        self.turn = details['turn']
+        self.players = details['players']
+        self.balances = details['balances']
+        self.positions = details['positions']
+        self.jailed = details['jailed']
+
+    def seed(self, snapshot):
+        """Record that the client already has a snapshot of the game."""
+        self._keep(snapshot, self._read(snapshot))
+        self.has_properties = True
+
+    def _dictionary(self, snapshot, details):
+        """Return the names the client hasn't been sent yet."""
+        dictionary = {}
+        if not self.has_properties:
+            dictionary['properties'] = {prop['position']: prop['name']
+                                        for prop in snapshot['properties']}
+            self.has_properties = True
+        joined = {uid: name for uid, name in details['players'].items()
+                  if self.players.get(uid) != name}
+        if joined:
+            dictionary['players'] = joined
+        if dictionary:
+            dictionary['format'] = COMPACT
+        return dictionary
+
+    def _delta(self, snapshot, details):
+        """Return everything that has changed since the client was last
+        sent the game."""
+        delta = {}
+        if details['turn'] != self.turn and details['turn'] is not None:
+            delta['t'] = details['turn']
+        for key, field in (('b', 'balances'), ('m', 'positions'),
+                           ('j', 'jailed')):
+            changes = pairs(getattr(self, field), details[field])
+            if changes:
+                delta[key] = changes
+        board = details['board']
+        changed = board.changed(self.board or backend.bitboard.Bitboard())
+        if changed:
+            delta['p'] = []
+            for position in backend.bitboard.positions(changed):
+                delta['p'].extend((position, board.owner(position) or 0,
+                                   board.level(position),
+                                   int(board.is_mortgaged(position))))
+        left = sorted(set(self.players) - set(details['players']))
+        if left:
+            delta['l'] = left
+        if snapshot['state'] != self.last_game_state:
+            delta['s'] = snapshot['state']
+            if snapshot['state'] == 'finished':
+                players = snapshot['players']
+                delta['w'] = players[0]['id'] if players else None
+        return delta
+
+    def update(self, output_stream, snapshot):
+        """Send the events that bring the client up to date with a snapshot,
+        as one batch with the snapshot's version as its id, if there are
+        any."""
+        details = self._read(snapshot)
+        dictionary = self._dictionary(snapshot, details)
+        delta = self._delta(snapshot, details)
+        if dictionary or delta:
+            output_stream.write('id: {}\n'.format(snapshot['version']))
+        if dictionary:
+            backend.events.output_event(output_stream, 'dictionary',
+                                        dictionary, compact=True)
+        if delta:
+            backend.events.output_event(output_stream, 'delta', delta,
+                                        compact=True)
+        self._keep(snapshot, details)
@@ -0,0 +1,156 @@
+"""Conditional GET support for the read-only pages.
+
+Each of these pages has a version that changes whenever its response would
+(the game's version, or the lobby's). The response carries an ``ETag`` made
+from it and a ``Last-Modified`` date, and a request whose ``If-None-Match``
+names the current ETag is answered with ``304 Not Modified`` after looking
+up nothing but the version.
+
+Responses can also be kept in a small in-process cache, by setting
+``MONOPOLY_RESPONSE_CACHE`` to the number to keep. Entries are keyed by
+their ETag, so a write can never make one stale; writes also drop the
+responses they replace, so that old versions don't take up room. Every
+write to a game drops each of its pages (invalidate_game(), called once the
+write is committed by backend.game.changed_after_commit()), and every
+change to the lobby drops the game list. This only helps processes that
+serve more than one request, as each CGI request is a process of its own.
+"""
+
+import collections
+import email.utils
+import os
+
+import backend.config
+
+_CACHE = collections.OrderedDict()
+
+# The kinds of response made for each game, all of which change with its
+# version.
+GAME_KINDS = ('game', 'players', 'snapshot', 'standings')
+
+
+def make_etag(kind, key, version):
+    """Return the ETag of a response.
+
+    >>> make_etag('game', 12, 4)
+    '"game-12-4"'
+    """
+    return '"{}-{}-{}"'.format(kind, key, version)
+
+
+def http_date(timestamp):
+    """Format a unix time for an HTTP header.
+
+    >>> http_date(0)
+    'Thu, 01 Jan 1970 00:00:00 GMT'
+    """
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def not_modified(etag, environ=None):
+    """Return True if the client already has the current response.
+
+    >>> not_modified('"a-1-2"', {'HTTP_IF_NONE_MATCH': '"a-1-1", "a-1-2"'})
+    True
+    >>> not_modified('"a-1-2"', {'HTTP_IF_NONE_MATCH': 'W/"a-1-2"'})
+    True
+    >>> not_modified('"a-1-2"', {'HTTP_IF_NONE_MATCH': '"a-1-1"'})
+    False
+    >>> not_modified('"a-1-2"', {})
+    False
+    """
+    environ = os.environ if environ is None else environ
+    header = environ.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in header.split(',')]
+    return etag in [tag[2:] if tag.startswith('W/') else tag
+                    for tag in tags]
+
+
+def cache_size():
+    """Return the number of responses to cache, or 0 if disabled."""
+    return backend.config.get_int('RESPONSE_CACHE', 0)
+
+
+def cached(etag, build):
+    """Return the response body with an ETag, building it if it isn't
+    cached.
+
+    Arguments:
+        etag: The ETag of the response.
+        build: A function returning the response body.
+    """
+    size = cache_size()
+    if size <= 0:
+        return build()
+    if etag in _CACHE:
+        _CACHE.move_to_end(etag)
+        return _CACHE[etag]
+    body = build()
+    _CACHE[etag] = body
+    while len(_CACHE) > size:
+        _CACHE.popitem(last=False)
+    return body
+
+
+def invalidate(kind, key):
+    """Drop the cached responses for something that has just been written.
+
+    >>> _CACHE['"game-1-1"'] = _CACHE['"game-12-1"'] = 'x'
+    >>> invalidate('game', 1)
+    >>> list(_CACHE)
+    ['"game-12-1"']
+    >>> _CACHE.clear()
+    """
+    prefix = '"{}-{}-'.format(kind, key)
+    for etag in [etag for etag in _CACHE if etag.startswith(prefix)]:
+        del _CACHE[etag]
+
+
+def invalidate_game(game_id):
+    """Drop every cached response about a game that has been written to.
+
+    >>> _CACHE['"snapshot-1-1"'] = _CACHE['"players-1-1"'] = 'x'
+    >>> _CACHE['"lobby-0-1"'] = 'x'
+    >>> invalidate_game(1)
+    >>> list(_CACHE)
+    ['"lobby-0-1"']
+    >>> _CACHE.clear()
+    """
+    for kind in GAME_KINDS:
+        invalidate(kind, game_id)
+
+
+def respond(output, etag, last_modified, build):
+    """Write a json response, or 304 Not Modified if the client has it.
+
+    Arguments:
+        output: The stream to write the response to.
+        etag: The ETag of the current response.
+        last_modified: The unix time the response last changed.
+        build: A function returning the response body as a string; only
+            called if the body is needed.
+
+    >>> import io
+    >>> output = io.StringIO()
+    >>> os.environ['HTTP_IF_NONE_MATCH'] = '"game-1-3"'
+    >>> respond(output, '"game-1-3"', 0, lambda: '{}')
+    >>> print(output.getvalue(), end='')
+    Status: 304 Not Modified
+    ETag: "game-1-3"
+    <BLANKLINE>
+    >>> del os.environ['HTTP_IF_NONE_MATCH']
+    """
+    if not_modified(etag):
+        output.write('Status: 304 Not Modified\n')
+        output.write('ETag: {}\n\n'.format(etag))
+        return
+    body = cached(etag, build)
+    output.write('Content-Type: application/json\n')
+    output.write('Cache-Control: no-cache\n')
+    output.write('ETag: {}\n'.format(etag))
+    output.write('Last-Modified: {}\n\n'.format(http_date(last_modified)))
+    output.write(body)
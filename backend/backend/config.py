@@ -0,0 +1,58 @@
+"""Runtime configuration for the backend.
+
+Every page runs as a separate CGI process, so configuration is read from
+environment variables, which Apache passes on to the scripts (see the
+``SetEnv`` lines in ``apache2/conf-available/serve-cgi-bin.conf``). Every
+variable is prefixed with ``MONOPOLY_``.
+"""
+
+import os
+
+PREFIX = 'MONOPOLY_'
+
+
+def get(name, default=None):
+    """Return the value of a configuration variable as a string.
+
+    Arguments:
+        name: The name of the variable, without the MONOPOLY_ prefix.
+        default: The value to return if the variable isn't set.
+
+    >>> import os
+    >>> os.environ['MONOPOLY_EXAMPLE'] = 'on'
+    >>> get('EXAMPLE')
+    'on'
+    >>> get('NOT_SET', 'default')
+    'default'
+    >>> del os.environ['MONOPOLY_EXAMPLE']
+    """
+    value = os.environ.get(PREFIX + name)
+    if value is None or value == '':
+        return default
+    return value
+
+
+def get_int(name, default=0):
+    """Return the value of a configuration variable as an int.
+
+    >>> import os
+    >>> os.environ['MONOPOLY_EXAMPLE'] = '12'
+    >>> get_int('EXAMPLE')
+    12
+    >>> get_int('NOT_SET', 3)
+    3
+    >>> del os.environ['MONOPOLY_EXAMPLE']
+    """
+    return int(get(name, default))
+
+
+def get_float(name, default=0.0):
+    """Return the value of a configuration variable as a float.
+
+    >>> import os
+    >>> os.environ['MONOPOLY_EXAMPLE'] = '0.5'
+    >>> get_float('EXAMPLE')
+    0.5
+    >>> del os.environ['MONOPOLY_EXAMPLE']
+    """
+    return float(get(name, default))
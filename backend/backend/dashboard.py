@@ -0,0 +1,232 @@
+"""A live feed of every active game, for the people running the server.
+
+``dashboard_event_source`` streams ``dashboard`` events, each holding the
+games that have changed since the last one. Rather than following each game
+like the players' stream does, the stream finds every game changed since its
+last tick with one query on the index of ``games.updated_at`` (which every
+write to a game bumps, see backend.game.touch_game()), so a tick costs the
+same however many games there are, and only the games that changed are
+sent.
+
+Each game is sent as a row of COLUMNS: its id, state, current turn, number
+of players, the unix time of its last change, and how many changes a second
+it has had since the last tick. Every RESYNC_INTERVAL seconds the stream
+reads all the waiting and playing games instead, to drop games that have
+gone (e.g. been archived) without a change being seen.
+
+When ``MONOPOLY_DASHBOARD_TOKEN`` is set, the stream is refused unless it's
+asked for with ``?token=<token>``.
+"""
+
+import hmac
+import sys
+import time
+import cgitb
+
+import backend.config
+import backend.scheduler
+import backend.storage
+from backend.entry_point import entry_point
+from backend.events import output_event
+from backend.lobby_events import request_fields
+from backend.streams import CHANGED, IDLE, run_stream
+
+cgitb.enable()
+
+COLUMNS = ('id', 'state', 'current_turn', 'players', 'updated_at', 'rate')
+
+ACTIVE_STATES = ('waiting', 'playing')
+
+# How often the stream checks for changes, in seconds.
+POLL_INTERVAL = 1
+
+# How often the stream reads every active game, in seconds.
+RESYNC_INTERVAL = 60
+
+
+def authorised(fields):
+    """Return True if a request may see the dashboard.
+
+    >>> import os
+    >>> os.environ['MONOPOLY_DASHBOARD_TOKEN'] = 'secret'
+    >>> authorised({'token': 'secret'}), authorised({'token': 'guess'})
+    (True, False)
+    >>> del os.environ['MONOPOLY_DASHBOARD_TOKEN']
+    >>> authorised({})
+    True
+    """
+    token = backend.config.get('DASHBOARD_TOKEN')
+    if token is None:
+        return True
+    return hmac.compare_digest(fields.get('token', '').encode(),
+                               token.encode())
+
+
+def read_games(cursor, since=None):
+    """Read the games changed at or after a unix time, or every active game
+    if since is None.
+
+    Returns:
+        A list of dictionaries, each with a game's 'id', 'state',
+        'current_turn', 'version', 'updated_at' and number of 'players'.
+    """
+    query = ('SELECT `id`, `state`, `current_turn`, `version`, '
+             '`updated_at`, (SELECT COUNT(*) FROM `playing_in` '
+             'WHERE `playing_in`.`game_id` = `games`.`id`) AS `players` '
+             'FROM `games` ')
+    if since is None:
+        cursor.execute(query + 'WHERE `state` IN (%s, %s);', ACTIVE_STATES)
+    else:
+        cursor.execute(query + 'WHERE `updated_at` >= %s;', (since,))
+    return cursor.fetchall()
+
+
+class Dashboard(object):
+    """The active games a dashboard client has been sent.
+
+    >>> dashboard = Dashboard()
+    >>> def game(uid, version, state='playing', players=2):
+    ...     return {'id': uid, 'state': state, 'current_turn': 0,
+    ...             'version': version, 'updated_at': 100,
+    ...             'players': players}
+    >>> frame = dashboard.apply([game(1, 3), game(2, 5, 'waiting')], 100.0,
+    ...                         full=True)
+    >>> frame['columns'] == list(COLUMNS), frame['games']
+    (True, [[1, 'playing', 0, 2, 100, 0.0], [2, 'waiting', 0, 2, 100, 0.0]])
+    >>> frame['totals'] == {'games': 2, 'playing': 1, 'waiting': 1,
+    ...                     'players': 4, 'rate': 0.0}
+    True
+
+    Games that haven't changed aren't sent again, and finished ones are
+    removed:
+
+    >>> frame = dashboard.apply([game(1, 7), game(2, 5, 'waiting')], 102.0)
+    >>> frame['games'], frame['removed']
+    ([[1, 'playing', 0, 2, 100, 2.0]], [])
+    >>> dashboard.apply([], 103.0)['games']   # game 1 has gone quiet
+    [[1, 'playing', 0, 2, 100, 0.0]]
+    >>> dashboard.apply([], 104.0) is None
+    True
+    >>> dashboard.apply([game(1, 8, 'finished')], 105.0)['removed']
+    [1]
+    """
+    def __init__(self):
+        # The last row sent for each game, by id.
+        self.games = {}
+        self.since = None
+        self.last_tick = None
+        self.last_resync = None
+
+    def apply(self, rows, now, full=False):
+        """Bring the games up to date with some rows read by read_games().
+
+        Arguments:
+            rows: The rows read.
+            now: The time they were read at.
+            full: True if the rows are every active game, so that any
+                others should be removed.
+
+        Returns:
+            The frame to send, or None if nothing has changed.
+        """
+        elapsed = now - self.last_tick if self.last_tick is not None else 0
+        changed = {}
+        removed = []
+        seen = set()
+        for row in rows:
+            uid = row['id']
+            seen.add(uid)
+            old = self.games.get(uid)
+            if row['state'] not in ACTIVE_STATES:
+                if old is not None:
+                    del self.games[uid]
+                    removed.append(uid)
+                continue
+            if old is not None and old['version'] == row['version']:
+                continue
+            rate = 0.0
+            if old is not None and elapsed > 0:
+                rate = round((row['version'] - old['version']) / elapsed, 2)
+            self.games[uid] = dict(row, rate=rate)
+            changed[uid] = self.games[uid]
+        for uid, game in list(self.games.items()):
+            if full and uid not in seen:
+                del self.games[uid]
+                removed.append(uid)
+            elif uid not in changed and game['rate']:
+                # It's had no changes since the last tick.
+                game['rate'] = 0.0
+                changed[uid] = game
+        self.last_tick = now
+        if not (changed or removed or full):
+            return None
+        frame = {
+            'time': int(now),
+            'games': [[changed[uid][column] for column in COLUMNS]
+                      for uid in sorted(changed)],
+            'removed': sorted(removed),
+            'totals': self.totals(),
+        }
+        if full:
+            frame['columns'] = list(COLUMNS)
+        return frame
+
+    def totals(self):
+        """Return the totals across every active game."""
+        totals = {'games': len(self.games), 'players': 0, 'rate': 0.0}
+        totals.update((state, 0) for state in ACTIVE_STATES)
+        for game in self.games.values():
+            totals[game['state']] += 1
+            totals['players'] += game['players']
+            totals['rate'] += game['rate']
+        totals['rate'] = round(totals['rate'], 2)
+        return totals
+
+    def poll(self, now=None):
+        """Read the games that have changed since the last poll.
+
+        Returns:
+            The frame to send, or None if nothing has changed.
+        """
+        now = time.time() if now is None else now
+        full = (self.last_resync is None or
+                now - self.last_resync >= RESYNC_INTERVAL)
+        conn = backend.storage.make_connection()
+        try:
+            with conn.cursor() as cursor:
+                # A game changed in the same second as the last poll, but
+                # after it, is only found by reading that second again.
+                rows = read_games(cursor, None if full else self.since)
+        finally:
+            conn.close()
+        self.since = int(now)
+        if full:
+            self.last_resync = now
+        return self.apply(rows, now, full)
+
+
+@entry_point('dashboard_event_source')
+def start_dashboard_stream(output_stream=sys.stdout):
+    """Stream the changes to every active game as ``dashboard`` events."""
+    if not authorised(request_fields()):
+        output_stream.write('Status: 403 Forbidden\n')
+        output_stream.write('Content-Type: text/plain\n\n')
+        output_stream.write('A valid token is needed\n')
+        return
+    output_stream.write('Content-Type: text/event-stream\n')
+    output_stream.write('Cache-Control: no-cache\n')
+    output_stream.write('\n')
+
+    dashboard = Dashboard()
+
+    def poll(output_stream):
+        """Send the games that have changed."""
+        frame = dashboard.poll()
+        if frame is None:
+            return IDLE
+        output_event(output_stream, 'dashboard', frame)
+        return CHANGED
+
+    # Operators expect the dashboard to keep up, so it doesn't back off.
+    run_stream(output_stream, poll, backend.scheduler.Schedule(
+        'dashboard', interval=POLL_INTERVAL, max_interval=POLL_INTERVAL))
@@ -0,0 +1,36 @@
+"""The decorator applied to every page handler listed in pages.py.
+
+This is the single place where cross-cutting behaviour (profiling and
+metrics) is attached to the handlers. It's decided once, when the handler's
+module is imported, so anything that's switched off adds no work to a
+request::
+
+    @entry_point('roll_dice')
+    def player_roll_dice(source=sys.stdin, output=sys.stdout):
+        ...
+"""
+
+import backend.metrics
+import backend.profiling
+
+
+def entry_point(page):
+    """Mark a function as the handler for a page.
+
+    Arguments:
+        page: The name of the page, as it appears in pages.py.
+
+    >>> def handler():
+    ...     pass
+    >>> entry_point('example')(handler) is handler
+    True
+    """
+    def decorate(handler):
+        """Attach whichever hooks are enabled to the handler."""
+        rate = backend.profiling.sample_rate()
+        if rate > 0:
+            handler = backend.profiling.profiled(page, handler, rate)
+        if backend.metrics.enabled():
+            handler = backend.metrics.timed(page, handler)
+        return handler
+    return decorate
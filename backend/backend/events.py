@@ -1,6 +1,7 @@
 """
 Handles the generation of Server-Sent Events which notify clients of state
-changes.
+changes. The stream that sends them to a game's players is
+backend.game_stream.
 
 Steps for adding more SSE on the SERVER SIDE:
     See README.rst in "team-software-project/backend"
@@ -9,122 +10,140 @@ Steps for adding more SSE listeners on the CLIENT SIDE:
     See README.md in "team-software-project/frontend"
 
 """
-import sys
-import time
 import json
-from cgi import FieldStorage
-import cgitb
-from backend.game import Game
-from backend.player import Player
-from backend.properties import owned_property_positions, Property
+import backend.bitboard
 import backend.properties
-
-cgitb.enable()
-
-
-def start_sse_stream(output_stream=sys.stdout):
-    """Generate a stream of server-sent events according to state changes.
-
-    This function is activated by making a request to the JavaScript
-    function "initialiseEventSource()" which is located in "sse.js".
-    This operation is performed by the JavaScript waitingGame function,
-    and hence, other JavaScript code need only "get" a reference to
-    the EventSource object (by calling "getEventSource()" from
-    "sse.js").
-
-    Reads in the game id, and repeatedly does each of the following:
-        1) Check whose turn it is.
-        2) Check if any new players have joined the waiting game lobby.
-        3) Check if any of the players' balances have changed in a game.
-        4) Check if any of the players' positions have changed in a game.
-        5) Check if the specified game's status has changed to "playing".
-
+import backend.metrics
+
+
+class GameEvents(object):  # pylint: disable=too-many-instance-attributes
+    """What a client has been sent about a game, so that the events that
+    bring it up to date with a newer snapshot can be worked out.
+
+    >>> import io
+    >>> events = GameEvents()
+    >>> snapshot = {'version': 4, 'state': 'waiting', 'current_turn': 0,
+    ...             'players': [{'id': 7, 'username': 'Alex',
+    ...                          'jail_state': 'not_in_jail',
+    ...                          'board_position': 0, 'balance': 1500,
+    ...                          'turn_position': 0}],
+    ...             'properties': []}
+    >>> events.seed(snapshot)
+    >>> snapshot['players'][0]['balance'] = 1400
+    >>> snapshot['version'] = 5
+    >>> output = io.StringIO()
+    >>> events.update(output, snapshot)
+    >>> print(output.getvalue().strip())
+    id: 5
+    event: playerBalance
+    data: [[7, 1400, -100]]
+    >>> events.finished
+    False
+    >>> snapshot.update(version=6, state='playing')
+    >>> events.seed(snapshot)
+    >>> snapshot.update(version=7, state='finished')
+    >>> output = io.StringIO()
+    >>> events.update(output, snapshot)
+    >>> 'event: gameEnd' in output.getvalue(), events.finished
+    (True, True)
     """
-    # The following headers are compulsory for SSE.
-    output_stream.write('Content-Type: text/event-stream\n')
-    output_stream.write('Cache-Control: no-cache\n')
-    output_stream.write('\n')
-
-    # Read in the game id from standard input (aka. FieldStorage) and create
-    # an empty dictionary of current players, positions, balances, new
-    # players, new positions, new balances and turn orders. All the "new"
-    # dicts will be populated with the most up to date data from the
-    # **database**, while non-"new" dicts will be populated only after a
-    # comparison between it and the corresponding "new" dict has been made.
-    input_data = FieldStorage()
-    game_id = input_data.getfirst('game')
-    last_game_state = "waiting"
-    players = {}
-    positions = {}
-    balances = {}
-    new_players = {}
-    new_positions = {}
-    new_balances = {}
-    turn = None
-    turn_order = {}
-    jailed_players = {}
-    new_jailed_players = {}
-    push_initial_user_details = True
-    houses = {}
-    property_ownership = {}
-
-    # These statements are executed constantly once the first request to this
-    # function is made.
-    while True:
-        # Create a Game object representing the game in the database.
-        # This can be thought of as a "pointer" to the appropriate game in the
-        # database.
-        game = Game(game_id)
-
-        # Go through each player in the game and populate the "new"
-        # dictionaries with user_id (aka. player_id) as the key, and
-        # username/position/balance/turn-order as the value.
-        # These are the latest values retrieved from the database.
-        for player in map(Player, game.players):
-            new_players[player.uid] = player.username
-            new_jailed_players[player.uid] = player.jail_state
-            new_positions[player.uid] = player.board_position
-            new_balances[player.uid] = player.balance
-            turn_order[player.uid] = player.turn_position
-
+    def __init__(self):
+        # Each of these is a dictionary by player id, or by property
+        # position, of what the client has last been sent.
+        self.version = None
+        self.board = None
+        self.last_game_state = 'waiting'
+        self.players = {}
+        self.positions = {}
+        self.balances = {}
+        self.turn = None
+        self.jailed_players = {}
+        self.push_initial_user_details = True
+        self.houses = {}
+        self.property_ownership = {}
+
+    @property
+    def finished(self):
+        """True once the game has finished, or everyone has left it."""
+        return self.last_game_state == 'finished' or (
+            self.version is not None and not self.players)
+
+    def _read(self, snapshot):
+        """Return the details of a snapshot that events are sent about."""
+        details = {'players': {}, 'jailed_players': {}, 'positions': {},
+                   'balances': {}, 'turn_order': {}}
+        for player in snapshot['players']:
+            details['players'][player['id']] = player['username']
+            details['jailed_players'][player['id']] = player['jail_state']
+            details['positions'][player['id']] = player['board_position']
+            details['balances'][player['id']] = player['balance']
+            details['turn_order'][player['id']] = player['turn_position']
+        board = backend.bitboard.Bitboard.from_properties(
+            snapshot['properties'])
+        # The properties only need comparing if the boards differ.
+        if board != self.board:
+            details['houses'] = property_houses(snapshot)
+            details['ownership'] = property_ownership_details(snapshot)
+        else:
+            details['houses'] = self.houses
+            details['ownership'] = self.property_ownership
+        self.board = board
+        self.version = snapshot['version']
+        return details
+
+    def seed(self, snapshot):
+        """Record that the client already has a snapshot of the game."""
+        details = self._read(snapshot)
+        self.turn = snapshot['current_turn']
+        self.players = details['players']
+        self.balances = details['balances']
+        self.jailed_players = details['jailed_players']
+        self.positions = details['positions']
+        self.houses = details['houses']
+        self.property_ownership = details['ownership']
+        self.last_game_state = snapshot['state']
+        self.push_initial_user_details = self.last_game_state == 'waiting'
+
+    def update(self, output_stream, snapshot):
+        """Send the events that bring the client up to date with a snapshot,
+        as one batch with the snapshot's version as its id."""
+        details = self._read(snapshot)
+        output_stream.write('id: {}\n'.format(self.version))
         # Assign the current (aka. non-new) dictionaries to the value of the
         # "new" (aka. latest) dictionaries, after calling the appropriate
         # comparison function to determine whether an event should be
         # generated.
-        turn = check_new_turn(output_stream, turn, game.current_turn,
-                              turn_order)
-        players = check_new_players(output_stream, players, new_players)
-        balances = check_new_balances(output_stream, balances, new_balances)
-        jailed_players = check_new_jailed_players(
-            output_stream, jailed_players, new_jailed_players)
-        positions = check_new_positions(output_stream, positions,
-                                        new_positions, new_jailed_players)
-        houses = check_property_houses(output_stream, game_id, houses)
-        property_ownership = check_property_ownership(
-            output_stream,
-            game_id,
-            property_ownership,
-        )
+        self.turn = check_new_turn(output_stream, self.turn,
+                                   snapshot['current_turn'],
+                                   details['turn_order'], details['players'])
+        self.players = check_new_players(output_stream, self.players,
+                                         details['players'])
+        self.balances = check_new_balances(output_stream, self.balances,
+                                           details['balances'])
+        self.jailed_players = check_new_jailed_players(
+            output_stream, self.jailed_players, details['jailed_players'])
+        self.positions = check_new_positions(output_stream, self.positions,
+                                             details['positions'],
+                                             details['jailed_players'])
+        self.houses = check_property_houses(output_stream, self.houses,
+                                            details['houses'])
+        self.property_ownership = check_property_ownership(
+            output_stream, self.property_ownership, details['ownership'])
 
         # Pushes data to update the players info table on game start
-        if push_initial_user_details and last_game_state == "playing":
-            push_initial_user_details = False
-            start_game_push(output_stream, turn_order)
+        if self.push_initial_user_details and \
+                self.last_game_state == "playing":
+            self.push_initial_user_details = False
+            start_game_push(output_stream, details['turn_order'],
+                            details['players'])
 
         # Call function to check the current state of this game.
         # A game state may be "waiting" or "playing".
-        last_game_state = check_game_playing_status(output_stream, game,
-                                                    last_game_state)
-
-        time.sleep(3)
+        self.last_game_state = check_game_playing_status(
+            output_stream, snapshot, self.last_game_state)
 
-        # Flush standard out which forcefully sends everything that might be
-        # buffered in standard out to the client. No need to worry about tech
-        # details too much, it's just standard SSE procedure!
-        output_stream.flush()
 
-
-def output_event(output_stream, event, data):
+def output_event(output_stream, event, data, compact=False):
     """Output a sse event as json with the given details.
 
     An SSE event consists of data and an optional name. The name is the
@@ -140,6 +159,7 @@ def output_event(output_stream, event, data):
         output_stream: The stream to output the sse event to.
         event: The name of the event to output.
         data: The data to be output. This will be serialised using json.dumps.
+        compact: If True, the json is written without spaces.
 
     Testing strings:
     >>> import sys
@@ -168,14 +188,22 @@ def output_event(output_stream, event, data):
     event: hello
     data: [3, 4, 5, 4]
     <BLANKLINE>
+    >>> output_event(sys.stdout, 'hello', {'a': [3, 4]}, compact=True)
+    event: hello
+    data: {"a":[3,4]}
+    <BLANKLINE>
     """
     output_stream.write(
         'event: {}\n'
         'data: {}\n'
-        '\n'.format(event, json.dumps(data, sort_keys=True)))
+        '\n'.format(event, json.dumps(
+            data, sort_keys=True,
+            separators=(',', ':') if compact else None)))
+    backend.metrics.increment('monopoly_sse_events_total', event=event)
 
 
-def check_new_turn(output_stream, old_turn, new_turn, turn_order):
+def check_new_turn(output_stream, old_turn, new_turn, turn_order,
+                   usernames):
     """Checks if the turn has changed to a different player and sends an SSE
     event if it has.
 
@@ -186,19 +214,25 @@ def check_new_turn(output_stream, old_turn, new_turn, turn_order):
             playing queue.
         turn_order: A dictionary representing mapping player ids to the
             player's position in the playing queue.
+        usernames: A dictionary mapping player ids to usernames.
 
     Returns:
         An int representing the current position of the playing queue.
 
+    >>> import sys
+    >>> check_new_turn(sys.stdout, 0, 1, {5: 0, 6: 1}, {5: 'a', 6: 'b'})
+    event: playerTurn
+    data: {"id": 6, "name": "b"}
+    <BLANKLINE>
+    1
     """
     if new_turn != old_turn:
         for uid, turn_pos in turn_order.items():
             if turn_pos == new_turn:
-                player = Player(uid)
                 output_event(
                     output_stream,
                     'playerTurn',
-                    {'name': player.username, 'id': player.uid})
+                    {'name': usernames[uid], 'id': uid})
     return new_turn
 
 
@@ -415,21 +449,21 @@ def generate_player_move_event(output_stream, old_positions, new_positions,
     output_event(output_stream, 'playerMove', data)
 
 
-def check_game_playing_status(output_stream, game, last_game_state):
+def check_game_playing_status(output_stream, snapshot, last_game_state):
     """Checks a game's state and issues events for changes.
 
     Arguments:
-        game: The game whose status is being checked.
+        snapshot: The snapshot of the game whose status is being checked.
 
     """
-    if last_game_state == "waiting" and game.state == "playing":
+    if last_game_state == "waiting" and snapshot['state'] == "playing":
         # Call function to generate appropriate event if game's status is
         # "playing".
-        generate_game_start_event(game.uid, output_stream)
-    elif last_game_state == "playing" and game.state == "finished":
-        generate_game_end_event(output_stream, game)
+        generate_game_start_event(snapshot['game_id'], output_stream)
+    elif last_game_state == "playing" and snapshot['state'] == "finished":
+        generate_game_end_event(output_stream, snapshot)
 
-    return game.state
+    return snapshot['state']
 
 
 def generate_game_start_event(game_id, output_stream):
@@ -448,29 +482,43 @@ def generate_game_start_event(game_id, output_stream):
     })
 
 
-def check_property_ownership(output_stream, game_id, old_properties):
+def property_ownership_details(snapshot):
+    """Return the ownership of a game's properties from its snapshot.
+
+    Returns:
+        A dictionary where the keys are the positions of the owned
+        properties, and the values have their 'name' and 'owner' (with the
+        owner's 'id' and 'name').
+
+    >>> property_ownership_details({
+    ...     'players': [{'id': 5, 'username': 'a'}],
+    ...     'properties': [{'position': 1, 'name': 'p1', 'owner': 5},
+    ...                    {'position': 3, 'name': 'p3', 'owner': None}]})
+    {1: {'name': 'p1', 'owner': {'id': 5, 'name': 'a'}}}
+    """
+    usernames = {player['id']: player['username']
+                 for player in snapshot['players']}
+    return {prop['position']: {
+        'name': prop['name'],
+        'owner': {
+            'id': prop['owner'],
+            'name': usernames.get(prop['owner']),
+        },
+    } for prop in snapshot['properties'] if prop['owner'] is not None}
+
+
+def check_property_ownership(output_stream, old_properties, new_properties):
     """Issue events if the ownership of any properties has changed.
 
     Arguments:
-        game_id: The id of the game the events are being issued for.
+        old_properties: The ownership data the client has.
+        new_properties: The current ownership data, from
+            property_ownership_details().
 
     Returns:
         The current property ownership data, as a dictionary where the keys
         are property positions, and the values are owner player ids.
     """
-    owners = owned_property_positions(game_id)
-    new_properties = {}
-    for positions in owners.values():
-        for position in positions:
-            with Property(position, game_id) as prop:
-                with Player(prop.owner) as player:
-                    new_properties[position] = {
-                        'name': prop.name,
-                        'owner': {
-                            'id': player.uid,
-                            'name': player.username,
-                        },
-                    }
     if old_properties != new_properties:
         generate_ownership_events(
             output_stream,
@@ -579,27 +627,33 @@ def generate_ownership_events(
     output_event(output_stream, 'propertyOwnerChanges', changes)
 
 
-def check_property_houses(output_stream, game_id, old_houses):
+def property_houses(snapshot):
+    """Return the houses and hotels on a game's owned properties from its
+    snapshot.
+
+    >>> property_houses({'properties': [
+    ...     {'position': 1, 'owner': 5, 'houses': 2, 'hotels': 0},
+    ...     {'position': 3, 'owner': None, 'houses': 0, 'hotels': 0}]})
+    {1: {'houses': 2, 'hotels': 0}}
+    """
+    return {prop['position']: {'houses': prop['houses'],
+                               'hotels': prop['hotels']}
+            for prop in snapshot['properties'] if prop['owner'] is not None}
+
+
+def check_property_houses(output_stream, old_houses, new_houses):
     """Issue events if the number of houses/hotels of any properties
      has changed.
 
     Arguments:
-        game_id: The id of the game the events are being issued for.
         old_houses: The dictionary of houses currently owned.
+        new_houses: The latest dictionary of houses, from property_houses().
 
     Returns:
         The current gouse data, as a dictionary where the keys
         are property positions, and the values are the number
         of houses/hotels.
     """
-    positions = owned_property_positions(game_id)
-    new_houses = {}
-    for pid in positions:
-        for position in positions[pid]:
-            this_property = Property(position, game_id)
-            houses = this_property.houses
-            hotels = this_property.hotels
-            new_houses[position] = {'houses': houses, 'hotels': hotels}
     if old_houses != new_houses:
         generate_house_event(
             output_stream,
@@ -743,7 +797,7 @@ def generate_player_jailed_event(
     output_event(output_stream, 'playerJailed', data)
 
 
-def start_game_push(output_stream, turn_order):
+def start_game_push(output_stream, turn_order, usernames):
     """Generates an event for to update the details table at game start.
 
     Compares two dictionaries and outputs a playerBalance server-sent event if
@@ -752,26 +806,40 @@ def start_game_push(output_stream, turn_order):
     """
     for uid, turn_pos in turn_order.items():
         if turn_pos == 0:
-            player = Player(uid)
             output_event(
                 output_stream,
                 'playerTurn',
-                {'name': player.username, 'id': player.uid})
+                {'name': usernames[uid], 'id': uid})
     generate_player_balance_event(output_stream, {},
                                   {1: 1500, 2: 1500, 3: 1500, 4: 1500})
 
 
-def generate_game_end_event(output_stream, game):
+def generate_game_end_event(output_stream, snapshot):
     """Generates a gameEnd event.
 
     Arguments:
         output_stream: The stream to which the event should be written.
-        game: The Game object to check.
+        snapshot: The snapshot of the game that has ended.
+
+    >>> import sys
+    >>> generate_game_end_event(sys.stdout, {'players': [
+    ...     {'id': 5, 'username': 'a'}]})
+    event: gameEnd
+    data: {"winner": {"id": 5, "name": "a"}}
+    <BLANKLINE>
+    >>> generate_game_end_event(sys.stdout, {'players': []})
+    event: gameEnd
+    data: {"winner": null}
+    <BLANKLINE>
     """
-    winner = Player(game.players[0])
+    if not snapshot['players']:
+        # Everyone has left.
+        output_event(output_stream, 'gameEnd', {'winner': None})
+        return
+    winner = snapshot['players'][0]
     output_event(output_stream, 'gameEnd', {
         'winner': {
-            'name': winner.username,
-            'id': winner.uid,
+            'name': winner['username'],
+            'id': winner['id'],
         },
     })
@@ -1,6 +1,9 @@
 """an example"""
 
+from backend.entry_point import entry_point
 
+
+@entry_point('example')
 def example():
     """serves an example web page
 
@@ -0,0 +1,141 @@
+"""Fault and latency injection for the storage layer.
+
+``MONOPOLY_FAULTS`` holds a json list of rules. Every rule applies either to
+opening connections (``"connect": true``) or to the statements whose text
+matches its ``pattern`` (a regular expression, matching every statement if
+left out). A matching rule sleeps for ``latency`` seconds, plus up to
+``jitter`` more, and then raises ``error`` with probability ``error_rate``::
+
+    [{"pattern": "^UPDATE `players`", "latency": 0.2, "jitter": 0.1},
+     {"pattern": "FROM `games`", "error_rate": 0.05, "error": "deadlock"},
+     {"connect": true, "error_rate": 0.01, "error": "connection"}]
+
+The errors are the ones PyMySQL raises for the real failures, whichever
+storage engine is in use, so handlers see the same exceptions they would
+from a degraded MySQL server. ``MONOPOLY_FAULTS_SEED`` makes the injected
+faults repeatable. When ``MONOPOLY_FAULTS`` isn't set nothing is injected.
+"""
+
+import json
+import random
+import re
+import time
+
+import pymysql.err
+
+import backend.config
+
+# The exceptions raised for each kind of error, as PyMySQL would raise them.
+ERRORS = {
+    'deadlock': (pymysql.err.OperationalError, 1213,
+                 'Deadlock found when trying to get lock; '
+                 'try restarting transaction'),
+    'lock_timeout': (pymysql.err.OperationalError, 1205,
+                     'Lock wait timeout exceeded; try restarting transaction'),
+    'connection': (pymysql.err.OperationalError, 2003,
+                   "Can't connect to MySQL server on 'localhost'"),
+    'lost_connection': (pymysql.err.OperationalError, 2013,
+                        'Lost connection to MySQL server during query'),
+}
+
+
+class Rule(object):
+    """A single fault injection rule.
+
+    >>> rule = Rule(pattern='^SELECT', error_rate=1, error='deadlock')
+    >>> rule.matches('UPDATE players SET balance = 1')
+    False
+    >>> rule.inject(random.Random(0))
+    Traceback (most recent call last):
+    ...
+    pymysql.err.OperationalError: (1213, 'Deadlock found when trying to \
+get lock; try restarting transaction')
+
+    Arguments:
+        pattern: A regular expression matched against each statement.
+        latency: Seconds to sleep before the statement.
+        jitter: Up to this many more seconds are added to the latency.
+        error_rate: The probability of raising an error.
+        error: The kind of error to raise; one of the keys of ERRORS.
+        connect: If True, the rule applies to opening connections instead
+            of to statements.
+    """
+    def __init__(self, pattern=None, latency=0, jitter=0, error_rate=0,
+                 error='deadlock', connect=False):
+        # pylint: disable=too-many-arguments
+        if error not in ERRORS:
+            raise ValueError('unknown error {!r}'.format(error))
+        self.pattern = re.compile(pattern) if pattern else None
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error = error
+        self.connect = connect
+
+    def matches(self, query):
+        """Return True if the rule applies to a statement."""
+        return (not self.connect and
+                (self.pattern is None or bool(self.pattern.search(query))))
+
+    def inject(self, generator):
+        """Sleep and/or raise, as the rule says.
+
+        Arguments:
+            generator: The random.Random used to draw jitter and errors.
+        """
+        delay = self.latency
+        if self.jitter:
+            delay += generator.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and generator.random() < self.error_rate:
+            exception, code, message = ERRORS[self.error]
+            raise exception(code, message)
+
+
+def parse_rules(text):
+    """Parse the rules in a MONOPOLY_FAULTS value.
+
+    >>> [rule.connect for rule in parse_rules(
+    ...     '[{"pattern": "games", "latency": 0.1}, {"connect": true}]')]
+    [False, True]
+    """
+    return [Rule(**rule) for rule in json.loads(text)]
+
+
+_STATE = []
+
+
+def _rules():
+    """Return the configured rules and random generator, parsed once."""
+    if not _STATE:
+        text = backend.config.get('FAULTS')
+        rules = parse_rules(text) if text else []
+        seed = backend.config.get('FAULTS_SEED')
+        _STATE.append((rules, random.Random(seed)))
+    return _STATE[0]
+
+
+def reset():
+    """Forget the parsed rules, so the configuration is read again."""
+    del _STATE[:]
+
+
+def before_connect():
+    """Inject any faults configured for opening a connection."""
+    rules, generator = _rules()
+    for rule in rules:
+        if rule.connect:
+            rule.inject(generator)
+
+
+def before_statement(query):
+    """Inject any faults configured for a statement.
+
+    Arguments:
+        query: The text of the statement about to be executed.
+    """
+    rules, generator = _rules()
+    for rule in rules:
+        if rule.matches(query):
+            rule.inject(generator)
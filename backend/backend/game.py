@@ -2,9 +2,19 @@
 
 from operator import itemgetter
 from itertools import groupby
+import time
 
+import backend.conditional
+import backend.lobby
+import backend.scheduler
 import backend.storage
 
+# Functions called with the cursor and the id of a game, in the transaction
+# changing it, whenever the game is created or its players change.
+# backend.standings adds rebuild() to them, which keeps each game's
+# standings in step with its players without this module importing it.
+PLAYERS_CHANGED = []
+
 
 class Game(object):  # pylint: disable=too-many-instance-attributes
     """A single game of monopoly. Refer to the Player class for how to
@@ -15,6 +25,9 @@ class Game(object):  # pylint: disable=too-many-instance-attributes
         self._players = None
         self._current_turn = None
         self._state = None
+        self._initial_turn = None
+        self._initial_state = None
+        self._initial_players = None
         self._conn = None
 
     def __enter__(self):
@@ -27,29 +40,48 @@ class Game(object):  # pylint: disable=too-many-instance-attributes
             result = cursor.fetchone()
             self._current_turn = result['current_turn']
             self._state = result['state']
+            self._initial_turn = result['current_turn']
+            self._initial_state = result['state']
             del result
             cursor.execute('SELECT `player_id` FROM `playing_in` '
                            'WHERE `game_id` = %s;',
                            (self.uid,))
             self._players = [result['player_id']
                              for result in cursor.fetchall()]
+            self._initial_players = list(self._players)
         return self
 
     def __exit__(self, *exc):
         try:
             with self._conn.cursor() as cursor:
-                cursor.execute('UPDATE `games` '
-                               'SET `current_turn` = %s, '
-                               '`state` = %s '
-                               'WHERE `id` = %s;',
-                               (self.current_turn, self.state,
-                                self.uid))
-                cursor.execute('DELETE FROM `playing_in` '
-                               'WHERE `game_id` = %s;',
-                               (self.uid))
-
-                cursor.executemany('INSERT INTO `playing_in` VALUES (%s, %s);',
-                                   ((pid, self.uid) for pid in self.players))
+                if (self._current_turn, self._state) != (
+                        self._initial_turn, self._initial_state):
+                    cursor.execute('UPDATE `games` '
+                                   'SET `current_turn` = %s, '
+                                   '`state` = %s, '
+                                   '`version` = `version` + 1, '
+                                   '`updated_at` = %s '
+                                   'WHERE `id` = %s;',
+                                   (self.current_turn, self.state,
+                                    int(time.time()), self.uid))
+                    changed_after_commit(cursor, self.uid)
+                elif self._players != self._initial_players:
+                    touch_game(cursor, self.uid)
+                if self._players != self._initial_players:
+                    cursor.execute('DELETE FROM `playing_in` '
+                                   'WHERE `game_id` = %s;',
+                                   (self.uid))
+                    cursor.executemany(
+                        'INSERT INTO `playing_in` VALUES (%s, %s);',
+                        ((pid, self.uid) for pid in self.players))
+                    players_changed(cursor, self.uid)
+
+                change = backend.lobby.lobby_change(
+                    self._initial_state, self.state,
+                    self._initial_players, self.players)
+                if change is not None:
+                    backend.lobby.record_change(cursor, self.uid, change,
+                                                self.players)
             self._conn.commit()
         finally:
             self._in_context = False
@@ -130,6 +162,77 @@ class Game(object):  # pylint: disable=too-many-instance-attributes
         self._set_property('players', players)
 
 
+def players_changed(cursor, game_id):
+    """Call each of PLAYERS_CHANGED for a game whose players have changed."""
+    for callback in PLAYERS_CHANGED:
+        callback(cursor, game_id)
+
+
+def changed_after_commit(cursor, game_id):
+    """Once the changes a cursor is making to a game have been committed,
+    wake the game's streams and drop its cached responses."""
+    backend.scheduler.hint_after_commit(
+        cursor, backend.scheduler.game_topic(game_id))
+    cursor.on_commit(lambda: backend.conditional.invalidate_game(game_id))
+
+
+def touch_game(cursor, game_id):
+    """Record that something belonging to a game has changed, by bumping its
+    version and updated_at.
+
+    Arguments:
+        cursor: The cursor of the transaction making the change.
+        game_id: The id of the game.
+    """
+    cursor.execute('UPDATE `games` SET `version` = `version` + 1, '
+                   '`updated_at` = %s WHERE `id` = %s;',
+                   (int(time.time()), game_id))
+    # Wake the game's streams, rather than leave them to their next poll.
+    changed_after_commit(cursor, game_id)
+
+
+def game_version(game_id):
+    """Return a game's version and the time it was last changed, with a
+    single lookup by primary key.
+
+    Returns:
+        (int, int): the version and the unix time, or None if there's no
+            such game.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT `version`, `updated_at` FROM `games` '
+                           'WHERE `id` = %s;', (game_id,))
+            row = cursor.fetchone()
+        return None if row is None else (row['version'], row['updated_at'])
+    finally:
+        conn.close()
+
+
+def insert_game(cursor, state='waiting'):
+    """Insert a new game, along with a row for each of its properties.
+
+    The property rows are derived from the board in ``property_values``, in
+    a single statement.
+
+    Arguments:
+        cursor: The cursor to insert the game with.
+        state: The state the game is created in.
+
+    Returns:
+        int: the game's unique id.
+    """
+    cursor.execute('INSERT INTO `games` (`state`, `updated_at`) '
+                   'VALUES (%s, %s);', (state, int(time.time())))
+    cursor.execute('SELECT LAST_INSERT_ID();')
+    game_id = cursor.fetchone()['LAST_INSERT_ID()']
+    cursor.execute('INSERT INTO `properties` (game_id, property_position) '
+                   'SELECT %s, `property_position` FROM `property_values`;',
+                   (game_id,))
+    return game_id
+
+
 def create_game(host):
     """Create a new game on the server
 
@@ -143,18 +246,11 @@ def create_game(host):
     try:
         conn.begin()
         with conn.cursor() as cursor:
-            cursor.execute('INSERT INTO `games` () VALUES ();', ())
-            cursor.execute('SELECT LAST_INSERT_ID();')
-            result = cursor.fetchone()['LAST_INSERT_ID()']
+            result = insert_game(cursor)
             cursor.execute('INSERT INTO `playing_in` VALUES (%s, %s);',
                            (host, result))
-            places = [1, 3, 6, 8, 9, 11, 13, 14, 16, 18, 19, 21, 23, 24, 26]
-            places += [27, 29, 31, 32, 34, 37, 39, 5, 15, 25, 35, 12, 28]
-            for x in places:
-                cursor.execute('INSERT INTO `properties`'
-                               ' (game_id, property_position)'
-                               ' VALUES (%s, %s);',
-                               (result, x))
+            players_changed(cursor, result)
+            backend.lobby.record_change(cursor, result, 'created', [host])
         conn.commit()
         return result
     finally:
@@ -0,0 +1,127 @@
+"""A pool of games created ahead of time, so that creating a game for a
+player doesn't have to wait on inserting it and its properties.
+
+Pooled games are ordinary rows in ``games`` (with their property rows) in
+the state 'pooled', with no players. When ``MONOPOLY_GAME_POOL`` is set,
+allocate_game_id claims one of them with a single update on the indexed
+``state`` column, only creating a game itself if the pool has run dry.
+
+The pool is topped up in the background with::
+
+    python -m backend.game_pool [--size 20] [--interval 5]
+
+which runs until interrupted (or once, with ``--interval 0``).
+"""
+
+import argparse
+import time
+
+import backend.config
+import backend.game
+import backend.lobby
+# Keeps the standings in step with the players (see
+# backend.game.PLAYERS_CHANGED).
+import backend.standings  # pylint: disable=unused-import
+import backend.storage
+
+# How many times to try claiming a game that another request claims first.
+CLAIM_ATTEMPTS = 3
+
+
+def pool_size():
+    """Return the configured size of the pool, or 0 if it's disabled."""
+    return backend.config.get_int('GAME_POOL', 0)
+
+
+def claim_game(host):
+    """Claim a pooled game for a host.
+
+    Arguments:
+        host: The id of the player creating the game.
+
+    Returns:
+        int: the id of the claimed game, or None if the pool is empty.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            for _ in range(CLAIM_ATTEMPTS):
+                # A new transaction each time, so the select sees the
+                # claims committed since the last attempt.
+                conn.rollback()
+                conn.begin()
+                cursor.execute('SELECT `id` FROM `games` '
+                               'WHERE `state` = "pooled" LIMIT 1;')
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                # Only succeeds if no other request claimed it in between.
+                claimed = cursor.execute(
+                    'UPDATE `games` SET `state` = "waiting", '
+                    '`version` = `version` + 1, `updated_at` = %s '
+                    'WHERE `id` = %s AND `state` = "pooled";',
+                    (int(time.time()), row['id']))
+                if claimed:
+                    cursor.execute('INSERT INTO `playing_in` '
+                                   'VALUES (%s, %s);', (host, row['id']))
+                    backend.game.players_changed(cursor, row['id'])
+                    backend.lobby.record_change(cursor, row['id'], 'created',
+                                                [host])
+                    conn.commit()
+                    return row['id']
+        return None
+    finally:
+        conn.close()
+
+
+def allocate_game(host):
+    """Create a game for a host, from the pool if it's enabled.
+
+    Returns:
+        int: the game's unique id.
+    """
+    if pool_size() > 0:
+        game_id = claim_game(host)
+        if game_id is not None:
+            return game_id
+    return backend.game.create_game(host)
+
+
+def fill_pool(size):
+    """Create pooled games until there are size of them.
+
+    Returns:
+        int: how many games were created.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) AS `count` FROM `games` '
+                           'WHERE `state` = "pooled";')
+            missing = size - cursor.fetchone()['count']
+            for _ in range(missing):
+                conn.begin()
+                backend.game.insert_game(cursor, 'pooled')
+                conn.commit()
+        return max(missing, 0)
+    finally:
+        conn.close()
+
+
+def main():
+    """Keep the pool of games topped up."""
+    parser = argparse.ArgumentParser(
+        description='Keep a pool of games ready to be claimed.')
+    parser.add_argument('--size', type=int, default=pool_size() or 20)
+    parser.add_argument('--interval', type=float, default=5,
+                        help='seconds between checks, or 0 to run once')
+    args = parser.parse_args()
+    while True:
+        fill_pool(args.size)
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""The players' stream of a game: the server-sent events that keep their
+clients up to date with it (see backend.events.GameEvents, and
+backend.compact_events for the compact format)."""
+
+import os
+import sys
+from cgi import FieldStorage
+import cgitb
+
+import backend.compact_events
+import backend.game
+import backend.scheduler
+import backend.snapshot
+import backend.spectate
+import backend.streams
+from backend.entry_point import entry_point
+
+cgitb.enable()
+
+
+@entry_point('game_event_source')
+def start_sse_stream(output_stream=sys.stdout):
+    """Generate a stream of server-sent events according to state changes.
+
+    This function is activated by making a request to the JavaScript
+    function "initialiseEventSource()" which is located in "sse.js".
+    This operation is performed by the JavaScript waitingGame function,
+    and hence, other JavaScript code need only "get" a reference to
+    the EventSource object (by calling "getEventSource()" from
+    "sse.js").
+
+    Reads in the game id, and repeatedly does each of the following:
+        1) Check whose turn it is.
+        2) Check if any new players have joined the waiting game lobby.
+        3) Check if any of the players' balances have changed in a game.
+        4) Check if any of the players' positions have changed in a game.
+        5) Check if the specified game's status has changed to "playing".
+
+    Each pass first looks up only the game's version, and only reads the
+    rest of the game (as a snapshot, see backend.snapshot) if it has
+    changed. Each batch of events carries the version as its id. If the
+    request has ``since`` (or the browser resends the id of the last event
+    it saw, in ``Last-Event-ID``) and the game is still at that version, the
+    stream starts from there rather than sending the whole game again. With
+    ``format=2``, the events are sent in the compact format instead (see
+    backend.compact_events).
+
+    The snapshots are also published for the game's spectators (see
+    backend.spectate).
+
+    The stream ends once the game has ended (after its gameEnd event), its
+    players have all left, or it's been deleted. It polls more often while
+    the game is being played, less often while nothing is happening, and
+    straight away when the game is written to (see backend.scheduler). A
+    client reconnecting to a game that has gone, or whose end it has seen,
+    is answered with 204.
+    """
+    input_data = FieldStorage()
+    game_id = input_data.getfirst('game')
+    event_format = backend.compact_events.negotiate(
+        input_data.getfirst('format'))
+    since = read_version(input_data.getfirst('since'))
+    if since is None:
+        since = read_version(os.environ.get('HTTP_LAST_EVENT_ID'))
+
+    current = backend.game.game_version(game_id)
+    if current is None or (current[0] == since and
+                           backend.game.Game(game_id).state == 'finished'):
+        # The game has gone, or the client has seen it end: 204 tells the
+        # browser not to reconnect.
+        output_stream.write('Status: 204 No Content\n\n')
+        return
+
+    # The following headers are compulsory for SSE.
+    output_stream.write('Content-Type: text/event-stream\n')
+    output_stream.write('Cache-Control: no-cache\n')
+    output_stream.write('\n')
+
+    events = backend.compact_events.make_events(event_format)
+    # The snapshots read are passed on to the game's spectators, if it has
+    # any and no other stream is already doing so.
+    publisher = backend.spectate.Publisher(game_id, create=False)
+    schedule = backend.scheduler.Schedule(
+        'game', backend.scheduler.game_topic(game_id), game_id)
+
+    def poll(output_stream):
+        """Send the events for any change to the game."""
+        nonlocal since
+        # Nothing can have changed if the game's version hasn't.
+        current = backend.game.game_version(game_id)
+        if current is None:
+            return backend.streams.FINISHED
+        if current[0] == events.version:
+            return backend.streams.IDLE
+        snapshot = backend.snapshot.read_snapshot(game_id)
+        publisher.offer(snapshot)
+        if snapshot['version'] == since:
+            # The client already has this version of the game (from the
+            # game_snapshot page), so there's nothing to send yet.
+            events.seed(snapshot)
+            result = backend.streams.IDLE
+        else:
+            events.update(output_stream, snapshot)
+            result = backend.streams.CHANGED
+        since = None
+        # Turns come quickly while the game is being played.
+        schedule.active = events.last_game_state == 'playing'
+        return backend.streams.FINISHED if events.finished else result
+
+    reason = backend.streams.run_stream(output_stream, poll, schedule)
+    publisher.close()
+    if reason == 'finished':
+        backend.spectate.forget_game(game_id)
+
+
+def read_version(value):
+    """Return a version sent by the client as an int, or None.
+
+    >>> read_version('12'), read_version(None), read_version('x')
+    (12, None, None)
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -6,18 +6,24 @@ import sys
 import json
 import cgitb
 
-from backend.game import Game
+import backend.conditional
+from backend.game import Game, game_version
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('request_players')
 def request_list_of_players(source=sys.stdin, output=sys.stdout):
     """Entry point for the service of requesting the list of
     players in a specfic game
+
+    The response carries the game's version as its ETag, and is answered
+    with 304 Not Modified if the client already has it.
     """
-    output.write('Content-Type: application/json\n\n')
     request = json.load(source)
     game_id = request["game_id"]
-    game = Game(game_id)
-    players = game.players
-    json.dump(players, output)
+    version, updated_at = game_version(game_id) or (0, 0)
+    backend.conditional.respond(
+        output, backend.conditional.make_etag('players', game_id, version),
+        updated_at, lambda: json.dumps(Game(game_id).players))
@@ -3,15 +3,36 @@
    the database.
 """
 
-from backend.properties import get_properties_by_state
+import backend.game
+from backend.portfolio import portfolio
 
 
-def get_un_mortgage(player_id):
+def get_un_mortgage(player_id, game_id=None):
     """Requests seperately mortgaged and unmortgaged properties
     owned by player.
     Returns {"unmortgage": [list of mortgaged properties],
              "mortgage": [list of unmortgaged properties]}
+
+    Arguments:
+        player_id: The id of the player.
+        game_id: The id of the game, if known; otherwise it's looked up.
     """
+    if game_id is None:
+        game_id = backend.game.get_this_game(player_id)
+    return names_by_state(portfolio(player_id, game_id))
+
 
-    return {"unmortgage": get_properties_by_state(player_id, "mortgaged"),
-            "mortgage": get_properties_by_state(player_id, "unmortgaged")}
+def names_by_state(holdings):
+    """Split the names of the properties in a portfolio by whether they're
+    mortgaged.
+
+    >>> names_by_state({'properties': [
+    ...     {'name': 'Old Kent Road', 'mortgaged': True},
+    ...     {'name': 'Whitechapel Road', 'mortgaged': False}]}) == {
+    ...     'unmortgage': ['Old Kent Road'], 'mortgage': ['Whitechapel Road']}
+    True
+    """
+    return {"unmortgage": [prop['name'] for prop in holdings['properties']
+                           if prop['mortgaged']],
+            "mortgage": [prop['name'] for prop in holdings['properties']
+                         if not prop['mortgaged']]}
@@ -5,10 +5,12 @@ import cgitb
 from backend.game import Game, get_games
 from backend.player import Player
 from backend.is_bankrupt import is_bankrupt
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('increment_turn')
 def increment_turn(source=sys.stdin, output=sys.stdout):
     """Entry point for the client ending their turn
     """
@@ -1,37 +1,146 @@
 """Module for providing the functionality to
    detirmine if a player is declared bankrupt
+
+A bankrupt player is taken out of their game in a single transaction, with
+a fixed number of statements however many properties they own: their
+properties are all released to the bank (or handed to the player they owe)
+with one update, the players after them move up the turn order, and the
+game finishes if only one player is left.
 """
 
-from backend.player import Player
-from backend.game import get_this_game, Game
-from backend.properties import Property, get_properties
+import time
+
+import backend.game
+import backend.standings
+import backend.storage
+
 
+def is_bankrupt(player_id, creditor_id=None):
+    """Player is checked if they are bankrupt or not, and removed from their
+    game if they are.
 
-def is_bankrupt(player_id):
-    """Player is checked if they are bankrupt or not"""
-    player = Player(player_id)
-    if player.balance < 0:
-        player_remove(player)
+    Arguments:
+        player_id: The id of the player to check.
+        creditor_id: The id of the player they owe, who takes their
+            properties, or None if they owe the bank.
+
+    Returns:
+        bool: True if the player was bankrupt.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        conn.begin()
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT `players`.`balance`, '
+                           '`playing_in`.`game_id` FROM `players` '
+                           'INNER JOIN `playing_in` '
+                           'ON `players`.`id` = `playing_in`.`player_id` '
+                           'WHERE `players`.`id` = %s;', (player_id,))
+            row = cursor.fetchone()
+            if row is None or row['balance'] >= 0:
+                return False
+            remove_player(cursor, row['game_id'], player_id, creditor_id)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
 
 
-def player_remove(player):
+def player_remove(player, creditor_id=None):
     """Player is removed from game with their status updated
        and appropriate changes commence (turn order, properties...)
+
+    Arguments:
+        player: The Player to remove from the game they're playing in.
+        creditor_id: The id of the player who takes their properties, or
+            None to return them to the bank.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        conn.begin()
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT `game_id` FROM `playing_in` '
+                           'WHERE `player_id` = %s;', (player.uid,))
+            game_id = cursor.fetchone()['game_id']
+            remove_player(cursor, game_id, player.uid, creditor_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def release_properties(cursor, game_id, player_id, creditor_id=None):
+    """Release all of a player's properties in a game with one statement.
+
+    Returned to the bank, properties lose their buildings and mortgages;
+    handed to a creditor, they're kept as they are.
+
+    Returns:
+        int: how many properties were released.
+    """
+    if creditor_id is None:
+        return cursor.execute('UPDATE `properties` '
+                              'SET `player_id` = 0, `state` = "unowned", '
+                              '`mortgaged` = "unmortgaged", '
+                              '`house_count` = 0, `hotel_count` = 0 '
+                              'WHERE `game_id` = %s AND `player_id` = %s;',
+                              (game_id, player_id))
+    return cursor.execute('UPDATE `properties` SET `player_id` = %s '
+                          'WHERE `game_id` = %s AND `player_id` = %s;',
+                          (creditor_id, game_id, player_id))
+
+
+def next_turn(current_turn, removed_position, remaining):
+    """Return the game's current turn after a player has been removed and
+    the players after them have moved up.
+
+    >>> next_turn(2, 1, 3)   # a player before the current one leaves
+    1
+    >>> next_turn(1, 1, 3)   # the current player leaves
+    1
+    >>> next_turn(3, 3, 3)   # the current (last) player leaves
+    0
+    >>> next_turn(0, 2, 3)
+    0
+    """
+    if current_turn > removed_position:
+        current_turn -= 1
+    return current_turn if current_turn < remaining else 0
+
+
+def remove_player(cursor, game_id, player_id, creditor_id=None):
+    """Take a player out of a game, in the transaction of cursor.
+
+    Their properties are released (see release_properties()), the players
+    after them in the turn order move up (and in the standings, whoever
+    took their properties), and the game is finished if only one player is
+    left.
     """
-    player_id = player.uid
-    game_id = get_this_game(player_id)
-    with Game(game_id) as game:
-        # Removes player by id from the game's list of players
-        game.players = [p for p in game.players if p != player_id]
-
-        # This part receives properties owned by player by their
-        # position and marks each property as 'unowned'
-        property_positions = get_properties(player_id)
-        for position in property_positions:
-            with Property(position, game_id) as property_:
-                property_.owner = 0
-                property_.state = 'unowned'
-                property_.houses = 0
-                property_.hotels = 0
-
-        game.state = 'finished'
+    release_properties(cursor, game_id, player_id, creditor_id)
+    backend.standings.remove_player(cursor, game_id, player_id, creditor_id)
+    cursor.execute('SELECT `turn_position` FROM `players` WHERE `id` = %s;',
+                   (player_id,))
+    removed_position = cursor.fetchone()['turn_position']
+    cursor.execute('DELETE FROM `playing_in` '
+                   'WHERE `game_id` = %s AND `player_id` = %s;',
+                   (game_id, player_id))
+    cursor.execute('INSERT INTO `departures` (`player_id`, `game_id`) '
+                   'VALUES (%s, %s);', (player_id, game_id))
+    cursor.execute('UPDATE `players` SET `turn_position` = '
+                   '`turn_position` - 1 '
+                   'WHERE `turn_position` > %s AND `id` IN '
+                   '(SELECT `player_id` FROM `playing_in` '
+                   'WHERE `game_id` = %s);', (removed_position, game_id))
+    cursor.execute('SELECT COUNT(*) AS `remaining` FROM `playing_in` '
+                   'WHERE `game_id` = %s;', (game_id,))
+    remaining = cursor.fetchone()['remaining']
+    cursor.execute('SELECT `current_turn`, `state` FROM `games` '
+                   'WHERE `id` = %s;', (game_id,))
+    game = cursor.fetchone()
+    cursor.execute('UPDATE `games` SET `current_turn` = %s, `state` = %s, '
+                   '`version` = `version` + 1, `updated_at` = %s '
+                   'WHERE `id` = %s;',
+                   (next_turn(game['current_turn'], removed_position,
+                              remaining),
+                    'finished' if remaining <= 1 else game['state'],
+                    int(time.time()), game_id))
+    backend.game.changed_after_commit(cursor, game_id)
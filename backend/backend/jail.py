@@ -3,6 +3,7 @@ import sys
 import cgitb
 import json
 from backend.player import Player
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
@@ -19,6 +20,7 @@ def jail_player(player_id):
         player.jail_state = 'in_jail'
 
 
+@entry_point('go_to_jail')
 def go_to_jail(source=sys.stdin, output=sys.stdout):
 
     """Function that sends a player to jail
@@ -44,6 +46,7 @@ def leave_jail(player_id):
         player.board_position = 10
 
 
+@entry_point('leave_jail')
 def pay_to_leave_jail(source=sys.stdin, output=sys.stdout):
 
     """Function that removes a player from jail for a fee
@@ -5,10 +5,12 @@ import sys
 import cgitb
 from backend.game import Game
 from backend.player import Player
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('join_game')
 def join_game(source=sys.stdin, output=sys.stdout):
     """Entry point for the client joining game on server
     """
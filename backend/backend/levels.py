@@ -0,0 +1,26 @@
+"""Building levels: the houses or hotel on a property, as one number.
+
+Levels 0 to 4 are that many houses, and HOTEL is a hotel. backend.board
+builds with them, and backend.standings values buildings by them.
+"""
+
+# The building level of a property with a hotel; levels 0 to 4 are houses.
+HOTEL = 5
+
+
+def level(houses, hotels):
+    """Return a property's building level.
+
+    >>> level(3, 0), level(0, 1)
+    (3, 5)
+    """
+    return HOTEL if hotels else houses
+
+
+def buildings(level_):
+    """Return the houses and hotels for a building level.
+
+    >>> buildings(3), buildings(HOTEL)
+    ((3, 0), (0, 1))
+    """
+    return (0, 1) if level_ == HOTEL else (level_, 0)
@@ -0,0 +1,187 @@
+"""The lobby: the list of games waiting for players.
+
+Rather than clients fetching the whole list over and over, every change to
+it is appended to ``lobby_log`` by the code making the change, in the same
+transaction. Each entry has a version (increasing with every change) and
+carries the game's usernames after the change, so a client that knows the
+version it last saw only needs the entries after it:
+
+created, filled
+    The game is (now) in the lobby, with these players.
+started, removed
+    The game has left the lobby.
+
+``request_games_list?since=<version>`` returns those entries, and the
+``lobby_event_source`` page (backend.lobby_events) streams them as they're
+made.
+"""
+
+import json
+import time
+from itertools import groupby
+from operator import itemgetter
+
+import backend.conditional
+import backend.scheduler
+import backend.storage
+
+# The most entries returned in one response.
+PAGE_SIZE = 500
+
+
+def lobby_change(old_state, new_state, old_players, new_players):
+    """Work out how a write to a game changed the lobby.
+
+    Arguments:
+        old_state: The game's state before the write, or None if the game
+            is new.
+        new_state: The game's state after the write.
+        old_players: The ids of the players in the game before the write.
+        new_players: The ids of the players in the game after the write.
+
+    Returns:
+        The kind of lobby_log entry to record, or None.
+
+    >>> lobby_change(None, 'waiting', [], [1])
+    'created'
+    >>> lobby_change('waiting', 'waiting', [1], [1, 2])
+    'filled'
+    >>> lobby_change('waiting', 'playing', [1, 2], [1, 2])
+    'started'
+    >>> lobby_change('waiting', 'waiting', [1], []), lobby_change(
+    ...     'playing', 'playing', [1, 2], [1])
+    ('removed', None)
+    """
+    if new_state == 'waiting':
+        if old_state != 'waiting':
+            return 'created'
+        if not new_players:
+            return 'removed'
+        if list(old_players) != list(new_players):
+            return 'filled'
+        return None
+    if old_state == 'waiting':
+        return 'started' if new_state == 'playing' else 'removed'
+    return None
+
+
+def record_change(cursor, game_id, kind, player_ids=()):
+    """Append an entry to the lobby log.
+
+    This should be called with the cursor making the change, so the entry is
+    committed (or not) along with it.
+
+    Arguments:
+        cursor: The cursor of the transaction changing the game.
+        game_id: The id of the game.
+        kind: 'created', 'filled', 'started' or 'removed'.
+        player_ids: The ids of the players now in the game, in turn order.
+    """
+    usernames = []
+    if kind in ('created', 'filled') and player_ids:
+        player_ids = list(player_ids)
+        cursor.execute('SELECT `id`, `username` FROM `players` '
+                       'WHERE `id` IN ({});'.format(
+                           ', '.join(['%s'] * len(player_ids))),
+                       tuple(player_ids))
+        names = {row['id']: row['username'] for row in cursor.fetchall()}
+        usernames = [names[uid] for uid in player_ids if uid in names]
+    cursor.execute('INSERT INTO `lobby_log` '
+                   '(`game_id`, `kind`, `players`, `created_at`) '
+                   'VALUES (%s, %s, %s, %s);',
+                   (game_id, kind, json.dumps(usernames), int(time.time())))
+    backend.scheduler.hint_after_commit(cursor, 'lobby')
+    cursor.on_commit(lambda: backend.conditional.invalidate('lobby', 0))
+
+
+def lobby_version():
+    """Return the lobby's version and the time it last changed.
+
+    Returns:
+        (int, int): the version of the latest change and its unix time,
+            or (0, 0) if there have been none.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT `version`, `created_at` FROM `lobby_log` '
+                           'ORDER BY `version` DESC LIMIT 1;')
+            row = cursor.fetchone()
+        return (0, 0) if row is None else (row['version'], row['created_at'])
+    finally:
+        conn.close()
+
+
+def waiting_games(cursor):
+    """Return the whole lobby: the usernames of the players in each waiting
+    game, by the game's id (as backend.game.get_games('waiting') does)."""
+    cursor.execute('SELECT playing_in.game_id, players.username '
+                   'FROM playing_in '
+                   'INNER JOIN players '
+                   'INNER JOIN games ON '
+                   'playing_in.player_id = players.id AND '
+                   'playing_in.game_id = games.id '
+                   'WHERE games.state = %s '
+                   'ORDER BY playing_in.game_id;', ('waiting',))
+    return {game_id: [user['username'] for user in rows]
+            for game_id, rows in groupby(cursor.fetchall(),
+                                         itemgetter('game_id'))}
+
+
+def changes_since(version):
+    """Return the changes to the lobby after a version.
+
+    If there's no version, or the entries after it have been pruned, the
+    whole lobby is returned instead, and the client should start again from
+    it.
+
+    Arguments:
+        version: The version the client last saw, or None.
+
+    Returns:
+        A dictionary with the version to ask for changes since next, and
+        either the list of changes or the whole lobby under 'games'.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT MIN(`version`) AS `oldest`, '
+                           'MAX(`version`) AS `latest` FROM `lobby_log`;')
+            bounds = cursor.fetchone()
+            oldest = bounds['oldest'] or 0
+            latest = bounds['latest'] or 0
+            if version is not None and oldest - 1 <= version <= latest:
+                cursor.execute('SELECT * FROM `lobby_log` '
+                               'WHERE `version` > %s '
+                               'ORDER BY `version` LIMIT %s;',
+                               (version, PAGE_SIZE))
+                changes = [{'version': row['version'],
+                            'game_id': row['game_id'],
+                            'kind': row['kind'],
+                            'players': json.loads(row['players'])}
+                           for row in cursor.fetchall()]
+                return {'version': (changes[-1]['version']
+                                    if changes else version),
+                        'changes': changes}
+            # The changes made while the lobby is read are sent again next
+            # time, which is harmless as each one carries the game's whole
+            # player list.
+            games = waiting_games(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+    return {'version': latest, 'games': games}
+
+
+def read_since(fields):
+    """Return the since parameter of a request as an int, or None.
+
+    >>> read_since({'since': '12'}), read_since({}), read_since(
+    ...     {'since': 'x'})
+    (12, None, None)
+    """
+    value = fields.get('since')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
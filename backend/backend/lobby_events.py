@@ -0,0 +1,87 @@
+"""Server-sent events for the lobby, so that clients waiting to join a game
+don't have to keep asking for the list of games (see backend.lobby)."""
+
+import os
+import sys
+from urllib.parse import parse_qs
+import cgitb
+
+import backend.lobby
+import backend.scheduler
+import backend.storage
+from backend.events import output_event
+from backend.entry_point import entry_point
+from backend.streams import CHANGED, IDLE, run_stream
+
+cgitb.enable()
+
+# How often the stream checks for changes, in seconds, and at most once
+# the lobby has been quiet for a while.
+POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 5
+
+
+def request_fields(environ=None):
+    """Return the query string parameters of the current request.
+
+    Only the query string is read, never the body, which pages may also be
+    sent (as json) by the frontend.
+
+    >>> request_fields({'QUERY_STRING': 'since=3&since=4&x='})
+    {'since': '3', 'x': ''}
+    """
+    environ = os.environ if environ is None else environ
+    return {key: values[0] for key, values in parse_qs(
+        environ.get('QUERY_STRING', ''), keep_blank_values=True).items()}
+
+
+def send_update(output_stream, update):
+    """Send the result of backend.lobby.changes_since(), if there's anything
+    to send.
+
+    >>> import sys
+    >>> send_update(sys.stdout, {'version': 3, 'games': {1: ['Alex']}})
+    id: 3
+    event: lobbyGames
+    data: {"1": ["Alex"]}
+    <BLANKLINE>
+    >>> send_update(sys.stdout, {'version': 3, 'changes': []})
+    """
+    if 'games' in update:
+        output_stream.write('id: {}\n'.format(update['version']))
+        output_event(output_stream, 'lobbyGames', update['games'])
+    elif update['changes']:
+        output_stream.write('id: {}\n'.format(update['version']))
+        output_event(output_stream, 'lobbyChanges', update['changes'])
+
+
+@entry_point('lobby_event_source')
+def start_lobby_stream(output_stream=sys.stdout):
+    """Stream the changes to the lobby as server-sent events.
+
+    The stream starts with a ``lobbyGames`` event holding the whole lobby,
+    unless the request has ``since`` (or the browser resends the id of the
+    last event it saw, in ``Last-Event-ID``). After that, a
+    ``lobbyChanges`` event is sent with each batch of changes.
+    """
+    output_stream.write('Content-Type: text/event-stream\n')
+    output_stream.write('Cache-Control: no-cache\n')
+    output_stream.write('\n')
+
+    since = backend.lobby.read_since(request_fields())
+    if since is None:
+        since = backend.lobby.read_since(
+            {'since': os.environ.get('HTTP_LAST_EVENT_ID')})
+
+    def poll(output_stream):
+        """Send any changes to the lobby."""
+        nonlocal since
+        update = backend.lobby.changes_since(since)
+        send_update(output_stream, update)
+        changed = update['version'] != since or 'games' in update
+        since = update['version']
+        return CHANGED if changed else IDLE
+
+    run_stream(output_stream, poll, backend.scheduler.Schedule(
+        'lobby', 'lobby', interval=POLL_INTERVAL,
+        max_interval=MAX_POLL_INTERVAL))
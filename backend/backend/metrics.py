@@ -0,0 +1,413 @@
+"""Request metrics, shared between the CGI processes through a file.
+
+Every request is handled by its own process, so metrics can't be kept in
+memory. Instead each process records into a memory-mapped file
+(``MONOPOLY_METRICS_FILE``), divided into fixed-size slots. Each slot holds
+one time series: its key (the metric name and labels) and a row of 64-bit
+counters. A slot is only updated while holding an fcntl lock on its own byte
+range, so updates from different processes never interleave, and processes
+updating different series never wait on each other. A series that's removed
+(such as one labelled with a game that has ended) leaves a tombstone, which
+the next new series to hash past it reuses. New series are claimed one at a
+time, holding a lock (on the byte just past the slots) from probing for a
+free slot until the key is written, so no series is ever given two slots.
+
+The ``metrics`` page renders every series in the Prometheus text format.
+When ``MONOPOLY_METRICS_FILE`` isn't set, nothing is recorded.
+"""
+
+import fcntl
+import functools
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import backend.config
+import backend.storage
+
+SLOT_COUNT = 1024
+KEY_SIZE = 128
+FIELD_COUNT = 16
+SLOT_SIZE = KEY_SIZE + 8 * FIELD_COUNT
+FILE_SIZE = SLOT_COUNT * SLOT_SIZE
+
+# Upper bounds of the latency histogram buckets, in seconds. The last field
+# of a histogram counts observations above the last bound.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Histogram fields: count, sum (in microseconds), then one per bucket.
+COUNT, SUM, FIRST_BUCKET = 0, 1, 2
+
+# Gauges are stored in millionths.
+SCALE = 1000000
+
+# The key of a slot whose series has been removed.
+TOMBSTONE = b'\xff'
+
+METRICS = {
+    'monopoly_request_duration_seconds': (
+        'histogram', 'Time taken to handle a request, by page.'),
+    'monopoly_request_errors_total': (
+        'counter', 'Requests which raised an exception, by page.'),
+    'monopoly_db_connections_total': (
+        'counter', 'Database connections opened, by page.'),
+    'monopoly_db_statements_total': (
+        'counter', 'Database statements (round trips) executed, by page.'),
+    'monopoly_db_microseconds_total': (
+        'counter', 'Time spent waiting on database statements, by page.'),
+    'monopoly_sse_events_total': (
+        'counter', 'Server-sent events emitted, by event name.'),
+    'monopoly_sse_streams_closed_total': (
+        'counter', 'Event streams closed, by stream and reason.'),
+    'monopoly_spectator_frames_dropped_total': (
+        'counter', 'Frames dropped for spectators who fell behind.'),
+    'monopoly_spectators_refused_total': (
+        'counter', 'Spectator streams refused for being over the limit.'),
+    'monopoly_poll_interval_seconds': (
+        'gauge', 'The interval event streams last chose between polls, by '
+        'stream and game.'),
+    'monopoly_poll_wakeups_total': (
+        'counter', 'Event streams woken early by a write, by stream.'),
+    'monopoly_polls_throttled_total': (
+        'counter', 'Polls delayed by the cap on polls a second, by stream.'),
+}
+
+
+def series_key(name, labels):
+    """Return the key identifying a time series.
+
+    >>> series_key('monopoly_requests', {'page': 'roll_dice', 'a': 'b'})
+    'monopoly_requests{a="b",page="roll_dice"}'
+    >>> series_key('monopoly_requests', {})
+    'monopoly_requests'
+    """
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join(
+        '{}="{}"'.format(label, str(value).replace('"', '\\"'))
+        for label, value in sorted(labels.items())))
+
+
+def bucket_index(seconds):
+    """Return the index of the histogram bucket a latency falls into.
+
+    >>> bucket_index(0.001), bucket_index(0.3), bucket_index(60)
+    (0, 6, 11)
+    """
+    for index, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(BUCKETS)
+
+
+class MetricsFile(object):
+    """A memory-mapped file of metric slots.
+
+    >>> import tempfile, os
+    >>> path = os.path.join(tempfile.mkdtemp(), 'metrics')
+    >>> segment = MetricsFile(path)
+    >>> segment.add('requests', {0: 1})
+    >>> segment.add('requests', {0: 2})
+    >>> MetricsFile(path).read()
+    {'requests': (3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)}
+    >>> segment.remove('requests')
+    >>> segment.read()
+    {}
+    >>> segment.add('errors', {0: 1})
+    >>> segment.read()['errors'][0]
+    1
+    >>> segment.close()
+    """
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        if os.fstat(self._fd).st_size < FILE_SIZE:
+            os.ftruncate(self._fd, FILE_SIZE)
+        self._map = mmap.mmap(self._fd, FILE_SIZE)
+
+    def close(self):
+        """Unmap and close the file."""
+        self._map.close()
+        os.close(self._fd)
+
+    def _lock(self, slot, operation):
+        fcntl.lockf(self._fd, operation, SLOT_SIZE, slot * SLOT_SIZE)
+
+    def _key_at(self, slot):
+        offset = slot * SLOT_SIZE
+        return self._map[offset:offset + KEY_SIZE].rstrip(b'\0')
+
+    def _claim(self, slot, encoded):
+        """Write a key into a locked slot, clearing its fields."""
+        offset = slot * SLOT_SIZE
+        self._map[offset:offset + SLOT_SIZE] = (
+            encoded.ljust(KEY_SIZE, b'\0') + bytes(SLOT_SIZE - KEY_SIZE))
+
+    def _probe(self, encoded):
+        """Follow a key's probe chain.
+
+        Returns:
+            The slot holding the key (or None if it has none), and the first
+            free slot, empty or a tombstone, on the way (or None).
+        """
+        start = zlib.crc32(encoded) % SLOT_COUNT
+        free = None
+        for probe in range(SLOT_COUNT):
+            slot = (start + probe) % SLOT_COUNT
+            existing = self._key_at(slot)
+            if existing == encoded:
+                return slot, free
+            if free is None and existing in (b'', TOMBSTONE):
+                free = slot
+            if not existing:
+                break
+        return None, free
+
+    def _find(self, key, claim=True):
+        """Find (or claim) the slot for a key, returning it locked.
+
+        Arguments:
+            key: The key of the series.
+            claim: If False, only find a slot the key already has.
+
+        Returns:
+            The index of the slot, or None if the key is too long or every
+            slot is taken. The caller must unlock a returned slot.
+        """
+        encoded = key.encode('utf-8')
+        if len(encoded) > KEY_SIZE:
+            return None
+        slot = self._probe(encoded)[0]
+        if slot is not None:
+            self._lock(slot, fcntl.LOCK_EX)
+            if self._key_at(slot) == encoded:
+                return slot
+            # It was removed since it was read.
+            self._lock(slot, fcntl.LOCK_UN)
+        if not claim:
+            return None
+        # Only claims write keys, so while this lock is held no free slot
+        # can be taken, and the key can't be claimed anywhere else.
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, FILE_SIZE)
+        try:
+            found, free = self._probe(encoded)
+            slot = free if found is None else found
+            if slot is None:
+                return None
+            self._lock(slot, fcntl.LOCK_EX)
+            # The key may have been removed since it was found, leaving a
+            # tombstone, which is claimed all the same.
+            if self._key_at(slot) != encoded:
+                self._claim(slot, encoded)
+            return slot
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, FILE_SIZE)
+
+    def _update(self, key, changes, replace):
+        slot = self._find(key)
+        if slot is None:
+            return
+        try:
+            for field, value in changes.items():
+                offset = slot * SLOT_SIZE + KEY_SIZE + 8 * field
+                if not replace:
+                    value += struct.unpack_from('<q', self._map, offset)[0]
+                struct.pack_into('<q', self._map, offset, value)
+        finally:
+            self._lock(slot, fcntl.LOCK_UN)
+
+    def add(self, key, changes):
+        """Atomically add to some of the fields of a series.
+
+        Arguments:
+            key: The key of the series.
+            changes: A dictionary mapping field numbers to the amount to add.
+        """
+        self._update(key, changes, replace=False)
+
+    def set(self, key, changes):
+        """Atomically overwrite some of the fields of a series."""
+        self._update(key, changes, replace=True)
+
+    def remove(self, key):
+        """Remove a series, if it's in the file."""
+        slot = self._find(key, claim=False)
+        if slot is None:
+            return
+        try:
+            self._claim(slot, TOMBSTONE)
+        finally:
+            self._lock(slot, fcntl.LOCK_UN)
+
+    def read(self):
+        """Return every series in the file.
+
+        Returns:
+            A dictionary mapping series keys to tuples of their fields.
+        """
+        series = {}
+        for slot in range(SLOT_COUNT):
+            key = self._key_at(slot)
+            if key and key != TOMBSTONE:
+                series[key.decode('utf-8')] = struct.unpack_from(
+                    '<{}q'.format(FIELD_COUNT), self._map,
+                    slot * SLOT_SIZE + KEY_SIZE)
+        return series
+
+
+_SEGMENT = []
+
+
+def enabled():
+    """Return True if metrics are being recorded."""
+    return bool(backend.config.get('METRICS_FILE'))
+
+
+def segment():
+    """Return the metrics file for this process, or None if disabled."""
+    if not _SEGMENT:
+        path = backend.config.get('METRICS_FILE')
+        try:
+            _SEGMENT.append(MetricsFile(path) if path else None)
+        except OSError:
+            _SEGMENT.append(None)
+    return _SEGMENT[0]
+
+
+def increment(name, amount=1, **labels):
+    """Add to a counter."""
+    metrics = segment()
+    if metrics is not None and amount:
+        metrics.add(series_key(name, labels), {0: amount})
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to a value."""
+    metrics = segment()
+    if metrics is not None:
+        metrics.set(series_key(name, labels), {0: int(value * SCALE)})
+
+
+def remove(name, **labels):
+    """Remove a series, such as a gauge for something that has gone."""
+    metrics = segment()
+    if metrics is not None:
+        metrics.remove(series_key(name, labels))
+
+
+def observe(name, seconds, **labels):
+    """Record an observation in a latency histogram."""
+    metrics = segment()
+    if metrics is not None:
+        metrics.add(series_key(name, labels), {
+            COUNT: 1,
+            SUM: int(seconds * SCALE),
+            FIRST_BUCKET + bucket_index(seconds): 1,
+        })
+
+
+def _split_key(key):
+    """Split a series key into its name and label string.
+
+    >>> _split_key('a{b="c"}')
+    ('a', 'b="c"')
+    >>> _split_key('a')
+    ('a', '')
+    """
+    if '{' not in key:
+        return key, ''
+    name, labels = key.split('{', 1)
+    return name, labels[:-1]
+
+
+def _with_label(labels, extra):
+    return '{' + ','.join(label for label in (labels, extra) if label) + '}'
+
+
+def render(series):
+    """Render a set of series in the Prometheus text exposition format.
+
+    >>> fields = [0] * FIELD_COUNT
+    >>> fields[COUNT], fields[SUM], fields[FIRST_BUCKET + 1] = 1, 7000, 1
+    >>> print(render({
+    ...     'monopoly_request_errors_total{page="a"}': (2,),
+    ...     'monopoly_request_duration_seconds{page="a"}': fields,
+    ... }), end='')  # doctest: +ELLIPSIS
+    # HELP monopoly_request_duration_seconds Time taken to ...
+    # TYPE monopoly_request_duration_seconds histogram
+    monopoly_request_duration_seconds_bucket{page="a",le="0.005"} 0
+    monopoly_request_duration_seconds_bucket{page="a",le="0.01"} 1
+    ...
+    monopoly_request_duration_seconds_bucket{page="a",le="+Inf"} 1
+    monopoly_request_duration_seconds_sum{page="a"} 0.007
+    monopoly_request_duration_seconds_count{page="a"} 1
+    # HELP monopoly_request_errors_total Requests which raised ...
+    # TYPE monopoly_request_errors_total counter
+    monopoly_request_errors_total{page="a"} 2
+    """
+    by_name = {}
+    for key, fields in series.items():
+        name, labels = _split_key(key)
+        by_name.setdefault(name, []).append((labels, fields))
+    lines = []
+    for name in sorted(by_name):
+        kind, description = METRICS.get(name, ('untyped', name))
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, fields in sorted(by_name[name]):
+            if kind == 'histogram':
+                cumulative = 0
+                bounds = [str(bound) for bound in BUCKETS] + ['+Inf']
+                for index, bound in enumerate(bounds):
+                    cumulative += fields[FIRST_BUCKET + index]
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _with_label(labels, 'le="{}"'.format(bound)),
+                        cumulative))
+                suffix = '{' + labels + '}' if labels else ''
+                lines.append('{}_sum{} {}'.format(
+                    name, suffix, fields[SUM] / SCALE))
+                lines.append('{}_count{} {}'.format(
+                    name, suffix, fields[COUNT]))
+            else:
+                value = fields[0]
+                if kind == 'gauge':
+                    value /= SCALE
+                suffix = '{' + labels + '}' if labels else ''
+                lines.append('{}{} {}'.format(name, suffix, value))
+    return ''.join(line + '\n' for line in lines)
+
+
+def timed(page, handler):
+    """Wrap a handler so that its latency, errors and database usage are
+    recorded.
+
+    Arguments:
+        page: The name of the page, used as the page label.
+        handler: The handler function to wrap.
+    """
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        """Call the handler, recording metrics about the call."""
+        before = dict(backend.storage.STATISTICS)
+        start = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            increment('monopoly_request_errors_total', page=page)
+            raise
+        finally:
+            observe('monopoly_request_duration_seconds',
+                    time.perf_counter() - start, page=page)
+            after = backend.storage.STATISTICS
+            increment('monopoly_db_connections_total',
+                      after['connections'] - before['connections'],
+                      page=page)
+            increment('monopoly_db_statements_total',
+                      after['statements'] - before['statements'],
+                      page=page)
+            increment('monopoly_db_microseconds_total',
+                      int(SCALE * (after['statement_seconds'] -
+                                   before['statement_seconds'])),
+                      page=page)
+    return wrapper
@@ -1,6 +1,8 @@
 """This module implements the Player class, used to represent individual
 players of Monopoly"""
 
+import backend.game
+import backend.standings
 import backend.storage
 
 
@@ -49,6 +51,8 @@ class Player(object):  # pylint: disable=too-many-instance-attributes
         self._conn = None
         self._balance = None
         self._jail_state = None
+        self._initial = None
+        self._initial_rolls = None
 
     def __enter__(self):
         self._in_context = True
@@ -63,28 +67,44 @@ class Player(object):  # pylint: disable=too-many-instance-attributes
             self._turn_position = result['turn_position']
             self._board_position = result['board_position']
             self._jail_state = result['jail_state']
+            self._initial = self._fields()
             del result
             cursor.execute('SELECT `roll1`, `roll2` FROM `rolls` '
                            'WHERE `id` = %s ORDER BY `num`;',
                            (self.uid,))
             self._rolls = [(result['roll1'], result['roll2'])
                            for result in cursor.fetchall()]
+            self._initial_rolls = list(self._rolls)
         return self
 
+    def _fields(self):
+        return (self._username, self._balance, self._turn_position,
+                self._board_position, self._jail_state)
+
     def __exit__(self, *exc):
         try:
             with self._conn.cursor() as cursor:
-                cursor.execute('UPDATE `players` '
-                               'SET `username` = %s, '
-                               '`balance` = %s, '
-                               '`turn_position` = %s, '
-                               '`board_position` = %s, '
-                               '`jail_state` = %s '
-                               'WHERE `id` = %s;',
-                               (self.username, self.balance,
-                                self.turn_position, self.board_position,
-                                self.jail_state, self.uid))
-                if self.rolls != []:
+                if self._fields() != self._initial:
+                    cursor.execute('UPDATE `players` '
+                                   'SET `username` = %s, '
+                                   '`balance` = %s, '
+                                   '`turn_position` = %s, '
+                                   '`board_position` = %s, '
+                                   '`jail_state` = %s '
+                                   'WHERE `id` = %s;',
+                                   (self.username, self.balance,
+                                    self.turn_position, self.board_position,
+                                    self.jail_state, self.uid))
+                    # The player's games have changed too.
+                    cursor.execute('SELECT `game_id` FROM `playing_in` '
+                                   'WHERE `player_id` = %s;', (self.uid,))
+                    game_ids = [row['game_id'] for row in cursor.fetchall()]
+                    for game_id in game_ids:
+                        backend.game.touch_game(cursor, game_id)
+                    backend.standings.adjust_cash(
+                        cursor, game_ids, self.uid,
+                        self.balance - self._initial[1])
+                if self.rolls != self._initial_rolls:
                     cursor.executemany('REPLACE INTO `rolls` '
                                        'VALUES (%s, %s, %s, %s);',
                                        ((self.uid, roll1, roll2, i)
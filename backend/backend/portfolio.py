@@ -0,0 +1,119 @@
+"""A player's holdings in a game, read with one query.
+
+portfolio() returns every property a player owns in a game, with its name,
+colour group, mortgage, buildings, current rent and mortgage value, and
+totals for the player's buildings and net worth. It's read with a single
+statement joining ``property_values`` to the game's ``properties`` (and the
+player's balance), which also gives the ownership of the whole game, so
+that rent (see backend.rent) can be worked out without another query.
+"""
+
+import backend.board
+import backend.rent
+import backend.standings
+import backend.storage
+
+
+def summarise(rows, player_id):
+    """Build a portfolio from the rows read by portfolio().
+
+    Net worth is the player's balance, plus the price of each property (or
+    half of it, if it's mortgaged), plus what was paid for the buildings.
+
+    >>> def row(position, group_rent, owner, houses=0, mortgaged=False):
+    ...     return {'property_position': position, 'name': str(position),
+    ...             'state': 'property', 'purchase_price': 60,
+    ...             'house_price': 50, 'base_rent': group_rent,
+    ...             'one_rent': 10, 'two_rent': 30, 'three_rent': 90,
+    ...             'four_rent': 160, 'hotel_rent': 250, 'balance': 100,
+    ...             'player_id': owner,
+    ...             'ownership': 'owned' if owner else None,
+    ...             'mortgaged': 'mortgaged' if mortgaged else 'unmortgaged',
+    ...             'house_count': houses, 'hotel_count': 0}
+    >>> holdings = summarise([row(1, 2, 7, houses=1), row(3, 4, 7),
+    ...                       row(6, 6, 8, mortgaged=True), row(8, 6, None)],
+    ...                      7)
+    >>> [(prop['position'], prop['group'], prop['rent'])
+    ...  for prop in holdings['properties']]
+    [(1, 'brown', 10), (3, 'brown', 8)]
+    >>> holdings['houses'], holdings['hotels'], holdings['net_worth']
+    (1, 0, 270)
+    """
+    table = backend.rent.make_table(rows)
+    engine = backend.rent.RentEngine(table)
+    balance = rows[0]['balance'] if rows else 0
+    holdings = []
+    for row in rows:
+        if row['ownership'] != 'owned':
+            continue
+        position = row['property_position']
+        engine.transfer(position, row['player_id'])
+        engine.set_level(position, backend.board.level(row['house_count'],
+                                                       row['hotel_count']))
+        engine.set_mortgaged(position, row['mortgaged'] == 'mortgaged')
+        if row['player_id'] == player_id:
+            holdings.append(row)
+
+    properties = []
+    net_worth = balance
+    for row in holdings:
+        position = row['property_position']
+        mortgaged = row['mortgaged'] == 'mortgaged'
+        properties.append({
+            'position': position,
+            'name': row['name'],
+            'group': table[position]['group'],
+            'mortgaged': mortgaged,
+            'houses': row['house_count'],
+            'hotels': row['hotel_count'],
+            'rent': engine.rent(position),
+            'mortgage_value': row['purchase_price'] // 2,
+        })
+        net_worth += backend.standings.asset_value(
+            row['purchase_price'], row['house_price'],
+            backend.board.level(row['house_count'], row['hotel_count']),
+            mortgaged)
+    return {
+        'player_id': player_id,
+        'balance': balance,
+        'properties': properties,
+        'houses': sum(prop['houses'] for prop in properties),
+        'hotels': sum(prop['hotels'] for prop in properties),
+        'net_worth': net_worth,
+    }
+
+
+def portfolio(player_id, game_id):
+    """Return a player's holdings in a game.
+
+    Arguments:
+        player_id: The id of the player.
+        game_id: The id of the game.
+
+    Returns:
+        A dictionary with the player's balance; their 'properties' in board
+        order, each with its position, name, group, mortgaged, houses,
+        hotels, rent (for a utility, per point on the dice) and
+        mortgage_value; and their total houses, hotels and net_worth.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT `property_values`.*, '
+                           '`players`.`balance`, '
+                           '`properties`.`player_id`, '
+                           '`properties`.`state` AS `ownership`, '
+                           '`properties`.`mortgaged`, '
+                           '`properties`.`house_count`, '
+                           '`properties`.`hotel_count` '
+                           'FROM `property_values` '
+                           'INNER JOIN `players` ON `players`.`id` = %s '
+                           'LEFT JOIN `properties` '
+                           'ON `properties`.`property_position` = '
+                           '`property_values`.`property_position` '
+                           'AND `properties`.`game_id` = %s '
+                           'ORDER BY `property_values`.`property_position`;',
+                           (player_id, game_id))
+            return summarise(cursor.fetchall(), player_id)
+    finally:
+        conn.close()
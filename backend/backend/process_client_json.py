@@ -6,10 +6,12 @@ import json
 import sys
 import cgitb
 from backend.roll_die import roll_two_dice
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('request_dice_roll')
 def request_dice_roll(source=sys.stdin, output=sys.stdout):
     """Entry point for the service of requesting a dice roll
 
@@ -30,6 +32,7 @@ def request_dice_roll(source=sys.stdin, output=sys.stdout):
     json.dump({player_id: roll_two_dice()}, output)
 
 
+@entry_point('receive_client_username')
 def receive_client_username(source=sys.stdin, output=sys.stdout):
     """Entry point for the client sending username to server.
 
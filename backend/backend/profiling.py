@@ -0,0 +1,114 @@
+"""Opt-in profiling of the page handlers.
+
+Profiling is switched on by setting ``MONOPOLY_PROFILE_SAMPLE`` to N, which
+profiles roughly one in every N requests with cProfile and writes the result
+to ``MONOPOLY_PROFILE_DIR`` (by default ``/tmp/monopoly-profiles``) as
+``<page>.<timestamp>.<pid>.pstats``. When the variable isn't set, handlers
+aren't wrapped at all, so there is no cost to leaving this deployed.
+
+The profiles for each page can be merged and summarised with::
+
+    python -m backend.profiling [directory] [--top 25] [--page roll_dice]
+"""
+
+import argparse
+import cProfile
+import functools
+import glob
+import os
+import pstats
+import random
+import time
+
+import backend.config
+
+DEFAULT_DIRECTORY = '/tmp/monopoly-profiles'
+
+
+def sample_rate():
+    """Return N, where one in N requests is profiled, or 0 if disabled."""
+    return backend.config.get_int('PROFILE_SAMPLE', 0)
+
+
+def directory():
+    """Return the directory profiles are written to."""
+    return backend.config.get('PROFILE_DIR', DEFAULT_DIRECTORY)
+
+
+def profile_path(page, when=None, pid=None):
+    """Return the file a profile of the given page should be written to.
+
+    >>> profile_path('roll_dice', 0, 12).endswith(
+    ...     'roll_dice.19700101T000000.12.pstats')
+    True
+    """
+    when = time.time() if when is None else when
+    pid = os.getpid() if pid is None else pid
+    return os.path.join(directory(), '{}.{}.{}.pstats'.format(
+        page, time.strftime('%Y%m%dT%H%M%S', time.gmtime(when)), pid))
+
+
+def profiled(page, handler, rate):
+    """Wrap a handler so that one in every rate calls is profiled.
+
+    Arguments:
+        page: The name of the page, used to name the profile.
+        handler: The handler function to wrap.
+        rate: Profile one call in this many.
+    """
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        """Call the handler, under the profiler if this call is sampled."""
+        if random.randrange(rate) != 0:
+            return handler(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(handler, *args, **kwargs)
+        finally:
+            os.makedirs(directory(), exist_ok=True)
+            profiler.dump_stats(profile_path(page))
+    return wrapper
+
+
+def profiles_by_page(path):
+    """Group the profiles in a directory by the page they're for.
+
+    Returns:
+        A dictionary mapping page names to lists of profile files.
+    """
+    pages = {}
+    for filename in sorted(glob.glob(os.path.join(path, '*.pstats'))):
+        page = os.path.basename(filename).split('.')[0]
+        pages.setdefault(page, []).append(filename)
+    return pages
+
+
+def aggregate(path, top=25, only=None):
+    """Merge the profiles for each page and print the top hot spots.
+
+    Arguments:
+        path: The directory containing the profiles.
+        top: How many functions to print for each page.
+        only: If given, only print the summary for this page.
+    """
+    for page, filenames in sorted(profiles_by_page(path).items()):
+        if only is not None and page != only:
+            continue
+        print('=== {} ({} profiles)'.format(page, len(filenames)))
+        stats = pstats.Stats(*filenames)
+        stats.sort_stats('cumulative').print_stats(top)
+
+
+def main():
+    """Summarise the profiles written by the handlers."""
+    parser = argparse.ArgumentParser(
+        description='Merge handler profiles and print the hot spots.')
+    parser.add_argument('directory', nargs='?', default=directory())
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--page')
+    args = parser.parse_args()
+    aggregate(args.directory, args.top, args.page)
+
+
+if __name__ == '__main__':
+    main()
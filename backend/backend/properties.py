@@ -5,8 +5,14 @@ from itertools import groupby
 import sys
 import json
 
+import backend.board
+import backend.game
+import backend.portfolio
+import backend.rent
+import backend.standings
 import backend.storage
 from backend.player import Player
+from backend.entry_point import entry_point
 
 
 class Property(object):  # pylint: disable=too-many-instance-attributes
@@ -31,6 +37,7 @@ class Property(object):  # pylint: disable=too-many-instance-attributes
         self._three = 0
         self._four = 0
         self._hotel = 0
+        self._initial = None
         self._conn = None
 
     def __enter__(self):
@@ -47,6 +54,7 @@ class Property(object):  # pylint: disable=too-many-instance-attributes
             self._houses = result['house_count']
             self._hotels = result['hotel_count']
             self._owner = result['player_id']
+            self._initial = self._fields()
             del result
             cursor.execute('SELECT * FROM `property_values` '
                            'WHERE `property_position` = %s;',
@@ -69,20 +77,42 @@ class Property(object):  # pylint: disable=too-many-instance-attributes
     def __exit__(self, *exc):
         try:
             with self._conn.cursor() as cursor:
-                cursor.execute(
-                    'UPDATE `properties`'
-                    ' SET `player_id` = %s,`mortgaged` = %s,'
-                    ' `state` = %s,`house_count` = %s,`hotel_count` = %s'
-                    ' WHERE `game_id` = %s AND `property_position` = %s;', (
-                        self._owner, self._mortgage, self._property_state,
-                        self._houses, self._hotels, self._gid, self._position
-                    )
-                )
+                if self._fields() != self._initial:
+                    cursor.execute(
+                        'UPDATE `properties`'
+                        ' SET `player_id` = %s,`mortgaged` = %s,'
+                        ' `state` = %s,`house_count` = %s,`hotel_count` = %s'
+                        ' WHERE `game_id` = %s AND `property_position` = %s;',
+                        (self._owner, self._mortgage, self._property_state,
+                         self._houses, self._hotels, self._gid,
+                         self._position))
+                    backend.standings.adjust(cursor, self._gid,
+                                             self._asset_changes())
+                    backend.game.touch_game(cursor, self._gid)
             self._conn.commit()
         finally:
             self._in_context = False
             self._conn.close()
 
+    def _fields(self):
+        return (self._owner, self._mortgage, self._property_state,
+                self._houses, self._hotels)
+
+    def _asset_changes(self):
+        """Return the changes to the standings (see backend.standings.adjust())
+        of the changes made to the property."""
+        changes = {}
+        for (owner, mortgage, state, houses, hotels), sign in (
+                (self._initial, -1), (self._fields(), 1)):
+            if state == 'owned':
+                cash, assets = changes.get(owner, (0, 0))
+                changes[owner] = (cash, assets + sign *
+                                  backend.standings.asset_value(
+                                      self._price, self._house_price,
+                                      backend.board.level(houses, hotels),
+                                      mortgage == 'mortgaged'))
+        return changes
+
     def _request_property(self, table, field, attribute):
         """Helper function to implement requesting a property from
         the database.
@@ -171,7 +201,7 @@ class Property(object):  # pylint: disable=too-many-instance-attributes
         return self._request_property(
             table='properties',
             field='mortgaged',
-            attribute='_mortgaged')
+            attribute='_mortgage')
 
     @property
     def owner(self):
@@ -212,34 +242,15 @@ class Property(object):  # pylint: disable=too-many-instance-attributes
     def rent(self):
         """
         Returns:
-            int: the rent for landing on the property
+            int: the rent for landing on the property (for a utility, per
+                point on the dice; see backend.rent)
         """
-        multiplier = 1
-        if (self._houses == 0) and (self._hotels == 0):
-            attribute = '_base'
-            field = 'base_rent'
-            if self._is_in_monopoly:
-                multiplier = 2
-        elif self._houses == 1:
-            attribute = '_one'
-            field = 'one_rent'
-        elif self._houses == 2:
-            attribute = '_two'
-            field = 'two_rent'
-        elif self._houses == 3:
-            attribute = '_three'
-            field = 'three_rent'
-        elif self._houses == 4:
-            attribute = '_four'
-            field = 'four_rent'
-        elif self._hotels == 1:
-            attribute = '_hotel'
-            field = 'hotel_rent'
-
-        return multiplier * self._request_property(
-            table='property_values',
-            field=field,
-            attribute=attribute)
+        if self._in_context:
+            with self._conn.cursor() as cursor:
+                engine = backend.rent.RentEngine.load(cursor, self._gid)
+        else:
+            engine = backend.rent.load_engine(self._gid)
+        return engine.rent(self._position)
 
     @property
     def house_price(self):
@@ -279,114 +290,6 @@ class Property(object):  # pylint: disable=too-many-instance-attributes
     def property_state(self, new_state):
         self._set_property('property_state', new_state)
 
-    def _is_in_monopoly(self):
-        """
-        Returns:
-            boolean: Whether the property is part of an owned monopoly
-        """
-        is_monopoly = False
-        if self._position in [1, 3]:
-            with self._conn.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                               'WHERE `game_id` = %s ',
-                               'AND `property_position` IN (`1`, `3`) ',
-                               'GROUP BY player_id; ',
-                               (self._gid))
-                result = cursor.fetchone()
-        elif self._position in [6, 8, 9]:
-            with self._conn.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                               'WHERE `game_id` = %s ',
-                               'AND `property_position` IN (`6`, `8`, `9`) ',
-                               'GROUP BY player_id; ',
-                               (self._gid))
-                result = cursor.fetchone()
-        elif self._position in [11, 13, 14]:
-            with self._conn.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                               'WHERE `game_id` = %s ',
-                               'AND `property_position` IN (`11`, `13`, `14`)',
-                               ' GROUP BY player_id; ',
-                               (self._gid))
-                result = cursor.fetchone()
-        elif self._position in [16, 18, 19]:
-            with self._conn.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                               'WHERE `game_id` = %s ',
-                               'AND `property_position` IN (`16`, `18`, `19`)',
-                               ' GROUP BY player_id; ',
-                               (self._gid))
-                result = cursor.fetchone()
-        elif self._position in [21, 23, 24]:
-            with self._conn.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                               'WHERE `game_id` = %s ',
-                               'AND `property_position` IN (`21`, `23`, `24`)',
-                               ' GROUP BY player_id; ',
-                               (self._gid))
-                result = cursor.fetchone()
-        elif self._position in [26, 27, 29]:
-            with self._conn.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                               'WHERE `game_id` = %s ',
-                               'AND `property_position` IN (`26`, `27`, `29`)',
-                               ' GROUP BY player_id; ',
-                               (self._gid))
-                result = cursor.fetchone()
-        elif self._position in [31, 32, 34]:
-            with self._conn.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                               'WHERE `game_id` = %s ',
-                               'AND `property_position` IN (`31`, `32`, `34`)',
-                               ' GROUP BY player_id; ',
-                               (self._gid))
-                result = cursor.fetchone()
-        elif self._position in [37, 39]:
-            with self._conn.cursor() as cursor:
-                cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                               'WHERE `game_id` = %s ',
-                               'AND `property_position` IN (`37`, `39`)',
-                               ' GROUP BY player_id; ',
-                               (self._gid))
-                result = cursor.fetchone()
-        if result[0] == 1:
-            is_monopoly = True
-        return is_monopoly
-
-    def rails_owned(self):
-        """
-        Returns:
-            int: how many railroads are owned by the owner of self.
-        """
-        with self._conn.cursor() as cursor:
-            cursor.execute('SELECT COUNT(*) FROM `properties` AS p ',
-                           'JOIN `property_values` AS pv ON ',
-                           'p.`property_position`=',
-                           'pv.`property_position` ',
-                           'WHERE p.`game_id` = %s ',
-                           'AND pv.`property_type` = `railroad` ',
-                           'AND p.`player_id` = %s',
-                           (self._gid, self._owner))
-            result = cursor.fetchone()
-            return result[result.keys()[0]]
-
-    def utils_owned(self):
-        """
-        Returns:
-            int: how many utilities are owned by the owner of self.
-        """
-        multiplier = 1
-        with self._conn.cursor() as cursor:
-            cursor.execute('SELECT COUNT(*) FROM `properties` ',
-                           'WHERE `game_id` = %s ',
-                           'AND `property_type` = `utility` ',
-                           'AND `player_id` = %s',
-                           (self._gid, self._owner))
-            result = cursor.fetchone()
-            if result[result.keys()[0]] == 2:
-                multiplier = 2.5
-            return multiplier
-
 
 def owned_property_positions(game_id):
     """Return a dictionary of positions of owned properties in a game.
@@ -456,40 +359,14 @@ def is_property_owned(property_position, game_id):
         conn.close()
 
 
-def get_properties(player_id):
-    """Returns a dictionary where a key is the 'player_id' and the value
-    is the list of the player's owned property's positions"""
-    conn = backend.storage.make_connection()
-    try:
-        conn.begin()
-        with conn.cursor() as cursor:
-            cursor.execute('SELECT `property_position` FROM `properties`'
-                           'WHERE `player_id` = %s;', (player_id))
-            result = [row['property_position'] for row in cursor.fetchall()]
-        conn.commit()
-        return result
-    finally:
-        conn.close()
-
-
-def get_properties_by_state(player_id, state):
-    """Returns an ordered list by price of the player's owned properties by
-    its 'state' specified."""
-    conn = backend.storage.make_connection()
-    try:
-        conn.begin()
-        with conn.cursor() as cursor:
-            cursor.execute('SELECT property_values.name'
-                           ' FROM properties INNER JOIN property_values'
-                           ' ON properties.property_position'
-                           ' = property_values.property_position'
-                           ' WHERE player_id = %s and mortgaged = %s;',
-                           (player_id, state))
-            result = [row['name'] for row in cursor.fetchall()]
-        conn.commit()
-        return result
-    finally:
-        conn.close()
+def get_properties(player_id, game_id=None):
+    """Returns the list of the player's owned property's positions in a
+    game (by default, the one they're playing in); see
+    backend.portfolio."""
+    if game_id is None:
+        game_id = backend.game.get_this_game(player_id)
+    return [prop['position'] for prop
+            in backend.portfolio.portfolio(player_id, game_id)['properties']]
 
 
 def get_position_by_name(player_id, property_name):
@@ -514,26 +391,7 @@ def get_position_by_name(player_id, property_name):
         conn.close()
 
 
-def get_propertys_gameid(player_id, property_position):
-    """Returns the gameID of a property from the property's position
-    and the owner's id."""
-    conn = backend.storage.make_connection()
-    try:
-        conn.begin()
-        with conn.cursor() as cursor:
-            cursor.execute('SELECT `game_id`, FROM `properties`'
-                           'WHERE `player_id` = %s;'
-                           'AND `property_position` = %s;',
-                           (player_id, property_position))
-
-            result = cursor.fetchone()
-
-        conn.commit()
-        return result
-    finally:
-        conn.close()
-
-
+@entry_point('buy_property')
 def buy_property(source=sys.stdin, output=sys.stdout):
     """Marks a property as bought by a particular player.
 
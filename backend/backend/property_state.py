@@ -7,14 +7,16 @@ import sys
 import json
 import cgitb
 
-from backend.player import Player
-from backend.properties import Property, get_position_by_name, \
-                               get_propertys_gameid
+import backend.board
+import backend.game
 from backend.get_un_mortgage import get_un_mortgage
+from backend.portfolio import portfolio
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('property_state')
 def property_state(source=sys.stdin, output=sys.stdout):
     """Entry point for the service of requesting list of player_id
     owned (un)mortgaged properties.
@@ -29,6 +31,9 @@ def property_state(source=sys.stdin, output=sys.stdout):
     prop_name = request["player_id"][1]
     player_id = request["player_id"][2]
 
+    game_id = backend.game.get_this_game(player_id)
+    response = {}
+
     # Change property state and player balance if prop_name
     # and prop_state isn't None. It means state for property
     # and player's balance is to be changed.
@@ -38,18 +43,44 @@ def property_state(source=sys.stdin, output=sys.stdout):
         change_state_to = "mortgage" if prop_state == "unmortgage" \
                                      else "unmortgage"
 
-        # Retrieving the property position and gameID for property object
-        property_position = get_position_by_name(player_id, prop_name)
-        game_id = get_propertys_gameid(player_id, property_position)
-
-        with Property(property_position, game_id) as property_:
-            with Player(player_id) as player:
-                # Property_state was unmortgaged, now mortgaged
-                property_.property_state = change_state_to
-                if change_state_to == "unmortgage":
-                    player.balance -= property_.price//2
-                elif change_state_to == "mortgage":
-                    player.balance += property_.price//2
+        # Find the property by name among the player's holdings, and
+        # change it (and the player's balance) in one transaction
+        positions = {prop['name']: prop['position'] for prop
+                     in portfolio(player_id, game_id)['properties']}
+        try:
+            if prop_name not in positions:
+                raise backend.board.BoardError(
+                    'player {} does not own {}'.format(player_id, prop_name))
+            backend.board.apply_changes(
+                game_id, player_id,
+                mortgages={positions[prop_name]:
+                           change_state_to == "mortgage"})
+        except backend.board.BoardError as error:
+            response['error'] = str(error)
 
     # For displaying the mortgaged/ unmortgaged properties.
-    json.dump(get_un_mortgage(player_id), output)
+    response.update(get_un_mortgage(player_id, game_id))
+    json.dump(response, output)
+
+
+@entry_point('mortgage_properties')
+def mortgage_properties(source=sys.stdin, output=sys.stdout):
+    """Entry point for the service of mortgaging or paying off any number
+    of properties at once.
+
+    The request has the player_id, the game_id and ``mortgages``, mapping
+    the positions to change to whether they should be mortgaged. The
+    changes are checked against the rules (see backend.board) and written
+    together, or not at all. Returns the changed properties and the
+    player's new balance, or an error.
+    """
+    output.write('Content-Type: application/json\n\n')
+    request = json.load(source)
+    try:
+        changes, balance = backend.board.apply_changes(
+            request['game_id'], request['player_id'],
+            mortgages=backend.board.read_positions(request.get('mortgages')))
+    except backend.board.BoardError as error:
+        json.dump({'error': str(error)}, output)
+        return
+    json.dump({'properties': changes, 'balance': balance}, output)
@@ -0,0 +1,213 @@
+"""Working out the rent for landing on a property.
+
+The rents of every property are read from ``property_values`` once per
+process (rent_table()), and each property is put in its colour group (from
+backend.board), or with the railroads or the utilities. A RentEngine then
+keeps, for one game, who owns each property and how many of each group
+every player owns, updating the counts as properties change hands, so that
+the rent of any property is worked out without touching the database:
+
+- a property with no buildings pays its base rent, doubled if its owner
+  has the whole colour group; with buildings, the rent for that many
+  houses or a hotel;
+- a railroad pays 25, doubled for each other railroad its owner has;
+- a utility pays 4 times the dice, or 10 times if its owner has both;
+- a mortgaged or unowned property pays nothing.
+"""
+
+import collections
+
+import backend.board
+import backend.storage
+
+# The multiplier of the dice for utility rent, when the owner has both.
+UTILITY_SET_MULTIPLIER = 10
+
+_TABLE = {}
+
+
+def make_table(rows):
+    """Build the rent table from rows of property_values.
+
+    >>> table = make_table([
+    ...     {'property_position': 1, 'state': 'property', 'base_rent': 2,
+    ...      'one_rent': 10, 'two_rent': 30, 'three_rent': 90,
+    ...      'four_rent': 160, 'hotel_rent': 250},
+    ...     {'property_position': 5, 'state': 'railroad', 'base_rent': 25,
+    ...      'one_rent': 0, 'two_rent': 0, 'three_rent': 0,
+    ...      'four_rent': 0, 'hotel_rent': 0}])
+    >>> table[1]['group'], table[1]['rents']
+    ('brown', (2, 10, 30, 90, 160, 250))
+    >>> table[5]['group'], table[5]['type']
+    ('railroad', 'railroad')
+    """
+    return {row['property_position']: {
+        'type': row['state'],
+        'group': backend.board.GROUP_OF.get(row['property_position'],
+                                            row['state']),
+        'rents': (row['base_rent'], row['one_rent'], row['two_rent'],
+                  row['three_rent'], row['four_rent'], row['hotel_rent']),
+    } for row in rows}
+
+
+def rent_table():
+    """Return the rent table, reading it the first time it's needed."""
+    if not _TABLE:
+        conn = backend.storage.make_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT * FROM `property_values`;')
+                _TABLE.update(make_table(cursor.fetchall()))
+        finally:
+            conn.close()
+    return _TABLE
+
+
+class RentEngine(object):
+    """The ownership of one game's properties, for working out rent.
+
+    Arguments:
+        table: The rent table, from rent_table().
+
+    >>> engine = RentEngine(make_table([
+    ...     {'property_position': position, 'state': kind, 'base_rent': base,
+    ...      'one_rent': 10, 'two_rent': 30, 'three_rent': 90,
+    ...      'four_rent': 160, 'hotel_rent': 250}
+    ...     for position, kind, base in [
+    ...         (1, 'property', 2), (3, 'property', 4), (5, 'railroad', 25),
+    ...         (15, 'railroad', 25), (25, 'railroad', 25),
+    ...         (12, 'utility', 4), (28, 'utility', 4)]]))
+    >>> engine.transfer(1, 7)
+    >>> engine.rent(1), engine.rent(3)
+    (2, 0)
+    >>> engine.transfer(3, 7)
+    >>> engine.rent(1), engine.has_monopoly(7, 'brown')
+    (4, True)
+    >>> engine.set_level(1, 2)
+    >>> engine.rent(1)
+    30
+    >>> for position in (5, 15, 25):
+    ...     engine.transfer(position, 8)
+    >>> engine.rent(5)
+    100
+    >>> engine.transfer(25, 7)
+    >>> engine.rent(5), engine.rent(25)
+    (50, 25)
+    >>> engine.set_mortgaged(25, True)
+    >>> engine.rent(25)
+    0
+    >>> engine.transfer(12, 8)
+    >>> engine.rent(12, dice=7)
+    28
+    >>> engine.transfer(28, 8)
+    >>> engine.rent(12, dice=7)
+    70
+    >>> engine.transfer(28, None)
+    >>> engine.rent(28, dice=7), engine.owner(28)
+    (0, None)
+    """
+    def __init__(self, table):
+        self._table = table
+        self._sizes = collections.Counter(entry['group']
+                                          for entry in table.values())
+        self._owners = {}
+        self._levels = {}
+        self._mortgaged = set()
+        # How many of each group each player owns, by (owner, group).
+        self._counts = collections.Counter()
+
+    @classmethod
+    def load(cls, cursor, game_id):
+        """Build the engine for a game with a single query.
+
+        Arguments:
+            cursor: The cursor to read the game's properties with.
+            game_id: The id of the game.
+        """
+        engine = cls(rent_table())
+        cursor.execute('SELECT `property_position`, `player_id`, '
+                       '`mortgaged`, `house_count`, `hotel_count` '
+                       'FROM `properties` '
+                       'WHERE `game_id` = %s AND `state` = "owned";',
+                       (game_id,))
+        for row in cursor.fetchall():
+            position = row['property_position']
+            engine.transfer(position, row['player_id'])
+            engine.set_level(position, backend.board.level(
+                row['house_count'], row['hotel_count']))
+            engine.set_mortgaged(position, row['mortgaged'] == 'mortgaged')
+        return engine
+
+    def owner(self, position):
+        """Return the id of the owner of a property, or None."""
+        return self._owners.get(position)
+
+    def transfer(self, position, owner):
+        """Record that a property has changed hands.
+
+        Arguments:
+            position: The position of the property.
+            owner: The id of its new owner, or None if it's now unowned.
+        """
+        group = self._table[position]['group']
+        old_owner = self._owners.pop(position, None)
+        if old_owner is not None:
+            self._counts[(old_owner, group)] -= 1
+        if owner is not None:
+            self._owners[position] = owner
+            self._counts[(owner, group)] += 1
+
+    def set_level(self, position, level):
+        """Record the buildings on a property (see backend.board.level())."""
+        self._levels[position] = level
+
+    def set_mortgaged(self, position, mortgaged):
+        """Record whether a property is mortgaged."""
+        if mortgaged:
+            self._mortgaged.add(position)
+        else:
+            self._mortgaged.discard(position)
+
+    def owned(self, owner, group):
+        """Return how many of a group a player owns."""
+        return self._counts[(owner, group)]
+
+    def has_monopoly(self, owner, group):
+        """Return True if a player owns the whole of a group."""
+        return self._counts[(owner, group)] == self._sizes[group]
+
+    def rent(self, position, dice=1):
+        """Return the rent for landing on a property.
+
+        Arguments:
+            position: The position of the property.
+            dice: The total of the dice the player rolled; only used for
+                utilities. If it's left out, the rent of a utility is
+                given per point on the dice.
+        """
+        owner = self._owners.get(position)
+        if owner is None or position in self._mortgaged:
+            return 0
+        entry = self._table[position]
+        group = entry['group']
+        base = entry['rents'][0]
+        if entry['type'] == 'railroad':
+            return base * 2 ** (self._counts[(owner, group)] - 1)
+        if entry['type'] == 'utility':
+            if self.has_monopoly(owner, group):
+                return UTILITY_SET_MULTIPLIER * dice
+            return base * dice
+        level = self._levels.get(position, 0)
+        if level:
+            return entry['rents'][level]
+        return base * 2 if self.has_monopoly(owner, group) else base
+
+
+def load_engine(game_id):
+    """Return the rent engine for a game, reading it with one query."""
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            return RentEngine.load(cursor, game_id)
+    finally:
+        conn.close()
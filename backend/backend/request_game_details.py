@@ -6,17 +6,25 @@ import sys
 import json
 import cgitb
 
+import backend.conditional
 import backend.game
+from backend.entry_point import entry_point
 
 cgitb.enable()
 
 
+@entry_point('get_game_details')
 def request_game_details(source=sys.stdin, output=sys.stdout):
     """Entry point for the service of requesting information of
     an available game
+
+    The response carries the game's version as its ETag, and is answered
+    with 304 Not Modified if the client already has it.
     """
-    output.write('Content-Type: application/json\n\n')
     request = json.load(source)
     game_id = request["game_id"]
-    game_info = backend.game.Game(game_id).state
-    json.dump({game_id: game_info}, output)
+    version, updated_at = backend.game.game_version(game_id) or (0, 0)
+    backend.conditional.respond(
+        output, backend.conditional.make_etag('game', game_id, version),
+        updated_at,
+        lambda: json.dumps({game_id: backend.game.Game(game_id).state}))
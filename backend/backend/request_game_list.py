@@ -7,14 +7,33 @@ import sys
 import json
 import cgitb
 
+import backend.conditional
 import backend.game
+import backend.lobby
+from backend.entry_point import entry_point
+from backend.lobby_events import request_fields
 
 cgitb.enable()
 
 
-def request_game_list(output=sys.stdout):
+@entry_point('request_games_list')
+def request_game_list(output=sys.stdout, fields=None):
     """Entry point for the service of requesting list of available games
+
+    With ``since=<version>`` in the query string, only the changes to the
+    list since that version are returned (see backend.lobby.changes_since).
+    Otherwise the whole list is returned, with the lobby's version as its
+    ETag, or 304 Not Modified if the client already has it.
     """
 
-    output.write('Content-Type: application/json\n\n')
-    json.dump(backend.game.get_games('waiting'), output)
+    fields = request_fields() if fields is None else fields
+    since = backend.lobby.read_since(fields)
+    if 'since' in fields:
+        output.write('Content-Type: application/json\n\n')
+        json.dump(backend.lobby.changes_since(since), output)
+        return
+    version, changed_at = backend.lobby.lobby_version()
+    backend.conditional.respond(
+        output, backend.conditional.make_etag('lobby', 0, version),
+        changed_at,
+        lambda: json.dumps(backend.game.get_games('waiting')))
@@ -0,0 +1,29 @@
+"""Module serving the metrics recorded by the other pages, in the
+   Prometheus text format.
+"""
+
+import sys
+import cgitb
+
+import backend.metrics
+from backend.entry_point import entry_point
+
+cgitb.enable()
+
+
+@entry_point('metrics')
+def request_metrics(output=sys.stdout):
+    """Entry point for the service of requesting the current metrics.
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> request_metrics(out)
+    >>> print(out.getvalue())
+    Content-Type: text/plain; version=0.0.4
+    <BLANKLINE>
+    <BLANKLINE>
+    """
+    output.write('Content-Type: text/plain; version=0.0.4\n\n')
+    metrics = backend.metrics.segment()
+    if metrics is not None:
+        output.write(backend.metrics.render(metrics.read()))
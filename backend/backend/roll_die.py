@@ -5,6 +5,7 @@ import sys
 from backend.player import Player
 from backend.game import Game, get_games
 from backend.check_position import check_position
+from backend.entry_point import entry_point
 
 
 def roll_dice():
@@ -26,6 +27,7 @@ def roll_two_dice():
     return dice_result
 
 
+@entry_point('roll_dice')
 def player_roll_dice(source=sys.stdin, output=sys.stdout):
     """Rolls two dice for a player, appends there rolls to the database,
        updates their position and the current game turn.
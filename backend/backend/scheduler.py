@@ -0,0 +1,286 @@
+"""When each event stream next polls the database.
+
+Each stream (see backend.streams.run_stream()) follows a Schedule, which
+works out how long to wait after each pass from how busy what it's following
+has been:
+
+- While a game is being played and has changed in the last IDLE_AFTER
+  seconds, its streams poll every ACTIVE_INTERVAL seconds.
+- Otherwise they poll every interval seconds (3 for a game), doubling the
+  wait after each quiet pass once nothing has changed for IDLE_AFTER
+  seconds, up to max_interval (30 for a game).
+- Whatever the wait, a stream is woken as soon as something is written to
+  what it follows. Every write to a game bumps its version (see
+  backend.game.touch_game()), which, once committed, touches the game's hint
+  file in ``MONOPOLY_SCHEDULER_DIR``; waiting streams check the file's
+  modification time (which costs no queries) every HINT_CHECK_INTERVAL
+  seconds. The lobby has a hint file too.
+
+However many streams there are, together they poll at most
+``MONOPOLY_POLL_QPS`` times a second (100 by default, or no limit if 0): a
+pass first takes a token from a bucket shared by every process through a
+locked file, and waits its turn if there are none left.
+
+The interval each game's streams last chose is the
+``monopoly_poll_interval_seconds`` gauge, labelled with the stream and game,
+which is removed when the stream ends.
+"""
+
+import fcntl
+import os
+import struct
+import time
+
+import backend.config
+import backend.metrics
+
+# What a pass of a stream did.
+CHANGED, IDLE, FINISHED = 'changed', 'idle', 'finished'
+
+DEFAULT_DIRECTORY = '/tmp/monopoly-scheduler'
+DEFAULT_QPS = 100
+
+# How often a stream polls, in seconds: while its game is being played, by
+# default, and at most once it has been idle for IDLE_AFTER seconds.
+ACTIVE_INTERVAL = 1
+DEFAULT_INTERVAL = 3
+MAX_INTERVAL = 30
+IDLE_AFTER = 60
+
+# How often a waiting stream checks its hint file, in seconds.
+HINT_CHECK_INTERVAL = 0.2
+
+# The token bucket's file holds the tokens left and when it was last taken
+# from.
+BUCKET_FORMAT = '<dd'
+
+
+def directory():
+    """Return the directory holding the hint and token bucket files."""
+    return backend.config.get('SCHEDULER_DIR', DEFAULT_DIRECTORY)
+
+
+def game_topic(game_id):
+    """Return the name of a game's hint file.
+
+    >>> game_topic('12')
+    'game-12'
+    """
+    return 'game-{}'.format(int(game_id))
+
+
+def hint(topic):
+    """Wake the streams waiting on a topic, if there are any."""
+    path = os.path.join(directory(), topic)
+    try:
+        # The file's times are set explicitly, as those set by the kernel
+        # may be too coarse to tell two hints apart.
+        stamp = max(int(time.time() * 1e9), os.stat(path).st_mtime_ns + 1)
+        os.utime(path, ns=(stamp, stamp))
+    except FileNotFoundError:
+        # No stream has followed it, so there's no one to wake.
+        pass
+
+
+def forget(topic):
+    """Remove a topic's hint file, once nothing will be written to it."""
+    try:
+        os.remove(os.path.join(directory(), topic))
+    except FileNotFoundError:
+        pass
+
+
+def hint_after_commit(cursor, topic):
+    """Wake the streams waiting on a topic once the changes a cursor is
+    making have been committed, so that they read the new version."""
+    cursor.on_commit(lambda: hint(topic))
+
+
+class TokenBucket(object):  # pylint: disable=too-few-public-methods
+    """A token bucket shared by every process through a file.
+
+    Arguments:
+        path: The file holding the bucket.
+        rate: How many tokens are added to the bucket a second.
+        burst: How many tokens the bucket holds at most.
+
+    >>> import tempfile, os
+    >>> bucket = TokenBucket(os.path.join(tempfile.mkdtemp(), 'tokens'), 2,
+    ...                      burst=2)
+    >>> [bucket.take(100.0) for _ in range(4)]
+    [0.0, 0.0, 0.5, 1.0]
+    >>> bucket.take(102.0)
+    0.0
+    """
+    def __init__(self, path, rate, burst=None):
+        self.path = path
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+
+    def take(self, now=None):
+        """Take a token from the bucket.
+
+        When the bucket is empty, the token is taken from those still to be
+        added, so that processes waiting for one take turns.
+
+        Returns:
+            float: how long to wait, in seconds, before using the token.
+        """
+        now = time.time() if now is None else now
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, struct.calcsize(BUCKET_FORMAT), 0)
+            if len(data) == struct.calcsize(BUCKET_FORMAT):
+                tokens, updated = struct.unpack(BUCKET_FORMAT, data)
+            else:
+                tokens, updated = self.burst, now
+            now = max(now, updated)
+            tokens = min(self.burst,
+                         tokens + (now - updated) * self.rate) - 1
+            os.pwrite(fd, struct.pack(BUCKET_FORMAT, tokens, now), 0)
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+        return max(0.0, -tokens / self.rate)
+
+
+def poll_bucket():
+    """Return the bucket capping how often streams poll, or None if they
+    aren't capped."""
+    rate = backend.config.get_float('POLL_QPS', DEFAULT_QPS)
+    if rate <= 0:
+        return None
+    os.makedirs(directory(), exist_ok=True)
+    return TokenBucket(os.path.join(directory(), 'tokens'), rate)
+
+
+class Schedule(object):  # pylint: disable=too-many-instance-attributes
+    """How long a stream waits between its passes.
+
+    Arguments:
+        name: The name of the stream, for metrics.
+        topic: The hint file that wakes the stream (see hint()), or None.
+        game_id: The id of the game the stream follows, if it follows one.
+        interval: How long to wait after a pass, in seconds.
+        max_interval: How long to wait at most, once idle.
+        idle_after: How long, in seconds, before a stream with no changes
+            is idle.
+        active_interval: How long to wait while active is set (e.g. while
+            a game is being played), unless idle.
+
+    >>> schedule = Schedule('example', interval=3, max_interval=20,
+    ...                     idle_after=10)
+    >>> [schedule.next_wait(result, now) for result, now in [
+    ...     ('changed', 0), ('idle', 3), ('idle', 12), ('idle', 18),
+    ...     ('idle', 30), ('idle', 50), ('changed', 70)]]
+    [3, 3, 6, 12, 20, 20, 3]
+    >>> schedule.active = True
+    >>> schedule.next_wait('idle', 73), schedule.next_wait('idle', 85)
+    (1, 2)
+    """
+    def __init__(self, name, topic=None, game_id=None,
+                 interval=DEFAULT_INTERVAL, max_interval=MAX_INTERVAL,
+                 idle_after=IDLE_AFTER, active_interval=ACTIVE_INTERVAL):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.topic = topic
+        self.game_id = game_id
+        self.interval = interval
+        self.max_interval = max_interval
+        self.idle_after = idle_after
+        self.active_interval = active_interval
+        # Set by the stream while what it follows is busy.
+        self.active = False
+        self.wait = None
+        self._last_change = None
+        self._hint_path = None
+        self._hint_time = None
+        self._bucket = None
+
+    def listen(self):
+        """Start watching the stream's hint file, and the poll cap."""
+        self._bucket = poll_bucket()
+        if self.topic is None:
+            return
+        os.makedirs(directory(), exist_ok=True)
+        self._hint_path = os.path.join(directory(), self.topic)
+        open(self._hint_path, 'a').close()
+        self._hint_time = os.stat(self._hint_path).st_mtime_ns
+
+    def hinted(self):
+        """Return True if the hint file has been touched since the last
+        check."""
+        if self._hint_path is None:
+            return False
+        try:
+            hint_time = os.stat(self._hint_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        hinted, self._hint_time = hint_time != self._hint_time, hint_time
+        return hinted
+
+    def next_wait(self, result, now):
+        """Work out how long to wait after a pass.
+
+        Arguments:
+            result: What the pass did: CHANGED or IDLE.
+            now: The time the pass finished.
+
+        Returns:
+            The time to wait, in seconds.
+        """
+        if result == CHANGED or self._last_change is None:
+            self._last_change = now
+        if result != CHANGED and now - self._last_change >= self.idle_after:
+            wait = min((self.wait or self.interval) * 2, self.max_interval)
+        else:
+            wait = self.active_interval if self.active else self.interval
+        if wait != self.wait:
+            self.wait = wait
+            backend.metrics.set_gauge('monopoly_poll_interval_seconds', wait,
+                                      **self._labels())
+        return wait
+
+    def sleep(self, seconds, sleep=time.sleep):
+        """Wait before the next pass, waking early if the stream is hinted.
+
+        Returns:
+            bool: True if it was woken by a hint.
+        """
+        if self._hint_path is None:
+            sleep(seconds)
+            return False
+        deadline = time.time() + seconds
+        while True:
+            if self.hinted():
+                backend.metrics.increment('monopoly_poll_wakeups_total',
+                                          stream=self.name)
+                # Poll at the fastest rate while the change is followed up.
+                self._last_change = time.time()
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            sleep(min(remaining, HINT_CHECK_INTERVAL))
+
+    def throttle(self, sleep=time.sleep):
+        """Wait for a turn to poll, if polling is capped."""
+        if self._bucket is None:
+            return
+        wait = self._bucket.take()
+        if wait > 0:
+            backend.metrics.increment('monopoly_polls_throttled_total',
+                                      stream=self.name)
+            sleep(wait)
+
+    def close(self):
+        """Remove the stream's interval gauge."""
+        if self.wait is not None:
+            backend.metrics.remove('monopoly_poll_interval_seconds',
+                                   **self._labels())
+
+    def _labels(self):
+        if self.game_id is None:
+            return {'stream': self.name}
+        return {'stream': self.name, 'game': self.game_id}
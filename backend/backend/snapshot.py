@@ -0,0 +1,142 @@
+"""The whole state of a game, read at once.
+
+A snapshot holds everything the game page shows (the players, their
+balances, positions and turn order, whose turn it is, and who owns which
+properties, with how many houses and whether they're mortgaged), along with
+the version of the game it was read at. It's read with three queries in one
+transaction rather than a query per field, so it's consistent: the version
+matches the rest of it.
+
+The ``game_snapshot`` page returns it, so a client can draw the game straight
+away, and then start the game's event stream with ``since`` set to the
+snapshot's version so that it's only sent what changes after it.
+"""
+
+import sys
+import json
+import cgitb
+
+import backend.bitboard
+import backend.conditional
+import backend.game
+import backend.storage
+from backend.entry_point import entry_point
+
+cgitb.enable()
+
+
+def player_details(row):
+    """Return the snapshot of a player from their row.
+
+    >>> player_details({'id': 3, 'username': 'Alex', 'balance': 1500,
+    ...                 'turn_position': 0, 'board_position': 7,
+    ...                 'jail_state': 'not_in_jail', 'game_id': 1}) == {
+    ...     'id': 3, 'username': 'Alex', 'balance': 1500, 'turn_position': 0,
+    ...     'board_position': 7, 'jail_state': 'not_in_jail'}
+    True
+    """
+    return {field: row[field] for field in
+            ('id', 'username', 'balance', 'turn_position', 'board_position',
+             'jail_state')}
+
+
+def property_details(row):
+    """Return the snapshot of a property from its row.
+
+    >>> property_details({'property_position': 1, 'name': 'Old Kent Road',
+    ...                   'state': 'owned', 'player_id': 3,
+    ...                   'mortgaged': 'unmortgaged', 'house_count': 2,
+    ...                   'hotel_count': 0}) == {
+    ...     'position': 1, 'name': 'Old Kent Road', 'owner': 3,
+    ...     'mortgaged': False, 'houses': 2, 'hotels': 0}
+    True
+    >>> property_details({'property_position': 3, 'name': 'Whitechapel',
+    ...                   'state': 'unowned', 'player_id': 0,
+    ...                   'mortgaged': 'unmortgaged', 'house_count': 0,
+    ...                   'hotel_count': 0})['owner'] is None
+    True
+    """
+    return {
+        'position': row['property_position'],
+        'name': row['name'],
+        'owner': row['player_id'] if row['state'] == 'owned' else None,
+        'mortgaged': row['mortgaged'] == 'mortgaged',
+        'houses': row['house_count'],
+        'hotels': row['hotel_count'],
+    }
+
+
+def read_snapshot(game_id):
+    """Read the whole state of a game.
+
+    Arguments:
+        game_id: The id of the game.
+
+    Returns:
+        A dictionary with the game's id, version, updated_at, state and
+        current_turn, its players in turn order, all of its properties in
+        board order, and the same properties encoded as a board (see
+        backend.bitboard); or None if there's no such game.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        conn.begin()
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT * FROM `games` WHERE `id` = %s;',
+                           (game_id,))
+            game = cursor.fetchone()
+            if game is None:
+                return None
+            cursor.execute('SELECT * FROM `players` '
+                           'INNER JOIN `playing_in` '
+                           'ON `players`.`id` = `playing_in`.`player_id` '
+                           'WHERE `playing_in`.`game_id` = %s '
+                           'ORDER BY `players`.`turn_position`;', (game_id,))
+            players = [player_details(row) for row in cursor.fetchall()]
+            cursor.execute('SELECT `properties`.*, `property_values`.`name` '
+                           'FROM `properties` INNER JOIN `property_values` '
+                           'ON `properties`.`property_position` = '
+                           '`property_values`.`property_position` '
+                           'WHERE `properties`.`game_id` = %s '
+                           'ORDER BY `properties`.`property_position`;',
+                           (game_id,))
+            properties = [property_details(row) for row in cursor.fetchall()]
+        conn.commit()
+    finally:
+        conn.close()
+    return {
+        'game_id': game['id'],
+        'version': game['version'],
+        'updated_at': game['updated_at'],
+        'state': game['state'],
+        'current_turn': game['current_turn'],
+        'players': players,
+        'properties': properties,
+        'board': backend.bitboard.Bitboard.from_properties(
+            properties).encode(),
+    }
+
+
+@entry_point('game_snapshot')
+def request_game_snapshot(source=sys.stdin, output=sys.stdout):
+    """Entry point for the service of requesting the whole state of a game.
+
+    The response carries the game's version as its ETag, and is answered
+    with 304 Not Modified (after looking up only the version) if the client
+    already has it.
+    """
+    request = json.load(source)
+    game_id = request['game_id']
+    version, updated_at = backend.game.game_version(game_id) or (0, 0)
+    etag = backend.conditional.make_etag('snapshot', game_id, version)
+    if backend.conditional.not_modified(etag):
+        backend.conditional.respond(output, etag, updated_at, None)
+        return
+    snapshot = read_snapshot(game_id)
+    if snapshot is not None:
+        # The snapshot may be newer than the version looked up above, so
+        # it's labelled with its own.
+        version, updated_at = snapshot['version'], snapshot['updated_at']
+    backend.conditional.respond(
+        output, backend.conditional.make_etag('snapshot', game_id, version),
+        updated_at, lambda: json.dumps(snapshot, sort_keys=True))
@@ -0,0 +1,426 @@
+"""Spectators: read-only streams of a game that don't query the database.
+
+Each spectator is a process of its own, so if each polled the game like the
+players' stream (backend.game_stream) does, a game with hundreds of them would
+cost hundreds of times as much. Instead they share one feed through files
+in a directory for the game under ``MONOPOLY_SPECTATOR_DIR``:
+
+- One process at a time is the game's publisher, chosen by whichever takes
+  an exclusive lock on its ``publisher`` file first. A players' stream
+  publishes the snapshots it reads anyway, so while one is open the
+  spectators cost no queries at all; otherwise one of the spectators polls
+  the game itself. Whenever the game's version changes, the publisher
+  replaces the cached ``snapshot.json`` and appends the batch of events it
+  makes (the same ones the players are sent, see
+  backend.events.GameEvents) to the ``frames`` log, one json line per
+  version, holding the batch in both formats (see backend.compact_events).
+  When the publisher goes, another process takes over.
+- Spectators are sent the cached snapshot, as a ``gameSnapshot`` event, and
+  then tail the frames log, in the format they asked for.
+
+A game has at most ``MONOPOLY_SPECTATOR_LIMIT`` spectators: each holds a lock
+on one of that many slot files, and a stream is refused with 503 when none
+is free. A spectator whose client reads slowly (so its writes block, and
+frames pile up in the log) keeps only the newest
+``MONOPOLY_SPECTATOR_BACKLOG`` of them, and if any were dropped it's sent
+the cached snapshot again, so its client is never left with a gap.
+"""
+
+import collections
+import fcntl
+import io
+import json
+import os
+import shutil
+import sys
+from cgi import FieldStorage
+import cgitb
+
+import backend.compact_events
+import backend.config
+import backend.events
+import backend.game
+import backend.metrics
+import backend.scheduler
+import backend.snapshot
+import backend.storage
+import backend.streams
+from backend.entry_point import entry_point
+
+cgitb.enable()
+
+DEFAULT_DIRECTORY = '/tmp/monopoly-spectators'
+DEFAULT_LIMIT = 100
+DEFAULT_BACKLOG = 16
+
+# How often spectators check for new frames, in seconds.
+POLL_INTERVAL = 1
+
+# The size the frames log may grow to before it's started again.
+MAX_LOG_SIZE = 256 * 1024
+
+
+def directory(game_id):
+    """Return the directory holding a game's spectator files."""
+    return os.path.join(backend.config.get('SPECTATOR_DIR',
+                                           DEFAULT_DIRECTORY),
+                        str(int(game_id)))
+
+
+def take_slot(game_id, limit=None):
+    """Take one of a game's spectator slots.
+
+    Returns:
+        The open slot file, which holds the slot until it's closed (or the
+        process ends), or None if every slot is taken.
+    """
+    if limit is None:
+        limit = backend.config.get_int('SPECTATOR_LIMIT', DEFAULT_LIMIT)
+    path = directory(game_id)
+    os.makedirs(path, exist_ok=True)
+    for slot in range(limit):
+        slot_file = open(os.path.join(path, 'slot-{}'.format(slot)), 'a')
+        try:
+            fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return slot_file
+        except BlockingIOError:
+            slot_file.close()
+    return None
+
+
+def forget_game(game_id):
+    """Remove a game's spectator files and its hint file (see
+    backend.scheduler), once it has finished or been archived.
+
+    Nothing is removed while another stream holds one of the game's slots
+    or its publisher lock; the last of them to end removes the files.
+
+    Returns:
+        bool: True if the files were removed.
+    """
+    path = directory(game_id)
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        names = []
+    locks = []
+    try:
+        for name in names:
+            if name == 'publisher' or name.startswith('slot-'):
+                lock = open(os.path.join(path, name), 'a')
+                locks.append(lock)
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # The files are removed while they're locked, so that no stream
+        # takes them in the meantime.
+        shutil.rmtree(path, ignore_errors=True)
+    except (BlockingIOError, FileNotFoundError):
+        return False
+    finally:
+        for lock in locks:
+            lock.close()
+    backend.scheduler.forget(backend.scheduler.game_topic(game_id))
+    return True
+
+
+def read_cached(game_id):
+    """Return a game's cached snapshot, or None if there isn't one yet."""
+    try:
+        with open(os.path.join(directory(game_id), 'snapshot.json')) as cache:
+            return json.load(cache)
+    except FileNotFoundError:
+        return None
+
+
+class Publisher(object):
+    """Publishes a game's snapshots and frames for its spectators, while it
+    holds the game's publisher lock.
+
+    Arguments:
+        game_id: The id of the game.
+        create: If False, nothing is published unless a spectator has made
+            the game's directory.
+    """
+    def __init__(self, game_id, create=True):
+        self._game_id = game_id
+        self._path = directory(game_id)
+        self._create = create
+        self._lock = None
+        # The events of each format, by format.
+        self._events = None
+
+    @property
+    def version(self):
+        """The version of the game last published, or None."""
+        if self._events is None:
+            return None
+        return self._events[backend.compact_events.VERBOSE].version
+
+    def _seed(self, snapshot):
+        self._events = {event_format: backend.compact_events.make_events(
+            event_format) for event_format in backend.compact_events.FORMATS}
+        for events in self._events.values():
+            events.seed(snapshot)
+
+    def take(self):
+        """Try to become the game's publisher, if it isn't already.
+
+        Returns:
+            bool: True if it's the game's publisher.
+        """
+        if self._lock is not None:
+            return True
+        if self._create:
+            os.makedirs(self._path, exist_ok=True)
+        elif not os.path.isdir(self._path):
+            return False
+        try:
+            lock = open(os.path.join(self._path, 'publisher'), 'a')
+        except FileNotFoundError:
+            # The game's files have just been removed (see forget_game()).
+            return False
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self._lock = lock
+        # Carry on from whatever the last publisher left.
+        cached = read_cached(self._game_id)
+        if cached is not None:
+            self._seed(cached)
+        return True
+
+    def close(self):
+        """Stop being the game's publisher."""
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+            self._events = None
+
+    def offer(self, snapshot):
+        """Publish a snapshot of the game, if this is its publisher and the
+        snapshot is newer than the last one published."""
+        if snapshot is None or not self.take():
+            return
+        if self._events is None:
+            self._seed(snapshot)
+            self._write_snapshot(snapshot)
+            return
+        if snapshot['version'] <= self.version:
+            return
+        entry = {'version': snapshot['version']}
+        for event_format, events in self._events.items():
+            frame = io.StringIO()
+            events.update(frame, snapshot)
+            entry[str(event_format)] = frame.getvalue()
+            entry['finished'] = events.finished
+        # The snapshot is written first, so that a spectator which reads it
+        # and then the frame skips the frame rather than missing it.
+        self._write_snapshot(snapshot)
+        self._append(entry)
+
+    def _write_snapshot(self, snapshot):
+        path = os.path.join(self._path, 'snapshot.json')
+        temporary = '{}.{}'.format(path, os.getpid())
+        with open(temporary, 'w') as cache:
+            json.dump(snapshot, cache, sort_keys=True)
+        os.replace(temporary, path)
+
+    def _append(self, entry):
+        path = os.path.join(self._path, 'frames')
+        line = (json.dumps(entry, sort_keys=True) + '\n').encode()
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # One write, so that lines are never interleaved.
+            os.write(fd, line)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > MAX_LOG_SIZE:
+            # Readers finish the old log before moving to the new one.
+            temporary = '{}.{}'.format(path, os.getpid())
+            open(temporary, 'w').close()
+            os.replace(temporary, path)
+
+
+class FrameLog(object):
+    """Reads the frames appended to a game's frames log.
+
+    Reading starts from the end of the log when it's first opened, since a
+    new spectator is sent the cached snapshot (which is written before each
+    frame) instead.
+    """
+    def __init__(self, game_id):
+        self._path = os.path.join(directory(game_id), 'frames')
+        self._file = None
+        self._buffer = ''
+
+    def _open(self, at_end):
+        try:
+            self._file = open(self._path)
+        except FileNotFoundError:
+            self._file = None
+            return
+        self._buffer = ''
+        if at_end:
+            self._file.seek(0, os.SEEK_END)
+
+    def _drain(self):
+        self._buffer += self._file.read()
+        lines = self._buffer.split('\n')
+        self._buffer = lines.pop()
+        return [json.loads(line) for line in lines if line]
+
+    def read(self):
+        """Return each frame appended since the last read, as a dictionary
+        with its 'version', whether the game has 'finished', and the batch
+        of events in each format, by the format's number as a string."""
+        if self._file is None:
+            # The log is only missing until the first frame, so if it's
+            # opened later it's read from the start.
+            self._open(at_end=False)
+            return self._drain() if self._file is not None else []
+        frames = self._drain()
+        try:
+            rotated = (os.stat(self._path).st_ino !=
+                       os.fstat(self._file.fileno()).st_ino)
+        except FileNotFoundError:
+            rotated = False
+        if rotated:
+            self._file.close()
+            self._open(at_end=False)
+            if self._file is not None:
+                frames += self._drain()
+        return frames
+
+    def start(self):
+        """Skip everything already in the log."""
+        self._open(at_end=True)
+
+    def close(self):
+        """Close the log."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Spectator(object):
+    """What one spectator's client has been sent.
+
+    Arguments:
+        game_id: The id of the game.
+        backlog: How many unsent frames to keep; older ones are dropped.
+        event_format: The format of the events to send (see
+            backend.compact_events), by default the verbose one.
+    """
+    def __init__(self, game_id, backlog=None, event_format=None):
+        if backlog is None:
+            backlog = backend.config.get_int('SPECTATOR_BACKLOG',
+                                             DEFAULT_BACKLOG)
+        if event_format is None:
+            event_format = backend.compact_events.VERBOSE
+        self._game_id = game_id
+        self._format = str(event_format)
+        self._log = FrameLog(game_id)
+        self._log.start()
+        self._backlog = collections.deque(maxlen=backlog)
+        self.version = None
+        # Whether the client has been sent the end of the game.
+        self.finished = False
+
+    def send(self, output_stream):
+        """Send the client whatever it hasn't been sent yet.
+
+        Returns:
+            int: how many frames were dropped because the client had fallen
+                too far behind.
+        """
+        frames = self._log.read()
+        self._backlog.extend(frames)
+        dropped = max(0, len(frames) - self._backlog.maxlen)
+        if self.version is None or dropped:
+            cached = read_cached(self._game_id)
+            if cached is not None and (self.version is None or
+                                       cached['version'] > self.version):
+                output_stream.write('id: {}\n'.format(cached['version']))
+                backend.events.output_event(output_stream, 'gameSnapshot',
+                                            cached)
+                self.version = cached['version']
+                self.finished = cached['state'] == 'finished'
+        while self._backlog:
+            frame = self._backlog.popleft()
+            if self.version is not None and frame['version'] > self.version:
+                output_stream.write(frame[self._format])
+                self.version = frame['version']
+                self.finished = frame['finished']
+        return dropped
+
+    def close(self):
+        """Stop reading the game's frames."""
+        self._log.close()
+
+
+@entry_point('spectator_event_source')
+def start_spectator_stream(output_stream=sys.stdout):
+    """Stream a game to a spectator, as server-sent events.
+
+    The stream starts with a ``gameSnapshot`` event holding the whole game
+    (in the form of the game_snapshot page), followed by the same events
+    the players are sent (in the compact format with ``format=2``, see
+    backend.compact_events), and ends with the game (see
+    backend.streams.run_stream()). It's refused with 400 without a game id,
+    and with 503 if the game already has as many spectators as it may.
+    """
+    fields = FieldStorage()
+    try:
+        game_id = int(fields.getfirst('game'))
+    except (TypeError, ValueError):
+        output_stream.write('Status: 400 Bad Request\n')
+        output_stream.write('Content-Type: text/plain\n\n')
+        output_stream.write('A game id is needed\n')
+        return
+    slot = take_slot(game_id)
+    if slot is None:
+        backend.metrics.increment('monopoly_spectators_refused_total')
+        output_stream.write('Status: 503 Service Unavailable\n')
+        output_stream.write('Retry-After: 30\n')
+        output_stream.write('Content-Type: text/plain\n\n')
+        output_stream.write('Too many spectators\n')
+        return
+    output_stream.write('Content-Type: text/event-stream\n')
+    output_stream.write('Cache-Control: no-cache\n')
+    output_stream.write('\n')
+
+    publisher = Publisher(game_id)
+    spectator = Spectator(game_id, event_format=(
+        backend.compact_events.negotiate(fields.getfirst('format'))))
+
+    def poll(output_stream):
+        """Publish the game if no one else is, and send the spectator
+        anything new."""
+        if publisher.take():
+            current = backend.game.game_version(game_id)
+            if current is None:
+                return backend.streams.FINISHED
+            if current[0] != publisher.version:
+                publisher.offer(backend.snapshot.read_snapshot(game_id))
+        version = spectator.version
+        backend.metrics.increment('monopoly_spectator_frames_dropped_total',
+                                  spectator.send(output_stream))
+        if spectator.finished:
+            return backend.streams.FINISHED
+        if spectator.version != version:
+            return backend.streams.CHANGED
+        return backend.streams.IDLE
+
+    try:
+        reason = backend.streams.run_stream(
+            output_stream, poll, backend.scheduler.Schedule(
+                'spectator', backend.scheduler.game_topic(game_id),
+                interval=POLL_INTERVAL))
+    finally:
+        spectator.close()
+        publisher.close()
+        slot.close()
+    if reason == 'finished':
+        forget_game(game_id)
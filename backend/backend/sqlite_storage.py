@@ -0,0 +1,449 @@
+"""A SQLite stand-in for the MySQL database.
+
+The rest of the backend talks to storage through PyMySQL connections with
+``DictCursor`` cursors, and writes its queries in MySQL's dialect. This
+module provides connection and cursor objects with the same interface, which
+translate those queries for SQLite as they're executed, so ``Player``,
+``Game``, ``Property`` and the page handlers run unchanged against it.
+
+The schema is translated from ``initialise_server.sql`` rather than being
+kept as a second copy.
+
+connect_file() opens a database file in WAL mode, which is what the
+``sqlite`` storage engine uses: readers never wait for the writer, and each
+CGI process opens the file directly, so no database server is needed.
+"""
+
+import fcntl
+import os
+import re
+import sqlite3
+
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))),
+    'initialise_server.sql')
+
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# How long to wait for another process's write transaction, in seconds.
+BUSY_TIMEOUT = 5
+
+# Database files this process has already checked for a schema.
+_INITIALISED = set()
+
+
+def translate_query(query, args=None):
+    """Translate a query written for PyMySQL into one for sqlite3.
+
+    Placeholders become qmarks, double-quoted strings become single-quoted
+    strings, and the handful of MySQL-only constructs the backend uses are
+    rewritten.
+
+    >>> translate_query('SELECT * FROM `players` WHERE `id` = %s;', (1,))
+    'SELECT * FROM `players` WHERE `id` = ?;'
+    >>> translate_query('SELECT * FROM cards WHERE state = "owned";')
+    "SELECT * FROM cards WHERE state = 'owned';"
+    >>> translate_query("SELECT '100%%' FROM t WHERE a = %s", (1,))
+    "SELECT '100%' FROM t WHERE a = ?"
+    >>> translate_query('SELECT LAST_INSERT_ID();')
+    'SELECT last_insert_rowid() AS `LAST_INSERT_ID()`;'
+    >>> translate_query('INSERT INTO `games` () VALUES ();')
+    'INSERT INTO `games` DEFAULT VALUES;'
+    """
+    out = []
+    i = 0
+    length = len(query)
+    while i < length:
+        char = query[i]
+        if char in '\'"`':
+            end = i + 1
+            while end < length:
+                if query[end] == '\\' and char != '`':
+                    end += 2
+                    continue
+                if query[end] == char:
+                    if end + 1 < length and query[end + 1] == char:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            literal = query[i:end + 1]
+            if args is not None:
+                literal = literal.replace('%%', '%')
+            if char == '"':
+                literal = "'{}'".format(
+                    literal[1:-1].replace('""', '"').replace("'", "''"))
+            out.append(literal)
+            i = end + 1
+        elif char == '%' and args is not None and i + 1 < length:
+            out.append('?' if query[i + 1] == 's' else query[i + 1])
+            i += 2
+        else:
+            out.append(char)
+            i += 1
+    translated = ''.join(out)
+    translated = translated.replace(
+        'LAST_INSERT_ID()', 'last_insert_rowid() AS `LAST_INSERT_ID()`')
+    translated = re.sub(r'\(\s*\)\s*VALUES\s*\(\s*\)', 'DEFAULT VALUES',
+                        translated)
+    return translated
+
+
+def translate_schema(schema):
+    """Translate the MySQL schema in initialise_server.sql for SQLite.
+
+    >>> print(translate_schema('''CREATE TABLE IF NOT EXISTS games (
+    ...     id int UNSIGNED NOT NULL AUTO_INCREMENT,
+    ...     state ENUM('waiting', 'playing') NOT NULL,
+    ...     PRIMARY KEY (id)
+    ... );'''))
+    CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        state TEXT CHECK (state IN ('waiting', 'playing')) NOT NULL
+    );
+    """
+    auto_increment = set(re.findall(
+        r'^\s*(\w+)\s.*AUTO_INCREMENT', schema, re.MULTILINE))
+    schema = re.sub(r'^(\s*)(\w+)\s.*AUTO_INCREMENT.*?(,?)$',
+                    r'\1\2 INTEGER PRIMARY KEY AUTOINCREMENT\3',
+                    schema, flags=re.MULTILINE)
+    for column in auto_increment:
+        schema = re.sub(r',\s*PRIMARY KEY \({}\)'.format(column), '',
+                        schema)
+    schema = re.sub(r'(\w+) ENUM\(([^)]*)\)', r'\1 TEXT CHECK (\1 IN (\2))',
+                    schema)
+    schema = re.sub(r'CHARACTER SET \w+ ', '', schema)
+    schema = re.sub(r' UNSIGNED', '', schema)
+    return re.sub(r'"([^"]*)"',
+                  lambda match: "'{}'".format(
+                      match.group(1).replace("'", "''")),
+                  schema)
+
+
+def _normalise_args(args):
+    """PyMySQL accepts a lone value in place of a sequence of arguments."""
+    if args is None:
+        return ()
+    if isinstance(args, (tuple, list, dict)):
+        return args
+    return (args,)
+
+
+def _column_name(description):
+    """Column names as MySQL reports them, e.g. `(state)` is state."""
+    name = description[0]
+    while name.startswith('(') and name.endswith(')'):
+        name = name[1:-1]
+    return name.strip('`')
+
+
+def _literal(value):
+    """Render a value as an SQL literal, for mogrify."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+class Cursor(object):
+    """A cursor with the interface of a PyMySQL DictCursor."""
+    def __init__(self, connection):
+        self._connection = connection
+        self._rows = iter(())
+        self.rowcount = -1
+        self.lastrowid = None
+        self.description = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Release the rows held by the cursor."""
+        self._rows = iter(())
+
+    def mogrify(self, query, args=None):
+        """Return the query with its arguments inlined as literals."""
+        if args is None:
+            return query
+        args = _normalise_args(args)
+        return query % tuple(_literal(arg) for arg in args)
+
+    def execute(self, query, args=None):
+        """Execute a single query written for PyMySQL."""
+        sql = translate_query(query, args)
+        params = _normalise_args(args)
+        self._connection.before_statement(sql)
+        cursor = self._connection.raw.execute(sql, params)
+        self._store(cursor)
+        return self.rowcount
+
+    def executemany(self, query, args):
+        """Execute a query once for each set of arguments."""
+        args = [_normalise_args(arg) for arg in args]
+        if not args:
+            return 0
+        sql = translate_query(query, args[0])
+        self._connection.before_statement(sql)
+        cursor = self._connection.raw.executemany(sql, args)
+        self._store(cursor)
+        return self.rowcount
+
+    def _store(self, cursor):
+        self.lastrowid = cursor.lastrowid
+        self.description = cursor.description
+        if cursor.description is None:
+            self._rows = iter(())
+            self.rowcount = cursor.rowcount
+        else:
+            names = [_column_name(column) for column in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+            self._rows = iter(rows)
+            self.rowcount = len(rows)
+
+    def fetchone(self):
+        """Return the next row as a dictionary, or None."""
+        return next(self._rows, None)
+
+    def fetchall(self):
+        """Return all remaining rows as a list of dictionaries."""
+        rows = list(self._rows)
+        return rows
+
+
+class Connection(object):
+    """A connection with the interface of a PyMySQL connection.
+
+    sqlite3 connections are used in autocommit mode, and a write
+    transaction is only opened when the first write is made after begin().
+    This mirrors the way the backend nests Player/Game/Property contexts,
+    each with its own connection: the inner contexts read, write and commit
+    before the outer ones write, which would otherwise have to wait on (or
+    be invalidated by) the outer connection's read snapshot.
+
+    Arguments:
+        raw: The sqlite3 connection to wrap.
+        shared: If True, closing this connection leaves raw open, so that
+            several connection objects can share one in-memory database.
+    """
+    def __init__(self, raw, shared=False):
+        self.raw = raw
+        self._shared = shared
+        self._owns_transaction = False
+
+    def cursor(self):
+        """Return a new DictCursor-like cursor."""
+        return Cursor(self)
+
+    def before_statement(self, sql):
+        """Open a write transaction before the first write statement."""
+        if (sql.lstrip().upper().startswith(_WRITE_STATEMENTS) and
+                not self.raw.in_transaction):
+            self.raw.execute('BEGIN IMMEDIATE;')
+            self._owns_transaction = True
+
+    def begin(self):
+        """Start a transaction; it's actually opened by the first write."""
+
+    def commit(self):
+        """Commit the write transaction, if this connection opened one."""
+        if self._owns_transaction and self.raw.in_transaction:
+            self.raw.execute('COMMIT;')
+        self._owns_transaction = False
+
+    def rollback(self):
+        """Roll back the write transaction, if this connection opened one."""
+        if self._owns_transaction and self.raw.in_transaction:
+            self.raw.execute('ROLLBACK;')
+        self._owns_transaction = False
+
+    def close(self):
+        """Close the connection, rolling back anything not committed."""
+        self.rollback()
+        if not self._shared:
+            self.raw.close()
+
+
+def load_schema(raw, path=SCHEMA_PATH):
+    """Create the tables and reference data from initialise_server.sql.
+
+    Arguments:
+        raw: The sqlite3 connection to create the schema with.
+        path: The location of initialise_server.sql.
+    """
+    with open(path, encoding='utf-8') as schema:
+        raw.executescript(translate_schema(schema.read()))
+
+
+class Snapshot(object):  # pylint: disable=too-few-public-methods
+    """The contents of a MemoryDatabase at some point in time.
+
+    Rows are kept as the tuples sqlite3 returns, which are immutable, so
+    snapshots and the lists in them can be shared freely: restoring one
+    snapshot into several databases doesn't copy it.
+
+    Attributes:
+        schema: The statements creating the tables and indexes.
+        rows: A dictionary mapping table names to lists of rows.
+    """
+    def __init__(self, schema, rows):
+        self.schema = schema
+        self.rows = rows
+
+
+class MemoryDatabase(object):
+    """A seeded in-memory database, shared by every connection made to it.
+
+    >>> database = MemoryDatabase()
+    >>> conn = database.connect()
+    >>> with conn.cursor() as cursor:
+    ...     cursor.execute('SELECT name FROM property_values '
+    ...                    'WHERE property_position = %s;', (39))
+    ...     cursor.fetchone()
+    1
+    {'name': 'Mayfair'}
+    >>> conn.close()
+
+    A seeded world can be snapshotted, and then either forked into a new
+    database or restored over whatever has happened since:
+
+    >>> conn = database.connect()
+    >>> with conn.cursor() as cursor:
+    ...     cursor.execute('INSERT INTO players (username) VALUES (%s);', 'a')
+    ...     conn.commit()
+    1
+    >>> seeded = database.snapshot()
+    >>> with conn.cursor() as cursor:
+    ...     cursor.execute('INSERT INTO players (username) VALUES (%s);', 'b')
+    ...     conn.commit()
+    1
+    >>> fork = MemoryDatabase(snapshot=seeded)
+    >>> database.restore(seeded)
+    >>> len(database.snapshot().rows['players'])
+    1
+    >>> fork.snapshot().rows['players'] == seeded.rows['players']
+    True
+    >>> conn.close()
+
+    Arguments:
+        path: The location of initialise_server.sql.
+        snapshot: If given, the database starts as a copy of this snapshot
+            instead of from the schema.
+    """
+    def __init__(self, path=SCHEMA_PATH, snapshot=None):
+        self.raw = sqlite3.connect(':memory:', isolation_level=None)
+        if snapshot is None:
+            load_schema(self.raw, path)
+        else:
+            for statement in snapshot.schema:
+                self.raw.execute(statement)
+            self.restore(snapshot)
+
+    def connect(self):
+        """Return a new connection to the database."""
+        return Connection(self.raw, shared=True)
+
+    def _tables(self):
+        return [row[0] for row in self.raw.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "ORDER BY name;")]
+
+    def snapshot(self):
+        """Return a Snapshot of everything committed to the database."""
+        schema = [row[0] for row in self.raw.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL "
+            "AND name NOT LIKE 'sqlite_%' ORDER BY type DESC, name;")]
+        rows = {table: self.raw.execute(
+            'SELECT * FROM `{}`;'.format(table)).fetchall()
+                for table in self._tables()}
+        return Snapshot(schema, rows)
+
+    def restore(self, snapshot):
+        """Replace the contents of every table with those in a snapshot.
+
+        The snapshot must have been taken from a database with the same
+        schema.
+        """
+        self.raw.execute('BEGIN IMMEDIATE;')
+        try:
+            for table in self._tables():
+                self.raw.execute('DELETE FROM `{}`;'.format(table))
+            for table, rows in snapshot.rows.items():
+                if rows:
+                    self.raw.executemany(
+                        'INSERT INTO `{}` VALUES ({});'.format(
+                            table, ', '.join('?' * len(rows[0]))),
+                        rows)
+        except Exception:
+            self.raw.execute('ROLLBACK;')
+            raise
+        self.raw.execute('COMMIT;')
+
+
+def initialise_file(path, schema_path=SCHEMA_PATH):
+    """Switch a database file to WAL mode and create the schema in it, if
+    that hasn't been done already.
+
+    The check is made while holding a lock on ``<path>.lock``, so that when
+    several processes start against a new file only one creates the schema.
+
+    Arguments:
+        path: The location of the database file.
+        schema_path: The location of initialise_server.sql.
+    """
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        raw = sqlite3.connect(path, timeout=BUSY_TIMEOUT,
+                              isolation_level=None)
+        try:
+            raw.execute('PRAGMA journal_mode=WAL;')
+            tables = raw.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "AND name = 'players';").fetchall()
+            if not tables:
+                load_schema(raw, schema_path)
+        finally:
+            raw.close()
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def connect_file(path, schema_path=SCHEMA_PATH):
+    """Open a connection to a database file, creating it if necessary.
+
+    >>> import tempfile, os
+    >>> path = os.path.join(tempfile.mkdtemp(), 'monopoly.sqlite3')
+    >>> conn = connect_file(path)
+    >>> with conn.cursor() as cursor:
+    ...     cursor.execute('INSERT INTO `players` (`username`) VALUES (%s);',
+    ...                    ('a'))
+    ...     conn.commit()
+    ...     cursor.execute('PRAGMA journal_mode;')
+    ...     cursor.fetchone()
+    1
+    1
+    {'journal_mode': 'wal'}
+    >>> conn.close()
+    >>> conn = connect_file(path)
+    >>> with conn.cursor() as cursor:
+    ...     cursor.execute('SELECT COUNT(*) AS n FROM players;')
+    ...     cursor.fetchone()
+    1
+    {'n': 1}
+    >>> conn.close()
+
+    Arguments:
+        path: The location of the database file.
+        schema_path: The location of initialise_server.sql.
+    """
+    if path not in _INITIALISED:
+        initialise_file(path, schema_path)
+        _INITIALISED.add(path)
+    raw = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    # In WAL mode, NORMAL only syncs at checkpoints: a power cut can lose the
+    # last few commits, but never corrupts the database.
+    raw.execute('PRAGMA synchronous=NORMAL;')
+    return Connection(raw)
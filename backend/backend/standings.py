@@ -0,0 +1,304 @@
+"""The standings of each game: every player's cash, assets and place.
+
+Working out who's winning from scratch means summing every player's balance,
+property prices and buildings. Instead, the ``standings`` table keeps, for
+each player in a game, their cash, the value of their assets, their net
+worth and their place, and every write that changes a balance or a property
+adjusts it in its own transaction (adjust()). Reading the standings is then
+one range of the table's primary key.
+
+An asset is worth its price, or half of it if it's mortgaged, plus what was
+paid for its buildings (see asset_value()); players with the same net worth
+share a place.
+
+The table can be checked against, and rebuilt from, the players and
+properties tables::
+
+    python -m backend.standings check [GAME_ID ...]
+    python -m backend.standings check --repair [GAME_ID ...]
+"""
+
+import argparse
+import json
+import sys
+
+import backend.conditional
+import backend.game
+import backend.levels
+import backend.storage
+from backend.entry_point import entry_point
+
+
+def asset_value(price, house_price, level, mortgaged):
+    """Return what a property is worth to its owner.
+
+    Arguments:
+        price: The property's purchase price.
+        house_price: The price of each of its houses.
+        level: Its building level (see backend.levels.level()).
+        mortgaged: Whether it's mortgaged.
+
+    >>> asset_value(200, 100, 2, False), asset_value(60, 50, 0, True)
+    (400, 30)
+    """
+    return (price // 2 if mortgaged else price) + level * house_price
+
+
+def places(net_worths):
+    """Return each player's place, from their net worths.
+
+    >>> places({7: 1500, 8: 1700, 9: 1500, 10: 900}) == {
+    ...     8: 1, 7: 2, 9: 2, 10: 4}
+    True
+    """
+    ordered = sorted(net_worths.values(), reverse=True)
+    return {player_id: ordered.index(net_worth) + 1
+            for player_id, net_worth in net_worths.items()}
+
+
+def rerank(cursor, game_id):
+    """Update the places in a game's standings, after a change to them."""
+    cursor.execute('SELECT `player_id`, `net_worth`, `place` '
+                   'FROM `standings` WHERE `game_id` = %s;', (game_id,))
+    rows = cursor.fetchall()
+    new_places = places({row['player_id']: row['net_worth'] for row in rows})
+    changed = [(new_places[row['player_id']], game_id, row['player_id'])
+               for row in rows if new_places[row['player_id']] != row['place']]
+    if changed:
+        cursor.executemany('UPDATE `standings` SET `place` = %s '
+                           'WHERE `game_id` = %s AND `player_id` = %s;',
+                           changed)
+
+
+def adjust(cursor, game_id, changes):
+    """Apply some changes in cash and assets to a game's standings.
+
+    Arguments:
+        cursor: The cursor of the transaction making the changes.
+        game_id: The id of the game.
+        changes: A dictionary mapping player ids to the (cash, assets) they
+            gained, or lost if negative.
+    """
+    changes = {player_id: change for player_id, change in changes.items()
+               if any(change)}
+    if not changes:
+        return
+    cursor.executemany('UPDATE `standings` '
+                       'SET `cash` = `cash` + %s, `assets` = `assets` + %s, '
+                       '`net_worth` = `net_worth` + %s '
+                       'WHERE `game_id` = %s AND `player_id` = %s;',
+                       [(cash, assets, cash + assets, game_id, player_id)
+                        for player_id, (cash, assets)
+                        in sorted(changes.items())])
+    rerank(cursor, game_id)
+
+
+def adjust_cash(cursor, game_ids, player_id, cash):
+    """Apply a change in a player's balance to the standings of the games
+    they're in.
+
+    Arguments:
+        game_ids: The ids of the games the player is in.
+    """
+    if not cash:
+        return
+    for game_id in game_ids:
+        adjust(cursor, game_id, {player_id: (cash, 0)})
+
+
+def remove_player(cursor, game_id, player_id, heir=None):
+    """Remove a player who has left a game from its standings.
+
+    Arguments:
+        heir: The id of the player who has been given their properties, if
+            anyone has.
+    """
+    cursor.execute('SELECT `assets` FROM `standings` '
+                   'WHERE `game_id` = %s AND `player_id` = %s;',
+                   (game_id, player_id))
+    row = cursor.fetchone()
+    cursor.execute('DELETE FROM `standings` '
+                   'WHERE `game_id` = %s AND `player_id` = %s;',
+                   (game_id, player_id))
+    if heir is not None and row is not None and row['assets']:
+        adjust(cursor, game_id, {heir: (0, row['assets'])})
+    else:
+        rerank(cursor, game_id)
+
+
+def compute(cursor, game_id):
+    """Work out a game's standings from the players and properties tables.
+
+    Returns:
+        A dictionary mapping each player's id to their 'cash', 'assets',
+        'net_worth' and 'place'.
+    """
+    cursor.execute('SELECT `players`.`id`, `players`.`balance` '
+                   'FROM `playing_in` INNER JOIN `players` '
+                   'ON `playing_in`.`player_id` = `players`.`id` '
+                   'WHERE `playing_in`.`game_id` = %s;', (game_id,))
+    result = {row['id']: {'cash': row['balance'], 'assets': 0}
+              for row in cursor.fetchall()}
+    cursor.execute('SELECT `properties`.`player_id`, '
+                   '`properties`.`mortgaged`, `properties`.`house_count`, '
+                   '`properties`.`hotel_count`, '
+                   '`property_values`.`purchase_price`, '
+                   '`property_values`.`house_price` '
+                   'FROM `properties` INNER JOIN `property_values` '
+                   'ON `properties`.`property_position` = '
+                   '`property_values`.`property_position` '
+                   'WHERE `properties`.`game_id` = %s '
+                   'AND `properties`.`state` = "owned";', (game_id,))
+    for row in cursor.fetchall():
+        if row['player_id'] in result:
+            result[row['player_id']]['assets'] += asset_value(
+                row['purchase_price'], row['house_price'],
+                backend.levels.level(row['house_count'], row['hotel_count']),
+                row['mortgaged'] == 'mortgaged')
+    for standing in result.values():
+        standing['net_worth'] = standing['cash'] + standing['assets']
+    for player_id, place in places({player_id: standing['net_worth']
+                                    for player_id, standing
+                                    in result.items()}).items():
+        result[player_id]['place'] = place
+    return result
+
+
+def read_standings(cursor, game_id):
+    """Return a game's standings, in order of place.
+
+    Returns:
+        A list of dictionaries, each with a player's 'player_id',
+        'username', 'cash', 'assets', 'net_worth' and 'place'.
+    """
+    cursor.execute('SELECT `standings`.`player_id`, `players`.`username`, '
+                   '`standings`.`cash`, `standings`.`assets`, '
+                   '`standings`.`net_worth`, `standings`.`place` '
+                   'FROM `standings` INNER JOIN `players` '
+                   'ON `standings`.`player_id` = `players`.`id` '
+                   'WHERE `standings`.`game_id` = %s '
+                   'ORDER BY `standings`.`place`, `standings`.`player_id`;',
+                   (game_id,))
+    return cursor.fetchall()
+
+
+def check(cursor, game_id):
+    """Compare a game's standings with the players and properties tables.
+
+    Returns:
+        [int]: the ids of the players whose standings are wrong or missing,
+            or who have standings but aren't in the game.
+    """
+    expected = compute(cursor, game_id)
+    cursor.execute('SELECT `player_id`, `cash`, `assets`, `net_worth`, '
+                   '`place` FROM `standings` WHERE `game_id` = %s;',
+                   (game_id,))
+    actual = {row.pop('player_id'): row for row in cursor.fetchall()}
+    return sorted(player_id for player_id in set(expected) | set(actual)
+                  if expected.get(player_id) != actual.get(player_id))
+
+
+def rebuild(cursor, game_id):
+    """Replace a game's standings with those worked out by compute()."""
+    cursor.execute('DELETE FROM `standings` WHERE `game_id` = %s;',
+                   (game_id,))
+    standings = compute(cursor, game_id)
+    if standings:
+        cursor.executemany('INSERT INTO `standings` (`game_id`, `player_id`, '
+                           '`cash`, `assets`, `net_worth`, `place`) '
+                           'VALUES (%s, %s, %s, %s, %s, %s);',
+                           [(game_id, player_id, standing['cash'],
+                             standing['assets'], standing['net_worth'],
+                             standing['place'])
+                            for player_id, standing
+                            in sorted(standings.items())])
+
+
+backend.game.PLAYERS_CHANGED.append(rebuild)
+
+
+def check_games(game_ids=None, repair=False):
+    """Check the standings of some games, each in its own transaction.
+
+    Arguments:
+        game_ids: The ids of the games to check, or None for every game
+            that isn't pooled.
+        repair: If True, rebuild the standings of the games that are wrong.
+
+    Returns:
+        A dictionary mapping the id of each game whose standings were wrong
+        to the players they were wrong for.
+    """
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            if game_ids is None:
+                cursor.execute('SELECT `id` FROM `games` '
+                               'WHERE `state` != "pooled" ORDER BY `id`;')
+                game_ids = [row['id'] for row in cursor.fetchall()]
+            wrong = {}
+            for game_id in game_ids:
+                conn.begin()
+                players = check(cursor, game_id)
+                if players:
+                    wrong[game_id] = players
+                    if repair:
+                        rebuild(cursor, game_id)
+                        backend.game.touch_game(cursor, game_id)
+                conn.commit()
+        return wrong
+    finally:
+        conn.close()
+
+
+@entry_point('standings')
+def request_standings(source=sys.stdin, output=sys.stdout):
+    """Entry point for the service of requesting a game's standings.
+
+    Like game_snapshot, the response is labelled with the game's version,
+    and answered with 304 Not Modified if the client already has it.
+    """
+    request = json.load(source)
+    game_id = request['game_id']
+    version, updated_at = backend.game.game_version(game_id) or (0, 0)
+    etag = backend.conditional.make_etag('standings', game_id, version)
+    if backend.conditional.not_modified(etag):
+        backend.conditional.respond(output, etag, updated_at, None)
+        return
+    conn = backend.storage.make_connection()
+    try:
+        with conn.cursor() as cursor:
+            standings = read_standings(cursor, game_id)
+    finally:
+        conn.close()
+    backend.conditional.respond(
+        output, etag, updated_at,
+        lambda: json.dumps({'game_id': game_id, 'version': version,
+                            'standings': standings}, sort_keys=True))
+
+
+def main():
+    """Check the standings, and optionally repair them."""
+    parser = argparse.ArgumentParser(
+        description='Check the standings table against the games.')
+    commands = parser.add_subparsers(dest='command')
+    check_parser = commands.add_parser('check', help='check the standings')
+    check_parser.add_argument('--repair', action='store_true',
+                              help='rebuild the standings that are wrong')
+    check_parser.add_argument('game_ids', type=int, nargs='*')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        wrong = check_games(args.game_ids or None, args.repair)
+        for game_id, players in sorted(wrong.items()):
+            print('Game {}: wrong for players {}{}'.format(
+                game_id, ', '.join(map(str, players)),
+                ' (rebuilt)' if args.repair else ''))
+        if wrong and not args.repair:
+            parser.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
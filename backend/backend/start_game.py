@@ -9,11 +9,13 @@ import sys
 import cgitb
 import backend.game
 import backend.player
+from backend.entry_point import entry_point
 
 
 cgitb.enable()
 
 
+@entry_point('start-game')
 def start_game(source=sys.stdin, output=sys.stdout):
     """Updates a requested game's state to 'playing' by
        its game id.
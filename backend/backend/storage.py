@@ -1,10 +1,213 @@
-"""Module implementing storage for the app"""
+"""Module implementing storage for the app
+
+Connections returned by make_connection() are wrapped so that every
+statement sent through them is counted and timed:
+
+- Statements slower than ``MONOPOLY_SLOW_QUERY_SECONDS`` (0.1 by default)
+  are logged, with their normalised text and the line that issued them, to
+  the ``backend.storage`` logger (stderr, or ``MONOPOLY_SLOW_QUERY_LOG``).
+- If ``MONOPOLY_N_PLUS_ONE`` is set to K, a warning is logged the first time
+  the same normalised statement runs more than K times in one request.
+
+Faults and latency configured with ``MONOPOLY_FAULTS`` are also injected
+here, whichever engine is in use (see backend.faults).
+
+A request is a whole process for ordinary pages; long-running pages (such as
+the event stream) call reset_request_statistics() to start a new one.
+
+The database itself is chosen with ``MONOPOLY_STORAGE``:
+
+- ``mysql`` (the default): the local MySQL server.
+- ``sqlite``: an SQLite file in WAL mode, ``MONOPOLY_SQLITE_PATH`` (by
+  default ``/tmp/monopoly.sqlite3``), created from initialise_server.sql the
+  first time it's used. See backend.sqlite_storage.
+- ``memory``: an in-memory database private to this process, for tests,
+  simulations and benchmarks. See memory_database().
+
+Code that needs several operations to succeed or fail together runs them in
+a transaction() block. Every connection made inside it is the block's own,
+so the Player, Game and Property contexts (which each open a connection and
+commit) all join the one transaction, which is committed when the block
+ends.
+"""
+
+import contextlib
+import logging
+import os
+import re
+import time
+import traceback
 
 import pymysql.cursors
 
+import backend.config
+import backend.faults
+import backend.sqlite_storage
 
-def make_connection():
-    """Create a connection object to the monopoly database."""
+LOGGER = logging.getLogger(__name__)
+
+# Running totals for this process, read by backend.metrics.
+STATISTICS = {'connections': 0, 'statements': 0, 'statement_seconds': 0.0}
+
+# Statement counts for the current request, by normalised statement.
+_REQUEST_STATEMENTS = {}
+
+_LOG_CONFIGURED = []
+
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|"
+                       r"\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalise_query(query):
+    """Reduce a statement to its shape, so that statements which differ
+    only in their values can be grouped together.
+
+    >>> normalise_query("SELECT * FROM `properties` WHERE `game_id` = 12\\n"
+    ...                 " AND `property_position` IN (1, 3);")
+    'SELECT * FROM `properties` WHERE `game_id` = ? AND \
+`property_position` IN (...);'
+    >>> normalise_query("SELECT * FROM players WHERE id = %s")
+    'SELECT * FROM players WHERE id = ?'
+    >>> normalise_query("UPDATE p SET name = 'O''Neil' WHERE id = 3")
+    'UPDATE p SET name = ? WHERE id = ?'
+    """
+    query = query.replace('%s', '?')
+    query = _LITERALS.sub('?', query)
+    query = _LISTS.sub('(...)', query)
+    return _WHITESPACE.sub(' ', query).strip()
+
+
+def call_site():
+    """Return 'file:line' for the innermost caller outside this module."""
+    for frame in reversed(traceback.extract_stack()):
+        if not frame[0].endswith('storage.py'):
+            return '{}:{}'.format(os.path.basename(frame[0]), frame[1])
+    return 'unknown'
+
+
+def logger():
+    """Return the storage logger, configured on first use."""
+    if not _LOG_CONFIGURED:
+        _LOG_CONFIGURED.append(True)
+        path = backend.config.get('SLOW_QUERY_LOG')
+        if path:
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter(
+                '%(asctime)s %(process)d %(levelname)s %(message)s'))
+            LOGGER.addHandler(handler)
+    return LOGGER
+
+
+def reset_request_statistics():
+    """Start a new request, as far as the N+1 detector is concerned."""
+    _REQUEST_STATEMENTS.clear()
+
+
+def record_statement(query, seconds):
+    """Account for a statement that has just been executed.
+
+    Arguments:
+        query: The text of the statement.
+        seconds: How long the statement took.
+    """
+    STATISTICS['statements'] += 1
+    STATISTICS['statement_seconds'] += seconds
+    threshold = backend.config.get_float('SLOW_QUERY_SECONDS', 0.1)
+    repeat_limit = backend.config.get_int('N_PLUS_ONE', 0)
+    if seconds < threshold and not repeat_limit:
+        return
+    normalised = normalise_query(query)
+    if seconds >= threshold:
+        logger().warning('slow query (%.3fs) at %s: %s',
+                         seconds, call_site(), normalised)
+    if repeat_limit:
+        count = _REQUEST_STATEMENTS.get(normalised, 0) + 1
+        _REQUEST_STATEMENTS[normalised] = count
+        if count == repeat_limit + 1:
+            logger().warning('possible N+1: statement run %d times in one '
+                             'request, latest at %s: %s',
+                             count, call_site(), normalised)
+
+
+class InstrumentedCursor(object):
+    """Wraps a cursor, accounting for every statement executed on it."""
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query, args=None):
+        """Execute a statement, timing it."""
+        start = time.perf_counter()
+        try:
+            backend.faults.before_statement(query)
+            return self._cursor.execute(query, args)
+        finally:
+            record_statement(query, time.perf_counter() - start)
+
+    def executemany(self, query, args):
+        """Execute a statement for each set of arguments, in one batch."""
+        start = time.perf_counter()
+        try:
+            backend.faults.before_statement(query)
+            return self._cursor.executemany(query, args)
+        finally:
+            record_statement(query, time.perf_counter() - start)
+
+    def on_commit(self, function):
+        """Call a function once the cursor's changes have been committed."""
+        self._connection.on_commit(function)
+
+
+class InstrumentedConnection(object):
+    """Wraps a connection so that its cursors are instrumented."""
+    def __init__(self, connection):
+        self._connection = connection
+        # Functions to call once the current transaction is committed.
+        self._on_commit = []
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self):
+        """Return an instrumented cursor."""
+        return InstrumentedCursor(self._connection.cursor(), self)
+
+    def on_commit(self, function):
+        """Call a function once the current transaction is committed, or
+        forget it if the transaction is rolled back."""
+        self._on_commit.append(function)
+
+    def commit(self):
+        """Commit the current transaction, then call the functions waiting
+        for it."""
+        self._connection.commit()
+        functions, self._on_commit = self._on_commit, []
+        for function in functions:
+            function()
+
+    def rollback(self):
+        """Roll back the current transaction."""
+        self._on_commit = []
+        self._connection.rollback()
+
+
+DEFAULT_SQLITE_PATH = '/tmp/monopoly.sqlite3'
+
+
+def connect_mysql():
+    """Open a connection to the local MySQL server."""
     return pymysql.connect(host='localhost',
                            user='root',
                            password='',
@@ -13,6 +216,120 @@ def make_connection():
                            cursorclass=pymysql.cursors.DictCursor)
 
 
+def connect_sqlite():
+    """Open a connection to the SQLite database file."""
+    return backend.sqlite_storage.connect_file(
+        backend.config.get('SQLITE_PATH', DEFAULT_SQLITE_PATH))
+
+
+_MEMORY_DATABASE = []
+
+
+def memory_database():
+    """Return the database used by the memory engine, creating it the first
+    time it's needed.
+
+    Tests can take a snapshot of it once they've seeded it, and restore the
+    snapshot before each test::
+
+        seeded = backend.storage.memory_database().snapshot()
+        ...
+        backend.storage.memory_database().restore(seeded)
+    """
+    if not _MEMORY_DATABASE:
+        _MEMORY_DATABASE.append(backend.sqlite_storage.MemoryDatabase())
+    return _MEMORY_DATABASE[0]
+
+
+def connect_memory():
+    """Open a connection to this process's in-memory database."""
+    return memory_database().connect()
+
+
+# Functions opening a connection, by the name of the storage engine.
+ENGINES = {
+    'mysql': connect_mysql,
+    'sqlite': connect_sqlite,
+    'memory': connect_memory,
+}
+
+
+def open_connection():
+    """Open an uninstrumented connection to the monopoly database."""
+    return ENGINES[backend.config.get('STORAGE', 'mysql')]()
+
+
+class TransactionAborted(Exception):
+    """Raised if code inside a transaction() block tries to roll back,
+    which can only be done by the whole block."""
+
+
+class SharedConnection(object):
+    """The connection of a transaction() block, as handed to the code inside
+    it. Beginning, committing and closing are left to the block."""
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def begin(self):
+        """Do nothing, as the block's transaction is already open."""
+
+    def commit(self):
+        """Do nothing; the block commits when it ends."""
+
+    def rollback(self):
+        """Abort the block, which rolls back everything done in it."""
+        raise TransactionAborted('rollback inside a transaction() block')
+
+    def close(self):
+        """Do nothing; the block closes the connection when it ends."""
+
+
+_TRANSACTION = []
+
+
+@contextlib.contextmanager
+def transaction():
+    """Run a block of code in a single transaction.
+
+    Every connection made in the block shares it, and it's committed if the
+    block finishes, or rolled back if it raises. Blocks inside another
+    block join the outer one.
+
+    Yields:
+        The connection shared by the block.
+    """
+    if _TRANSACTION:
+        yield _TRANSACTION[-1]
+        return
+    conn = make_connection()
+    try:
+        conn.begin()
+        _TRANSACTION.append(SharedConnection(conn))
+        try:
+            yield _TRANSACTION[-1]
+        finally:
+            _TRANSACTION.pop()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def make_connection():
+    """Create a connection object to the monopoly database, or return the
+    current transaction()'s."""
+    if _TRANSACTION:
+        return _TRANSACTION[-1]
+    STATISTICS['connections'] += 1
+    backend.faults.before_connect()
+    return InstrumentedConnection(open_connection())
+
+
 def request_property(cls, in_context, table, name):
     """Helper function to implement requesting a property from
     the database."""
@@ -0,0 +1,126 @@
+"""Running streams of server-sent events.
+
+Every stream (the players' stream of a game in backend.events, the lobby's,
+the spectators' and the dashboard's) is a poll function run by run_stream(),
+which waits between its passes as the stream's backend.scheduler.Schedule
+says, keeps the connection alive with heartbeats, and ends the stream when
+the poll says it's finished, the client has gone, or it's been open long
+enough.
+"""
+
+import io
+import os
+import time
+
+import backend.config
+import backend.metrics
+import backend.scheduler
+import backend.storage
+
+# What a pass of a stream did (see run_stream()).
+CHANGED = backend.scheduler.CHANGED
+IDLE = backend.scheduler.IDLE
+FINISHED = backend.scheduler.FINISHED
+
+# How long a stream may send nothing before it sends a heartbeat comment.
+HEARTBEAT_INTERVAL = 15
+
+# How long a stream stays open, by default, in seconds.
+DEFAULT_MAX_LIFETIME = 60 * 60
+
+
+def run_stream(output_stream, poll, schedule, heartbeat=HEARTBEAT_INTERVAL,
+               sleep=time.sleep):
+    """Run a stream of server-sent events until it's finished, its client
+    has gone, or it's been open for ``MONOPOLY_SSE_MAX_LIFETIME`` seconds
+    (after which the browser reconnects, with the id of the last event it
+    saw).
+
+    Between passes the stream waits as long as its schedule says, or until
+    it's hinted that there's a change (see backend.scheduler.Schedule).
+    While nothing has been sent for heartbeat seconds, a comment is sent
+    instead, which keeps proxies from closing the connection, and finds out
+    if the client has gone.
+
+    Arguments:
+        output_stream: The stream to write the events to.
+        poll: A function called with output_stream on every pass, to send
+            any events, which returns CHANGED if it sent some, IDLE if not,
+            or FINISHED to end the stream.
+        schedule: The backend.scheduler.Schedule of the stream.
+
+    Returns:
+        str: why the stream ended: 'finished', 'disconnected' or 'expired'.
+
+    >>> import io, os
+    >>> os.environ['MONOPOLY_POLL_QPS'] = '0'
+    >>> results = iter([CHANGED, IDLE, IDLE, IDLE, CHANGED, FINISHED])
+    >>> waits = []
+    >>> output = io.StringIO()
+    >>> schedule = backend.scheduler.Schedule(
+    ...     'example', interval=1, max_interval=3, idle_after=0)
+    >>> run_stream(output, lambda output: next(results), schedule,
+    ...            heartbeat=0, sleep=waits.append)
+    'finished'
+    >>> waits, output.getvalue().count(': heartbeat')
+    ([1, 2, 3, 3, 1], 3)
+
+    A stream whose client has gone ends when it next writes to it:
+
+    >>> class Gone(io.StringIO):
+    ...     def flush(self):
+    ...         raise BrokenPipeError()
+    >>> run_stream(Gone(), lambda output: IDLE,
+    ...            backend.scheduler.Schedule('example'), sleep=waits.append)
+    'disconnected'
+    >>> del os.environ['MONOPOLY_POLL_QPS']
+    """
+    lifetime = backend.config.get_float('SSE_MAX_LIFETIME',
+                                        DEFAULT_MAX_LIFETIME)
+    started = last_write = time.time()
+    schedule.listen()
+    try:
+        while True:
+            schedule.throttle(sleep)
+            # Each pass of the loop counts as a request, so that repeated
+            # queries are reported per pass rather than for the whole stream.
+            backend.storage.reset_request_statistics()
+            result = poll(output_stream)
+            now = time.time()
+            if result == FINISHED:
+                reason = 'finished'
+                output_stream.flush()
+                break
+            if result == CHANGED:
+                last_write = now
+            elif now - last_write >= heartbeat:
+                output_stream.write(': heartbeat\n\n')
+                last_write = now
+
+            # Flush standard out which forcefully sends everything that
+            # might be buffered in standard out to the client.
+            output_stream.flush()
+            if now - started >= lifetime:
+                reason = 'expired'
+                break
+            schedule.sleep(schedule.next_wait(result, now), sleep)
+    except (BrokenPipeError, ConnectionResetError):
+        reason = 'disconnected'
+        discard_output(output_stream)
+    finally:
+        schedule.close()
+    backend.metrics.increment('monopoly_sse_streams_closed_total',
+                              stream=schedule.name, reason=reason)
+    return reason
+
+
+def discard_output(output_stream):
+    """Send anything still to be written to a stream whose client has gone
+    to /dev/null, so it doesn't raise again when it's flushed at exit."""
+    try:
+        fd = output_stream.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        return
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, fd)
+    os.close(devnull)
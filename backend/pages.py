@@ -7,10 +7,10 @@ pages = {
     'allocate_user_id': 'backend.allocate_user_id:request_user_id',
     'allocate_game_id': 'backend.allocate_game_id:request_game_id',
     'get_game_details': 'backend.request_game_details:request_game_details',
-    'game_event_source': 'backend.events:start_sse_stream',
+    'game_event_source': 'backend.game_stream:start_sse_stream',
     'roll_dice': 'backend.roll_die:player_roll_dice',
     'start-game': 'backend.start_game:start_game',
-    'game_event_source': 'backend.events:start_sse_stream',
+    'game_event_source': 'backend.game_stream:start_sse_stream',
     'join_game': 'backend.join_game:join_game',
     'increment_turn': 'backend.increment_turn:increment_turn',
     'request_players': 'backend.get_list_of_players:request_list_of_players',
@@ -20,4 +20,13 @@ pages = {
     'go_to_jail': 'backend.jail:go_to_jail',
     'buy_house': 'backend.buy_house:add_house',
     'buy_property': 'backend.properties:buy_property',
+    'metrics': 'backend.request_metrics:request_metrics',
+    'lobby_event_source': 'backend.lobby_events:start_lobby_stream',
+    'game_snapshot': 'backend.snapshot:request_game_snapshot',
+    'batch': 'backend.batch:batch',
+    'build_houses': 'backend.buy_house:build_houses',
+    'mortgage_properties': 'backend.property_state:mortgage_properties',
+    'standings': 'backend.standings:request_standings',
+    'spectator_event_source': 'backend.spectate:start_spectator_stream',
+    'dashboard_event_source': 'backend.dashboard:start_dashboard_stream',
 }
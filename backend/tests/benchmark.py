@@ -0,0 +1,314 @@
+"""Micro-benchmarks for the page handlers listed in pages.py.
+
+Every entry point is called in isolation, with ``io.StringIO`` objects as its
+``source`` and ``output``, against a freshly seeded world. For each handler
+the median wall time, the number of database round trips (statements
+executed) and the peak memory allocated per call are recorded.
+
+Run from ``team-software-project/backend/``::
+
+    python -m tests.benchmark run --engine memory --output after.json
+    python -m tests.benchmark run --engine mysql --output mysql.json
+    python -m tests.benchmark run --engine sqlite --output sqlite.json
+    python -m tests.benchmark compare before.json after.json
+
+``--engine mysql`` uses the local database that ``backend.storage`` connects
+to, so it should only be run against a development server. ``--engine
+sqlite`` uses the embedded SQLite engine, with a new database file in a
+temporary directory. ``--engine memory`` uses the SQLite stand-in from
+``backend.sqlite_storage`` in memory and needs no files at all.
+
+Faults set up with ``MONOPOLY_FAULTS`` (see ``backend.faults``) are
+injected into the handlers being benchmarked, so their effect on latency and
+errors can be measured.
+
+``compare`` exits with a non-zero status if any handler got slower by more
+than ``--threshold``, or started making more round trips. Comparing the
+results of two engines (``compare mysql.json sqlite.json``) shows which
+pages are slower on the second.
+"""
+
+import argparse
+import contextlib
+import importlib
+import inspect
+import io
+import json
+import platform
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import backend.faults
+import backend.storage
+from pages import pages
+
+# Handlers that can't be benchmarked as a single call.
+SKIPPED = {
+    'game_event_source': 'streams events until the client disconnects',
+    'lobby_event_source': 'streams events until the client disconnects',
+    'spectator_event_source': 'streams events until the client '
+                              'disconnects',
+    'dashboard_event_source': 'streams events until the client '
+                              'disconnects',
+}
+
+
+class World(object):  # pylint: disable=too-few-public-methods
+    """The ids of a seeded game, used to build requests for the handlers.
+
+    The game has four players and is in progress; the first player owns Old
+    Kent Road and the second is standing on it. There's also a second game
+    still waiting for players to join.
+    """
+    def __init__(self):
+        from backend.game import create_game
+        from backend.join_game import add_player
+        from backend.player import create_player, Player
+        from backend.properties import buy_property_db
+        from backend.start_game import start_game_db
+
+        suffix = random.randint(0, 10 ** 6)
+        self.players = [create_player('bench{}-{}'.format(suffix, number))
+                        for number in range(4)]
+        self.game = create_game(self.players[0])
+        for player in self.players[1:]:
+            add_player(player, self.game)
+        start_game_db(self.game)
+        buy_property_db(self.game, self.players[0], 1)
+        with Player(self.players[1]) as player:
+            player.board_position = 1
+        self.lobby = create_game(create_player('bench{}-host'.format(suffix)))
+        self._new_player = create_player
+
+    def new_player(self):
+        """Create a player who isn't in any game yet."""
+        return self._new_player('bench-joiner')
+
+
+# Functions building the request each handler is benchmarked with.
+REQUESTS = {
+    'example': lambda world: None,
+    'request_dice_roll': lambda world: {'player_id': world.players[0]},
+    'receive_client_username': lambda world: {'username': 'bench'},
+    'request_games_list': lambda world: None,
+    'allocate_user_id': lambda world: {'username': 'bench'},
+    'allocate_game_id': lambda world: {'host_id': world.players[0]},
+    'get_game_details': lambda world: {'game_id': world.game},
+    'game_snapshot': lambda world: {'game_id': world.game},
+    'standings': lambda world: {'game_id': world.game},
+    'roll_dice': lambda world: {'user_id': world.players[0]},
+    'start-game': lambda world: {'game_id': world.game},
+    'join_game': lambda world: {'user_id': world.new_player(),
+                                'game_id': world.lobby},
+    'increment_turn': lambda world: {'player_id': world.players[0]},
+    'request_players': lambda world: {'game_id': world.game},
+    'metrics': lambda world: None,
+    'property_state': lambda world: {
+        'player_id': ['None', 'None', world.players[0]]},
+    'charge_rent': lambda world: {'player_id': world.players[1]},
+    'leave_jail': lambda world: {'player_id': world.players[2]},
+    'go_to_jail': lambda world: {'player_id': world.players[2]},
+    'buy_house': lambda world: {'player_id': world.players[0],
+                                'property_name': 'Old Kent Road'},
+    'buy_property': lambda world: {'game_id': world.game,
+                                   'user_id': world.players[3],
+                                   'property_position': 3},
+    'build_houses': lambda world: {'game_id': world.game,
+                                   'player_id': world.players[0],
+                                   'levels': {'1': 1, '3': 1}},
+    'mortgage_properties': lambda world: {'game_id': world.game,
+                                          'player_id': world.players[0],
+                                          'mortgages': {'1': True}},
+    'batch': lambda world: {'actions': [
+        {'action': 'buy_property',
+         'request': {'game_id': world.game, 'user_id': world.players[0],
+                     'property_position': 3}},
+        {'action': 'buy_house',
+         'request': {'player_id': world.players[0],
+                     'property_name': 'Old Kent Road'}},
+        {'action': 'increment_turn',
+         'request': {'player_id': world.players[0]}}]},
+}
+
+
+def load_handler(page):
+    """Import the function behind one of the pages."""
+    module, function = pages[page].split(':')
+    return getattr(importlib.import_module(module), function)
+
+
+def call_handler(handler, request):
+    """Call a handler the way its console script would, with the request
+    given as its input.
+
+    Handlers that read from ``source`` get the request as json; handlers
+    that take named arguments instead get them from the request.
+    """
+    parameters = inspect.signature(handler).parameters
+    output = io.StringIO()
+    if 'source' in parameters:
+        handler(io.StringIO(json.dumps(request)), output)
+    elif 'output' in parameters:
+        handler(output)
+    elif parameters:
+        handler(**request)
+    else:
+        with contextlib.redirect_stdout(output):
+            handler()
+    return output.getvalue()
+
+
+def benchmark_page(page, world, repeat):
+    """Benchmark a single page.
+
+    Returns:
+        A dictionary of the page's results.
+    """
+    handler = load_handler(page)
+    times = []
+    errors = 0
+    round_trips = 0
+    random.seed(0)
+    for _ in range(repeat):
+        request = REQUESTS[page](world)
+        statements = backend.storage.STATISTICS['statements']
+        start = time.perf_counter()
+        try:
+            call_handler(handler, request)
+        except Exception:  # pylint: disable=broad-except
+            errors += 1
+        times.append(time.perf_counter() - start)
+        round_trips = max(
+            round_trips,
+            backend.storage.STATISTICS['statements'] - statements)
+
+    request = REQUESTS[page](world)
+    tracemalloc.start()
+    try:
+        call_handler(handler, request)
+    except Exception:  # pylint: disable=broad-except
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times.sort()
+    return {
+        'wall_ms': times[len(times) // 2] * 1000,
+        'min_ms': times[0] * 1000,
+        'round_trips': round_trips,
+        'peak_kib': peak / 1024,
+        'errors': errors,
+    }
+
+
+def run(engine, repeat, only=None):
+    """Benchmark every page against the given storage engine.
+
+    Returns:
+        A dictionary of results, ready to be saved as json.
+    """
+    os.environ['MONOPOLY_STORAGE'] = engine
+    if engine == 'sqlite':
+        os.environ['MONOPOLY_SQLITE_PATH'] = os.path.join(
+            tempfile.mkdtemp(), 'benchmark.sqlite3')
+    # Faults are only injected into the handlers, not while seeding.
+    faults = os.environ.pop('MONOPOLY_FAULTS', None)
+    backend.faults.reset()
+    world = World()
+    if faults is not None:
+        os.environ['MONOPOLY_FAULTS'] = faults
+        backend.faults.reset()
+    # Each page starts from the seeded world, when that's cheap to do.
+    seeded = None
+    if engine == 'memory':
+        seeded = backend.storage.memory_database().snapshot()
+    results = {}
+    for page in sorted(pages):
+        if page in SKIPPED or (only and page not in only):
+            continue
+        if seeded is not None:
+            backend.storage.memory_database().restore(seeded)
+        results[page] = benchmark_page(page, world, repeat)
+        print('{:<24} {:9.3f} ms {:4d} round trips {:9.1f} KiB'.format(
+            page, results[page]['wall_ms'],
+            results[page]['round_trips'],
+            results[page]['peak_kib']), file=sys.stderr)
+    return {
+        'engine': engine,
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'time': time.time(),
+        'skipped': SKIPPED,
+        'results': results,
+    }
+
+
+def compare(before, after, threshold):
+    """Find the pages that regressed between two sets of results.
+
+    >>> compare({'results': {'a': {'wall_ms': 10, 'round_trips': 3}}},
+    ...         {'results': {'a': {'wall_ms': 13, 'round_trips': 3}}}, 0.2)
+    ['a: wall time 10.000 ms -> 13.000 ms (+30%)']
+    >>> compare({'results': {'a': {'wall_ms': 10, 'round_trips': 3}}},
+    ...         {'results': {'a': {'wall_ms': 9, 'round_trips': 4}}}, 0.2)
+    ['a: round trips 3 -> 4']
+
+    Returns:
+        A list of descriptions of the regressions.
+    """
+    regressions = []
+    for page, new in sorted(after['results'].items()):
+        old = before['results'].get(page)
+        if old is None:
+            continue
+        if new['wall_ms'] > old['wall_ms'] * (1 + threshold):
+            regressions.append(
+                '{}: wall time {:.3f} ms -> {:.3f} ms (+{:.0f}%)'.format(
+                    page, old['wall_ms'], new['wall_ms'],
+                    100 * (new['wall_ms'] / old['wall_ms'] - 1)))
+        if new['round_trips'] > old['round_trips']:
+            regressions.append('{}: round trips {} -> {}'.format(
+                page, old['round_trips'], new['round_trips']))
+    return regressions
+
+
+def main():
+    """Parse the command line and run or compare benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='benchmark the handlers')
+    run_parser.add_argument('--engine', choices=['memory', 'sqlite', 'mysql'],
+                            default='memory')
+    run_parser.add_argument('--repeat', type=int, default=20)
+    run_parser.add_argument('--output', default='benchmark.json')
+    run_parser.add_argument('pages', nargs='*',
+                            help='only benchmark these pages')
+    compare_parser = commands.add_parser(
+        'compare', help='flag regressions between two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='fractional slowdown to flag')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(args.engine, args.repeat, args.pages)
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    elif args.command == 'compare':
+        with open(args.before) as before, open(args.after) as after:
+            regressions = compare(json.load(before), json.load(after),
+                                  args.threshold)
+        for regression in regressions:
+            print(regression)
+        sys.exit(1 if regressions else 0)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Measures how many bytes a game's event stream sends in each format.
+
+A game is replayed against the in-memory database: the seeded game from
+tests.benchmark is played for a number of turns, each player rolling, buying
+the property they land on if they can, paying rent and ending their turn,
+with a snapshot of the game read after every request. The snapshots are then
+fed to the events of each format (see backend.compact_events), as a stream
+would be, and the bytes written are counted:
+
+- once per request, as if the stream saw every change on its own, and
+- once per turn, as if the stream saw a turn's changes together.
+
+Run from ``team-software-project/backend/``::
+
+    python -m tests.event_sizes --turns 100 --seed 0
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+
+import backend.compact_events
+import backend.snapshot
+import tests.benchmark
+
+
+def play(world, turns):
+    """Play the world's game for a number of turns.
+
+    Returns:
+        A list with a list of the snapshots read after each request, for
+        each turn.
+    """
+    game_id = world.game
+    played = []
+    for _ in range(turns):
+        snapshots = []
+        state = backend.snapshot.read_snapshot(game_id)
+        if state['state'] != 'playing':
+            break
+        player = next(player for player in state['players']
+                      if player['turn_position'] == state['current_turn'])
+        requests = [('roll_dice', {'user_id': player['id']})]
+        for page, request in requests:
+            try:
+                tests.benchmark.call_handler(
+                    tests.benchmark.load_handler(page), request)
+            except Exception:  # pylint: disable=broad-except
+                pass
+            snapshots.append(backend.snapshot.read_snapshot(game_id))
+            if page != 'roll_dice':
+                continue
+            # What the player does next depends on where they landed.
+            moved = next(each for each in snapshots[-1]['players']
+                         if each['id'] == player['id'])
+            square = next((prop for prop in snapshots[-1]['properties']
+                           if prop['position'] == moved['board_position']),
+                          None)
+            if square is not None and square['owner'] is None:
+                requests.append(('buy_property', {
+                    'game_id': game_id, 'user_id': player['id'],
+                    'property_position': square['position']}))
+            elif square is not None and square['owner'] != player['id']:
+                requests.append(('charge_rent', {'player_id': player['id']}))
+            requests.append(('increment_turn', {'player_id': player['id']}))
+        played.append(snapshots)
+    return played
+
+
+def stream_bytes(event_format, ticks):
+    """Return the bytes a stream sends, given the snapshots it reads on each
+    of its ticks."""
+    events = backend.compact_events.make_events(event_format)
+    output = io.StringIO()
+    for snapshot in ticks:
+        if snapshot['version'] != events.version:
+            events.update(output, snapshot)
+    return len(output.getvalue().encode('utf-8'))
+
+
+def measure(turns, seed):
+    """Replay a game and measure its streams in each format.
+
+    Returns:
+        A dictionary of the results, ready to be saved as json.
+    """
+    os.environ['MONOPOLY_STORAGE'] = 'memory'
+    random.seed(seed)
+    world = tests.benchmark.World()
+    played = play(world, turns)
+    per_request = [snapshot for snapshots in played
+                   for snapshot in snapshots]
+    per_turn = [snapshots[-1] for snapshots in played]
+    results = {}
+    for name, ticks in (('per_request', per_request),
+                        ('per_turn', per_turn)):
+        results[name] = {str(event_format): stream_bytes(event_format, ticks)
+                         for event_format in backend.compact_events.FORMATS}
+        results[name]['ticks'] = len(ticks)
+    return {'turns': len(played), 'seed': seed, 'results': results}
+
+
+def main():
+    """Parse the command line, replay a game and print the sizes."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--turns', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also save the results as json')
+    args = parser.parse_args()
+
+    results = measure(args.turns, args.seed)
+    for name, sizes in sorted(results['results'].items()):
+        verbose = sizes[str(backend.compact_events.VERBOSE)]
+        compact = sizes[str(backend.compact_events.COMPACT)]
+        print('{:<12} {:5d} ticks {:8d} B verbose {:8d} B compact '
+              '({:.0f}% smaller)'.format(
+                  name, sizes['ticks'], verbose, compact,
+                  100 * (1 - compact / verbose)), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+"""Synthetic load test for the deployed game server.
+
+Spins up a number of concurrent games, each played by simulated players who
+go through the same sequence of requests as the frontend (allocate a user id,
+create or join a game, start it, then roll, buy and end turns with realistic
+think times). Every game also keeps an SSE subscriber attached, which is how
+the simulated players find out whose turn it is.
+
+The number of concurrent games is ramped up step by step until the latency
+or error-rate SLO is broken, and the saturation point is reported along with
+the database queries and connections per second seen during each step.
+
+Intended to be run directly on the server or local Docker image, e.g.::
+
+    python -m tests.load_testing --base-url http://localhost --max-games 64
+
+To measure how the server degrades along with the database, configure
+``MONOPOLY_FAULTS`` on the server (see ``backend.faults``) before running.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# How long a subscriber waits for a line of its event stream, in seconds:
+# longer than the server's heartbeat (see backend.events), so that a quiet
+# game isn't taken for a dead stream.
+STREAM_TIMEOUT = 45
+
+
+class Recorder(object):
+    """Collects the latency and outcome of every request made in a step."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.sse_events = 0
+
+    def record(self, latency, failed):
+        """Record a single request.
+
+        Arguments:
+            latency: How long the request took, in seconds.
+            failed: True if the request did not succeed.
+        """
+        with self._lock:
+            self.latencies.append(latency)
+            if failed:
+                self.errors += 1
+
+    def record_event(self):
+        """Record an event received by an SSE subscriber."""
+        with self._lock:
+            self.sse_events += 1
+
+
+def percentile(values, fraction):
+    """Return the value at the given fraction of a list of values.
+
+    >>> percentile([4, 1, 3, 2], 0.5)
+    3
+    >>> percentile([], 0.99)
+    0
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return ordered[index]
+
+
+def post(base_url, page, payload, recorder, timeout=30):
+    """POST some json to one of the backend pages and decode the response.
+
+    Arguments:
+        base_url: The address of the server, e.g. http://localhost.
+        page: The name of the page, as it appears in pages.py.
+        payload: The object to send as the body of the request.
+        recorder: The Recorder the request should be recorded in.
+
+    Returns:
+        The decoded json response, or None if there was no json body or the
+        request failed.
+    """
+    request = urllib.request.Request(
+        '{}/cgi-bin/{}.py'.format(base_url, page),
+        data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json; charset=UTF-8'})
+    start = time.time()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read().decode('utf-8')
+    except (urllib.error.URLError, OSError):
+        recorder.record(time.time() - start, True)
+        return None
+    recorder.record(time.time() - start, False)
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+class SyntheticGame(object):  # pylint: disable=too-many-instance-attributes
+    """A single game, played by simulated players until told to stop.
+
+    Arguments:
+        base_url: The address of the server.
+        recorder: The Recorder requests should be recorded in.
+        stop: A threading.Event which is set when the game should stop.
+        players: The number of simulated players in the game.
+        think_time: A (min, max) tuple of seconds a player waits between
+            actions.
+    """
+    def __init__(self, base_url, recorder, stop, players=4,
+                 think_time=(0.5, 2.5)):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.stop = stop
+        self.players = players
+        self.think_time = think_time
+        self.game_id = None
+        self.user_ids = []
+        self.current_turn = None
+        self.positions = {}
+        self.owned = {}
+        self._turn_changed = threading.Condition()
+        self._threads = []
+
+    def _post(self, page, payload):
+        return post(self.base_url, page, payload, self.recorder)
+
+    def _think(self):
+        self.stop.wait(random.uniform(*self.think_time))
+
+    def setup(self):
+        """Create the players and the game, and start it.
+
+        Returns:
+            True if the game was created and started successfully.
+        """
+        for number in range(self.players):
+            response = self._post('allocate_user_id',
+                                  {'username': 'load{}'.format(number)})
+            if response is None:
+                return False
+            self.user_ids.append(response['your_id'])
+        response = self._post('allocate_game_id',
+                              {'host_id': self.user_ids[0]})
+        if response is None:
+            return False
+        self.game_id = response['game_id']
+        for user_id in self.user_ids[1:]:
+            self._think()
+            self._post('join_game',
+                       {'user_id': user_id, 'game_id': self.game_id})
+        self._post('start-game', {'game_id': self.game_id})
+        return True
+
+    def start(self):
+        """Attach the SSE subscriber and start a thread per player."""
+        self._threads.append(threading.Thread(target=self.subscribe))
+        self._threads.extend(
+            threading.Thread(target=self.play, args=(user_id,))
+            for user_id in self.user_ids)
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def join(self):
+        """Wait for all of the game's threads to finish."""
+        with self._turn_changed:
+            self._turn_changed.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=10)
+
+    def subscribe(self):
+        """Follow the game's event stream until the game is stopped.
+
+        The server ends the stream when the game finishes or the stream has
+        been open for its maximum lifetime; the subscriber then reconnects
+        from the last event it saw, as a browser would, until the server
+        answers that there is nothing more to send.
+        """
+        last_id = None
+        try:
+            while not self.stop.is_set():
+                last_id = self._follow(last_id)
+                if last_id is None:
+                    return
+        except (urllib.error.URLError, OSError, ValueError):
+            if not self.stop.is_set():
+                self.recorder.record(0, True)
+
+    def _follow(self, last_id):
+        """Read the game's event stream until the server ends it.
+
+        Returns:
+            The id of the last event seen, to reconnect from, or None if the
+            server has no more events to send.
+        """
+        url = '{}/cgi-bin/game_event_source.py?game={}'.format(
+            self.base_url, self.game_id)
+        request = urllib.request.Request(url)
+        if last_id:
+            request.add_header('Last-Event-ID', last_id)
+        with urllib.request.urlopen(request,
+                                    timeout=STREAM_TIMEOUT) as stream:
+            if stream.status == 204:
+                return None
+            event = None
+            while not self.stop.is_set():
+                line = stream.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8').rstrip('\n')
+                if line.startswith('id: '):
+                    last_id = line[len('id: '):]
+                elif line.startswith('event: '):
+                    event = line[len('event: '):]
+                elif line.startswith('data: '):
+                    self.recorder.record_event()
+                    self.handle_event(event,
+                                      json.loads(line[len('data: '):]))
+        return last_id if last_id is not None else ''
+
+    def handle_event(self, event, data):
+        """Update the game's view of the board from an SSE event."""
+        if event == 'playerTurn':
+            with self._turn_changed:
+                self.current_turn = data['id']
+                self._turn_changed.notify_all()
+        elif event == 'playerMove':
+            for user_id, position, _old, *_jailed in data:
+                self.positions[user_id] = position
+        elif event == 'propertyOwnerChanges':
+            for change in data:
+                if change['newOwner'] is not None:
+                    self.owned[change['property']['position']] = (
+                        change['newOwner']['id'],
+                        change['property']['name'])
+                else:
+                    self.owned.pop(change['property']['position'], None)
+
+    def play(self, user_id):
+        """Take turns as the given player until the game is stopped."""
+        while not self.stop.is_set():
+            with self._turn_changed:
+                while self.current_turn != user_id:
+                    if self.stop.is_set():
+                        return
+                    self._turn_changed.wait(1)
+            self._think()
+            self._post('roll_dice', {'user_id': user_id})
+            self._think()
+            position = self.positions.get(user_id)
+            if position is not None and position not in self.owned:
+                self._post('buy_property', {
+                    'game_id': self.game_id,
+                    'user_id': user_id,
+                    'property_position': position})
+            mine = [name for owner, name in self.owned.values()
+                    if owner == user_id]
+            if mine and random.random() < 0.3:
+                self._think()
+                self._post('buy_house', {
+                    'player_id': user_id,
+                    'property_name': random.choice(mine)})
+            self._think()
+            with self._turn_changed:
+                # Only end the turn once; the next playerTurn event moves
+                # current_turn on.
+                self.current_turn = None
+            self._post('increment_turn', {'player_id': user_id})
+
+
+def database_counters():
+    """Return the server's cumulative query and connection counts.
+
+    Returns:
+        A (queries, connections) tuple, or None if the database can't be
+        reached from here.
+    """
+    try:
+        import backend.storage
+        conn = backend.storage.make_connection()
+    except Exception:  # pylint: disable=broad-except
+        return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name "
+                           "IN ('Questions', 'Connections');")
+            status = {row['Variable_name']: int(row['Value'])
+                      for row in cursor.fetchall()}
+        return status['Questions'], status['Connections']
+    finally:
+        conn.close()
+
+
+def run_step(base_url, games, duration, think_time):
+    """Run the given number of concurrent games for a fixed duration.
+
+    Returns:
+        A dictionary summarising the step.
+    """
+    recorder = Recorder()
+    stop = threading.Event()
+    before = database_counters()
+    started = time.time()
+
+    synthetic_games = [SyntheticGame(base_url, recorder, stop,
+                                     think_time=think_time)
+                       for _ in range(games)]
+    setup_threads = [threading.Thread(target=game.setup)
+                     for game in synthetic_games]
+    for thread in setup_threads:
+        thread.start()
+    for thread in setup_threads:
+        thread.join()
+    for game in synthetic_games:
+        if game.game_id is not None:
+            game.start()
+
+    stop.wait(duration)
+    stop.set()
+    for game in synthetic_games:
+        game.join()
+
+    elapsed = time.time() - started
+    after = database_counters()
+    summary = {
+        'games': games,
+        'requests': len(recorder.latencies),
+        'errors': recorder.errors,
+        'error_rate': recorder.errors / max(1, len(recorder.latencies)),
+        'p50': percentile(recorder.latencies, 0.50),
+        'p95': percentile(recorder.latencies, 0.95),
+        'p99': percentile(recorder.latencies, 0.99),
+        'sse_events': recorder.sse_events,
+        'queries_per_sec': None,
+        'connections_per_sec': None,
+    }
+    if before is not None and after is not None:
+        summary['queries_per_sec'] = (after[0] - before[0]) / elapsed
+        summary['connections_per_sec'] = (after[1] - before[1]) / elapsed
+    return summary
+
+
+def format_step(summary):
+    """Format a step summary as a single line of the report."""
+    line = ('games={games:4d} requests={requests:6d} errors={errors:4d} '
+            'p50={p50:.3f}s p95={p95:.3f}s p99={p99:.3f}s '
+            'sse_events={sse_events}').format(**summary)
+    if summary['queries_per_sec'] is not None:
+        line += ' db_qps={:.1f} db_conn/s={:.1f}'.format(
+            summary['queries_per_sec'], summary['connections_per_sec'])
+    return line
+
+
+def ramp(base_url, start, step, max_games, duration, think_time,
+         slo_p95, slo_error_rate):
+    """Increase the number of concurrent games until the SLO breaks.
+
+    Returns:
+        (saturation, steps): the number of games at which the SLO was first
+        broken (None if it never was), and the summaries of every step.
+    """
+    steps = []
+    games = start
+    while games <= max_games:
+        summary = run_step(base_url, games, duration, think_time)
+        steps.append(summary)
+        print(format_step(summary), flush=True)
+        if (summary['p95'] > slo_p95 or
+                summary['error_rate'] > slo_error_rate):
+            return games, steps
+        games += step
+    return None, steps
+
+
+def main():
+    """Parse the command line and run the ramp."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--base-url', default='http://localhost')
+    parser.add_argument('--start', type=int, default=1,
+                        help='concurrent games in the first step')
+    parser.add_argument('--step', type=int, default=4,
+                        help='games added at each step')
+    parser.add_argument('--max-games', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=60,
+                        help='seconds each step runs for')
+    parser.add_argument('--think-min', type=float, default=0.5)
+    parser.add_argument('--think-max', type=float, default=2.5)
+    parser.add_argument('--slo-p95', type=float, default=1.0,
+                        help='p95 request latency SLO, in seconds')
+    parser.add_argument('--slo-error-rate', type=float, default=0.01)
+    args = parser.parse_args()
+
+    saturation, steps = ramp(
+        args.base_url, args.start, args.step, args.max_games,
+        args.duration, (args.think_min, args.think_max),
+        args.slo_p95, args.slo_error_rate)
+    if saturation is None:
+        print('SLO held up to {} concurrent games'.format(
+            steps[-1]['games'] if steps else 0))
+    else:
+        print('Saturated at {} concurrent games'.format(saturation))
+
+
+if __name__ == '__main__':
+    main()
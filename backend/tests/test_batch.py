@@ -0,0 +1,12 @@
+import unittest
+import doctest
+import backend.batch
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(backend.batch))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,12 @@
+import unittest
+import doctest
+import backend.levels
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(backend.levels))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,673 @@
+"""Tests for the data model and the page handlers, run against the in-memory
+storage engine so that no database server is needed.
+
+Each test starts from the same seeded world: a started game with four
+players, the first of whom owns Old Kent Road (which the second is standing
+on), and a second game waiting for players.
+"""
+
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import backend.archive
+import backend.conditional
+import backend.storage
+from backend.allocate_game_id import request_game_id
+from backend.archive import archive_games, restore_game
+from backend.batch import batch
+from backend.board import apply_changes
+from backend.buy_house import add_house, build_houses
+from backend.charge_rent import charge_rent
+from backend.dashboard import Dashboard
+from backend.game import create_game, Game, game_version, get_games
+from backend.game_pool import fill_pool
+from backend.game_stream import start_sse_stream
+from backend.get_list_of_players import request_list_of_players
+from backend.increment_turn import increment_turn
+from backend.is_bankrupt import is_bankrupt
+from backend.jail import go_to_jail, pay_to_leave_jail
+from backend.join_game import add_player, join_game
+from backend.lobby import changes_since
+from backend.player import create_player, Player
+from backend.portfolio import portfolio
+from backend.properties import buy_property, buy_property_db, Property
+from backend.property_state import mortgage_properties, property_state
+from backend.request_game_details import request_game_details
+from backend.request_game_list import request_game_list
+from backend.roll_die import player_roll_dice
+from backend.scheduler import game_topic, Schedule
+from backend.snapshot import read_snapshot, request_game_snapshot
+from backend.spectate import (directory, forget_game, Publisher, Spectator,
+                              start_spectator_stream, take_slot)
+from backend.standings import check_games, request_standings
+from backend.start_game import start_game_db
+
+
+def call(handler, request):
+    """Call a handler that reads json from source, returning its response
+    body (without the headers)."""
+    output = io.StringIO()
+    handler(io.StringIO(json.dumps(request)), output)
+    return output.getvalue().split('\n\n', 1)[1]
+
+
+class PagesTest(unittest.TestCase):
+    """Runs the handlers against a freshly restored in-memory world."""
+    @classmethod
+    def setUpClass(cls):
+        cls._engine = os.environ.get('MONOPOLY_STORAGE')
+        os.environ['MONOPOLY_STORAGE'] = 'memory'
+
+        cls.players = [create_player(name)
+                       for name in ('Alex', 'Beth', 'Fred', 'Eimear')]
+        cls.game = create_game(cls.players[0])
+        for player in cls.players[1:]:
+            add_player(player, cls.game)
+        start_game_db(cls.game)
+        buy_property_db(cls.game, cls.players[0], 1)
+        with Player(cls.players[1]) as player:
+            player.board_position = 1
+        cls.host = create_player('Host')
+        cls.lobby = create_game(cls.host)
+        cls.seeded = backend.storage.memory_database().snapshot()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls._engine is None:
+            del os.environ['MONOPOLY_STORAGE']
+        else:
+            os.environ['MONOPOLY_STORAGE'] = cls._engine
+
+    def setUp(self):
+        backend.storage.memory_database().restore(self.seeded)
+
+    def current_player(self):
+        """Return the id of the player whose turn it is."""
+        game = Game(self.game)
+        for player_id in game.players:
+            if Player(player_id).turn_position == game.current_turn:
+                return player_id
+        return None
+
+    def test_seeded_game(self):
+        game = Game(self.game)
+        self.assertEqual(game.state, 'playing')
+        self.assertEqual(sorted(game.players), sorted(self.players))
+        positions = sorted(Player(p).turn_position for p in self.players)
+        self.assertEqual(positions, [0, 1, 2, 3])
+
+    def test_restore_discards_changes(self):
+        with Player(self.players[0]) as player:
+            player.balance = 0
+        backend.storage.memory_database().restore(self.seeded)
+        self.assertEqual(Player(self.players[0]).balance, 1500 - 60)
+
+    def test_buy_property(self):
+        response = call(buy_property, {'game_id': self.game,
+                                       'user_id': self.players[3],
+                                       'property_position': 3})
+        self.assertEqual(json.loads(response), 'Property bought')
+        with Property(3, self.game) as property_:
+            self.assertEqual(property_.owner, self.players[3])
+            self.assertEqual(property_.property_state, 'owned')
+        self.assertEqual(Player(self.players[3]).balance, 1500 - 60)
+
+    def test_charge_rent(self):
+        with Property(1, self.game) as property_:
+            rent = property_.rent
+        charge_rent(self.players[1])
+        self.assertEqual(Player(self.players[1]).balance, 1500 - rent)
+        self.assertEqual(Player(self.players[0]).balance, 1500 - 60 + rent)
+
+    def test_charge_rent_monopoly(self):
+        buy_property_db(self.game, self.players[0], 3)
+        charge_rent(self.players[1])
+        # Old Kent Road's rent of 2, doubled for the whole brown group.
+        self.assertEqual(Player(self.players[1]).balance, 1500 - 4)
+        self.assertEqual(Player(self.players[0]).balance, 1500 - 120 + 4)
+
+    def test_buy_house(self):
+        response = call(add_house, {'player_id': self.players[0],
+                                    'property_name': 'Old Kent Road'})
+        self.assertEqual(json.loads(response),
+                         {'house_number': 1, 'property_position': 1})
+
+    def test_roll_dice(self):
+        player_id = self.current_player()
+        with Player(player_id) as player:
+            player.board_position = 0
+        # From Go, a 6 lands on The Angel Islington, which no one owns, so
+        # no card or rent moves the player on.
+        with unittest.mock.patch('backend.roll_die.roll_two_dice',
+                                 return_value=[2, 4]):
+            response = json.loads(call(player_roll_dice,
+                                       {'user_id': player_id}))
+        self.assertEqual(response['your_rolls'], [2, 4])
+        self.assertEqual(Player(player_id).board_position, 6)
+        self.assertEqual(Player(player_id).jail_state, 'not_in_jail')
+
+    def test_increment_turn(self):
+        turn = Game(self.game).current_turn
+        response = call(increment_turn, {'player_id': self.players[0]})
+        self.assertEqual(json.loads(response), {'turn': 'turn_over'})
+        self.assertEqual(Game(self.game).current_turn, (turn + 1) % 4)
+
+    def test_join_game(self):
+        player_id = create_player('Joiner')
+        call(join_game, {'user_id': player_id, 'game_id': self.lobby})
+        self.assertEqual(Game(self.lobby).players, [self.host, player_id])
+        self.assertEqual(Player(player_id).turn_position, 1)
+
+    def test_create_game(self):
+        game_id = create_game(self.host)
+        self.assertEqual(Game(game_id).players, [self.host])
+        with Property(39, game_id) as property_:
+            self.assertEqual(property_.property_state, 'unowned')
+
+    def test_game_pool(self):
+        self.assertEqual(fill_pool(2), 2)
+        self.assertEqual(fill_pool(2), 0)
+        os.environ['MONOPOLY_GAME_POOL'] = '2'
+        try:
+            response = call(request_game_id, {'host_id': self.host})
+        finally:
+            del os.environ['MONOPOLY_GAME_POOL']
+        game_id = json.loads(response)['game_id']
+        self.assertEqual(Game(game_id).state, 'waiting')
+        self.assertEqual(Game(game_id).players, [self.host])
+        self.assertEqual(check_games(), {})
+        self.assertEqual(fill_pool(2), 1)
+
+    def test_archive(self):
+        path = tempfile.mkdtemp()
+        add_player(self.players[0], self.lobby)
+        with Game(self.game) as game:
+            game.state = 'finished'
+        # Only the finished game is archived, as the lobby is still fresh.
+        self.assertEqual(archive_games(path=path), 1)
+        self.assertEqual(list(get_games()), [self.lobby])
+        self.assertTrue(restore_game(self.game, path))
+        self.assertFalse(restore_game(self.game, path))
+        self.assertEqual(sorted(Game(self.game).players),
+                         sorted(self.players))
+        self.assertEqual(archive_games(ttl=-1, path=path), 2)
+        self.assertEqual(get_games(), {})
+
+    def test_archive_lobby_joined_while_archiving(self):
+        path = tempfile.mkdtemp()
+        joiner = create_player('Joiner')
+        read_games = backend.archive.read_games
+
+        def read_then_join(cursor, game_ids):
+            rows = read_games(cursor, game_ids)
+            add_player(joiner, self.lobby)
+            return rows
+        with unittest.mock.patch('backend.archive.read_games',
+                                 read_then_join):
+            self.assertEqual(archive_games(ttl=-1, path=path), 0)
+        self.assertEqual(os.listdir(path), [])
+        self.assertIn(joiner, Game(self.lobby).players)
+
+    def test_archive_bankrupt_players(self):
+        path = tempfile.mkdtemp()
+        with Player(self.players[0]) as player:
+            player.balance = -10
+        self.assertTrue(is_bankrupt(self.players[0]))
+        with Game(self.game) as game:
+            game.state = 'finished'
+        # A batch that is rolled back leaves nothing in the archive.
+        with unittest.mock.patch('backend.archive.delete_games',
+                                 return_value=False):
+            self.assertEqual(archive_games(ttl=-1, path=path), 0)
+        self.assertEqual(os.listdir(path), [])
+        self.assertEqual(archive_games(ttl=-1, path=path), 2)
+
+        def player_rows():
+            conn = backend.storage.make_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT `id` FROM `players` '
+                                   'WHERE `id` = %s;', (self.players[0],))
+                    return cursor.fetchall()
+            finally:
+                conn.close()
+        self.assertEqual(player_rows(), [])
+        self.assertTrue(restore_game(self.game, path))
+        self.assertEqual(len(player_rows()), 1)
+
+    def test_game_lists(self):
+        output = io.StringIO()
+        request_game_list(output)
+        games = json.loads(output.getvalue().split('\n\n', 1)[1])
+        self.assertEqual(games, {str(self.lobby): ['Host']})
+        details = call(request_game_details, {'game_id': self.game})
+        self.assertEqual(json.loads(details), {str(self.game): 'playing'})
+
+    def test_lobby_changes(self):
+        output = io.StringIO()
+        request_game_list(output, {'since': None})
+        lobby = json.loads(output.getvalue().split('\n\n', 1)[1])
+        self.assertEqual(lobby['games'], {str(self.lobby): ['Host']})
+
+        add_player(create_player('Joiner'), self.lobby)
+        with Game(self.lobby) as game:
+            game.state = 'playing'
+        update = changes_since(lobby['version'])
+        self.assertEqual(
+            [(change['kind'], change['players'])
+             for change in update['changes']],
+            [('filled', ['Host', 'Joiner']), ('started', [])])
+        self.assertEqual(changes_since(update['version'])['changes'], [])
+        self.assertEqual(get_games('waiting'), {})
+
+    def test_conditional_get(self):
+        request = json.dumps({'game_id': self.lobby})
+        output = io.StringIO()
+        request_list_of_players(io.StringIO(request), output)
+        headers = dict(line.split(': ', 1) for line in
+                       output.getvalue().split('\n\n')[0].split('\n'))
+        os.environ['HTTP_IF_NONE_MATCH'] = headers['ETag']
+        try:
+            output = io.StringIO()
+            request_list_of_players(io.StringIO(request), output)
+            self.assertTrue(output.getvalue().startswith('Status: 304'))
+            add_player(create_player('Joiner'), self.lobby)
+            output = io.StringIO()
+            request_list_of_players(io.StringIO(request), output)
+            self.assertNotIn('Status: 304', output.getvalue())
+        finally:
+            del os.environ['HTTP_IF_NONE_MATCH']
+
+    def test_response_cache_invalidation(self):
+        # pylint: disable=protected-access
+        os.environ['MONOPOLY_RESPONSE_CACHE'] = '10'
+        try:
+            call(request_game_snapshot, {'game_id': self.game})
+            call(request_standings, {'game_id': self.game})
+            self.assertEqual(len(backend.conditional._CACHE), 2)
+            # Writing to one of the game's players drops all of its pages.
+            with Player(self.players[0]) as player:
+                player.balance -= 10
+            self.assertEqual(list(backend.conditional._CACHE), [])
+        finally:
+            del os.environ['MONOPOLY_RESPONSE_CACHE']
+            backend.conditional._CACHE.clear()
+
+    def test_game_snapshot(self):
+        snapshot = json.loads(call(request_game_snapshot,
+                                   {'game_id': self.game}))
+        self.assertEqual(snapshot['state'], 'playing')
+        self.assertEqual([player['turn_position']
+                          for player in snapshot['players']], [0, 1, 2, 3])
+        owned = [prop for prop in snapshot['properties'] if prop['owner']]
+        self.assertEqual(owned, [{'position': 1, 'name': 'Old Kent Road',
+                                  'owner': self.players[0],
+                                  'mortgaged': False, 'houses': 0,
+                                  'hotels': 0}])
+        self.assertEqual(game_version(self.game)[0], snapshot['version'])
+        self.assertEqual(snapshot['board'], {
+            'owners': {str(self.players[0]): '2'}, 'mortgaged': '0',
+            'levels': '0'})
+
+        # Writing a player back unchanged leaves the version alone.
+        with Player(self.players[2]):
+            pass
+        self.assertEqual(game_version(self.game)[0], snapshot['version'])
+        buy_property_db(self.game, self.players[2], 3)
+        self.assertGreater(game_version(self.game)[0], snapshot['version'])
+
+    def test_batch(self):
+        response = json.loads(call(batch, {'actions': [
+            {'action': 'buy_property',
+             'request': {'game_id': self.game, 'user_id': self.players[0],
+                         'property_position': 3}},
+            {'action': 'buy_house',
+             'request': {'player_id': self.players[0],
+                         'property_name': 'Old Kent Road'}},
+            {'action': 'increment_turn',
+             'request': {'player_id': self.players[0]}}]}))
+        self.assertEqual(response['results'], [
+            'Property bought', {'house_number': 1, 'property_position': 1},
+            {'turn': 'turn_over'}])
+        with Property(1, self.game) as property_:
+            self.assertEqual(property_.houses, 1)
+        self.assertEqual(Player(self.players[0]).balance, 1500 - 60 - 60 - 50)
+
+    def test_batch_rolls_back(self):
+        response = json.loads(call(batch, {'actions': [
+            {'action': 'buy_property',
+             'request': {'game_id': self.game, 'user_id': self.players[0],
+                         'property_position': 3}},
+            {'action': 'buy_house', 'request': {}}]}))
+        self.assertEqual(response['error']['index'], 1)
+        self.assertEqual(response['error']['action'], 'buy_house')
+        with Property(3, self.game) as property_:
+            self.assertEqual(property_.property_state, 'unowned')
+        self.assertEqual(Player(self.players[0]).balance, 1500 - 60)
+
+    def test_build_houses(self):
+        buy_property_db(self.game, self.players[0], 3)
+        request = {'game_id': self.game, 'player_id': self.players[0]}
+        response = json.loads(call(build_houses, dict(
+            request, levels={'1': 2})))
+        self.assertEqual(response,
+                         {'error': 'houses in brown must be built evenly'})
+        response = json.loads(call(build_houses, dict(
+            request, levels={'1': 5, '3': 4})))
+        self.assertEqual(response['balance'], 1500 - 120 - 9 * 50)
+        with Property(1, self.game) as property_:
+            self.assertEqual((property_.houses, property_.hotels), (0, 1))
+        with Property(3, self.game) as property_:
+            self.assertEqual((property_.houses, property_.hotels), (4, 0))
+        response = json.loads(call(build_houses, dict(
+            request, levels={'6': 1})))
+        self.assertIn('error', response)
+        self.assertEqual(Player(self.players[0]).balance,
+                         1500 - 120 - 9 * 50)
+
+    def test_mortgage_properties(self):
+        buy_property_db(self.game, self.players[0], 5)
+        request = {'game_id': self.game, 'player_id': self.players[0]}
+        response = json.loads(call(mortgage_properties, dict(
+            request, mortgages={'1': True, '5': True})))
+        self.assertEqual(response['balance'], 1500 - 60 - 200 + 30 + 100)
+        with Property(5, self.game) as property_:
+            self.assertEqual(property_.mortgage, 'mortgaged')
+        response = json.loads(call(mortgage_properties, dict(
+            request, mortgages={'1': False, '3': True})))
+        self.assertIn('error', response)
+        self.assertEqual(Player(self.players[0]).balance,
+                         1500 - 60 - 200 + 30 + 100)
+
+    def test_bankruptcy(self):
+        self.assertFalse(is_bankrupt(self.players[0]))
+        with Player(self.players[0]) as player:
+            player.balance = -10
+        self.assertTrue(is_bankrupt(self.players[0]))
+        game = Game(self.game)
+        self.assertEqual(sorted(game.players), sorted(self.players[1:]))
+        self.assertEqual(game.state, 'playing')
+        self.assertEqual(sorted(Player(p).turn_position
+                                for p in self.players[1:]), [0, 1, 2])
+        with Property(1, self.game) as property_:
+            self.assertEqual(property_.property_state, 'unowned')
+            self.assertEqual(property_.owner, 0)
+
+        for player_id in self.players[1:3]:
+            with Player(player_id) as player:
+                player.balance = -10
+            is_bankrupt(player_id)
+        self.assertEqual(Game(self.game).players, [self.players[3]])
+        self.assertEqual(Game(self.game).state, 'finished')
+
+    def test_bankruptcy_to_creditor(self):
+        with Player(self.players[0]) as player:
+            player.balance = -10
+        self.assertTrue(is_bankrupt(self.players[0], self.players[1]))
+        with Property(1, self.game) as property_:
+            self.assertEqual(property_.property_state, 'owned')
+            self.assertEqual(property_.owner, self.players[1])
+
+    def test_portfolio(self):
+        buy_property_db(self.game, self.players[0], 3)
+        buy_property_db(self.game, self.players[0], 5)
+        holdings = portfolio(self.players[0], self.game)
+        self.assertEqual(
+            [(prop['position'], prop['group'], prop['rent'],
+              prop['mortgage_value']) for prop in holdings['properties']],
+            [(1, 'brown', 4, 30), (3, 'brown', 8, 30),
+             (5, 'railroad', 25, 100)])
+        self.assertEqual(holdings['balance'], 1500 - 320)
+        self.assertEqual(holdings['net_worth'], 1500)
+        self.assertEqual(portfolio(self.players[1], self.game)['properties'],
+                         [])
+
+    def test_standings(self):
+        def standings():
+            response = json.loads(call(request_standings,
+                                       {'game_id': self.game}))
+            return [(row['player_id'], row['cash'], row['assets'],
+                     row['place']) for row in response['standings']]
+
+        alex, beth, fred, eimear = self.players
+        self.assertEqual(standings(), [
+            (alex, 1440, 60, 1), (beth, 1500, 0, 1), (fred, 1500, 0, 1),
+            (eimear, 1500, 0, 1)])
+        buy_property_db(self.game, alex, 3)
+        apply_changes(self.game, alex, levels={1: 1, 3: 1})
+        charge_rent(beth)
+        buy_property_db(self.game, fred, 5)
+        apply_changes(self.game, fred, mortgages={5: True})
+        self.assertEqual(standings(), [
+            (alex, 1290, 220, 1), (fred, 1400, 100, 2), (eimear, 1500, 0, 2),
+            (beth, 1490, 0, 4)])
+
+        with Player(alex) as player:
+            player.balance = -10
+        is_bankrupt(alex, beth)
+        self.assertEqual(standings(), [
+            (beth, 1490, 220, 1), (fred, 1400, 100, 2), (eimear, 1500, 0, 2)])
+        self.assertEqual(check_games(), {})
+
+        with Player(fred) as player:
+            player.balance = 2000
+        conn = backend.storage.make_connection()
+        with conn.cursor() as cursor:
+            cursor.execute('UPDATE `standings` SET `cash` = 0 '
+                           'WHERE `player_id` = %s;', (eimear,))
+        conn.commit()
+        conn.close()
+        self.assertEqual(check_games([self.game]), {self.game: [eimear]})
+        self.assertEqual(check_games([self.game], repair=True),
+                         {self.game: [eimear]})
+        self.assertEqual(standings()[0], (fred, 2000, 100, 1))
+        self.assertEqual(check_games(), {})
+
+    def test_compact_game_stream(self):
+        os.environ['QUERY_STRING'] = 'game={}&format=2'.format(self.game)
+        os.environ['MONOPOLY_SSE_MAX_LIFETIME'] = '0'
+        try:
+            output = io.StringIO()
+            start_sse_stream(output)
+            events = output.getvalue().split('\n\n')
+            self.assertIn('event: dictionary', events[1])
+            self.assertIn('"Old Kent Road"', events[1])
+            self.assertIn('event: delta', events[2])
+            self.assertNotIn('event: playerBalance', output.getvalue())
+        finally:
+            del os.environ['QUERY_STRING']
+            del os.environ['MONOPOLY_SSE_MAX_LIFETIME']
+
+    def test_write_hints(self):
+        os.environ['MONOPOLY_SCHEDULER_DIR'] = tempfile.mkdtemp()
+        try:
+            schedule = Schedule('game', game_topic(self.game), self.game)
+            schedule.listen()
+            self.assertFalse(schedule.hinted())
+            with Player(self.players[2]) as player:
+                player.balance = 1000
+            self.assertTrue(schedule.hinted())
+            self.assertFalse(schedule.hinted())
+            # Changes that are rolled back don't wake anyone.
+            with self.assertRaises(ValueError):
+                with backend.storage.transaction():
+                    with Player(self.players[2]) as player:
+                        player.balance = 900
+                    raise ValueError()
+            self.assertFalse(schedule.hinted())
+            # Streams share the cap on polls a second.
+            os.environ['MONOPOLY_POLL_QPS'] = '1'
+            waits = []
+            for _ in range(2):
+                schedule = Schedule('game')
+                schedule.listen()
+                schedule.throttle(waits.append)
+            self.assertEqual(len(waits), 1)
+        finally:
+            del os.environ['MONOPOLY_SCHEDULER_DIR']
+            os.environ.pop('MONOPOLY_POLL_QPS', None)
+
+    def test_spectators(self):
+        os.environ['MONOPOLY_SPECTATOR_DIR'] = tempfile.mkdtemp()
+        try:
+            slots = [take_slot(self.game, limit=2) for _ in range(3)]
+            self.assertIsNone(slots[2])
+            slots[0].close()
+            slots[0] = take_slot(self.game, limit=2)
+            self.assertIsNotNone(slots[0])
+            for slot in slots[:2]:
+                slot.close()
+
+            publisher = Publisher(self.game)
+            self.assertTrue(publisher.take())
+            # Only one process publishes each game.
+            self.assertFalse(Publisher(self.game).take())
+            publisher.offer(read_snapshot(self.game))
+            spectator = Spectator(self.game)
+            slow = Spectator(self.game, backlog=1)
+            compact = Spectator(self.game, event_format=2)
+            output = io.StringIO()
+            spectator.send(output)
+            slow.send(io.StringIO())
+            compact.send(io.StringIO())
+            self.assertIn('event: gameSnapshot', output.getvalue())
+
+            for balance in (1000, 900, 800):
+                with Player(self.players[2]) as player:
+                    player.balance = balance
+                publisher.offer(read_snapshot(self.game))
+            output = io.StringIO()
+            self.assertEqual(spectator.send(output), 0)
+            self.assertEqual(output.getvalue().count('event: playerBalance'),
+                             3)
+            self.assertNotIn('gameSnapshot', output.getvalue())
+            # Spectators that asked for the compact format are sent it.
+            output = io.StringIO()
+            compact.send(output)
+            self.assertEqual(output.getvalue().count('event: delta'), 3)
+            self.assertNotIn('event: playerBalance', output.getvalue())
+            # The slow spectator is sent the latest snapshot instead.
+            output = io.StringIO()
+            self.assertEqual(slow.send(output), 2)
+            self.assertIn('event: gameSnapshot', output.getvalue())
+            self.assertEqual(slow.version, spectator.version)
+
+            # Whoever publishes next carries on from the cached snapshot.
+            publisher.close()
+            with Player(self.players[2]) as player:
+                player.balance = 700
+            publisher = Publisher(self.game)
+            publisher.offer(read_snapshot(self.game))
+            publisher.close()
+            output = io.StringIO()
+            spectator.send(output)
+            self.assertIn('[[{}, 700, -100]]'.format(self.players[2]),
+                          output.getvalue())
+            spectator.close()
+            slow.close()
+            compact.close()
+        finally:
+            del os.environ['MONOPOLY_SPECTATOR_DIR']
+
+    def test_forget_game(self):
+        os.environ['MONOPOLY_SPECTATOR_DIR'] = tempfile.mkdtemp()
+        os.environ['MONOPOLY_SCHEDULER_DIR'] = tempfile.mkdtemp()
+        try:
+            Schedule('spectator', game_topic(self.game)).listen()
+            hint_file = os.path.join(os.environ['MONOPOLY_SCHEDULER_DIR'],
+                                     game_topic(self.game))
+            slot = take_slot(self.game)
+            publisher = Publisher(self.game)
+            publisher.offer(read_snapshot(self.game))
+            # Nothing is removed while a stream is still using the files.
+            self.assertFalse(forget_game(self.game))
+            slot.close()
+            self.assertFalse(forget_game(self.game))
+            publisher.close()
+            self.assertTrue(forget_game(self.game))
+            self.assertFalse(os.path.exists(directory(self.game)))
+            self.assertFalse(os.path.exists(hint_file))
+        finally:
+            del os.environ['MONOPOLY_SPECTATOR_DIR']
+            del os.environ['MONOPOLY_SCHEDULER_DIR']
+
+    def test_spectator_stream_needs_game(self):
+        for query in ('', 'game=', 'game=x'):
+            os.environ['QUERY_STRING'] = query
+            output = io.StringIO()
+            try:
+                start_spectator_stream(output)
+            finally:
+                del os.environ['QUERY_STRING']
+            self.assertTrue(
+                output.getvalue().startswith('Status: 400 Bad Request\n'))
+
+    def test_dashboard(self):
+        dashboard = Dashboard()
+        now = time.time()
+        frame = dashboard.poll(now)
+        self.assertEqual([(game[0], game[1], game[3])
+                          for game in frame['games']],
+                         [(self.game, 'playing', 4),
+                          (self.lobby, 'waiting', 1)])
+        self.assertIsNone(dashboard.poll(now))
+
+        with Player(self.players[0]) as player:
+            player.balance -= 10
+        with Game(self.lobby) as game:
+            game.state = 'finished'
+        frame = dashboard.poll(now + 2)
+        self.assertEqual([game[0] for game in frame['games']], [self.game])
+        self.assertEqual(frame['removed'], [self.lobby])
+        self.assertEqual(frame['totals']['games'], 1)
+
+    def test_game_stream_lifecycle(self):
+        os.environ['QUERY_STRING'] = 'game={}'.format(self.game)
+        os.environ['MONOPOLY_SSE_MAX_LIFETIME'] = '0'
+        try:
+            output = io.StringIO()
+            start_sse_stream(output)
+            self.assertIn('id: {}\n'.format(game_version(self.game)[0]),
+                          output.getvalue())
+            # The stream ends with the game, without waiting to expire.
+            del os.environ['MONOPOLY_SSE_MAX_LIFETIME']
+            with Game(self.game) as game:
+                game.state = 'finished'
+            start_sse_stream(io.StringIO())
+            # A client that has seen the end is told not to reconnect.
+            os.environ['HTTP_LAST_EVENT_ID'] = str(
+                game_version(self.game)[0])
+            output = io.StringIO()
+            start_sse_stream(output)
+            self.assertEqual(output.getvalue(), 'Status: 204 No Content\n\n')
+        finally:
+            del os.environ['QUERY_STRING']
+            os.environ.pop('MONOPOLY_SSE_MAX_LIFETIME', None)
+            os.environ.pop('HTTP_LAST_EVENT_ID', None)
+
+    def test_property_state(self):
+        request = {'player_id': ['None', 'None', self.players[0]]}
+        self.assertEqual(json.loads(call(property_state, request)),
+                         {'mortgage': ['Old Kent Road'], 'unmortgage': []})
+        request = {'player_id': ['unmortgage', 'Old Kent Road',
+                                 self.players[0]]}
+        self.assertEqual(json.loads(call(property_state, request)),
+                         {'mortgage': [], 'unmortgage': ['Old Kent Road']})
+
+    def test_jail(self):
+        player_id = self.players[2]
+        response = call(go_to_jail, {'player_id': player_id})
+        self.assertEqual(json.loads(response), {str(player_id): 'in_jail'})
+        response = call(pay_to_leave_jail, {'player_id': player_id})
+        self.assertEqual(json.loads(response),
+                         {str(player_id): 'not_in_jail'})
+        self.assertEqual(Player(player_id).jail_state, 'not_in_jail')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,12 @@
+import unittest
+import doctest
+import backend.request_metrics
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(backend.request_metrics))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main()
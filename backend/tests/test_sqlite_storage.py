@@ -0,0 +1,12 @@
+import unittest
+import doctest
+import backend.sqlite_storage
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(backend.sqlite_storage))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main()
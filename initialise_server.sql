@@ -19,11 +19,32 @@ CREATE TABLE IF NOT EXISTS rolls (
 
 CREATE TABLE IF NOT EXISTS games (
     id int UNSIGNED NOT NULL AUTO_INCREMENT,
-    state ENUM('waiting', 'playing', 'finished') NOT NULL DEFAULT 'waiting',
+    -- 'pooled' games have been created ahead of time and not yet claimed
+    state ENUM('pooled', 'waiting', 'playing', 'finished') NOT NULL DEFAULT 'waiting',
     current_turn tinyint UNSIGNED NOT NULL DEFAULT 0,
+    -- Incremented by every change to the game, and the Unix time of the
+    -- last one; both are set by the backend
+    version int UNSIGNED NOT NULL DEFAULT 0,
+    updated_at int UNSIGNED NOT NULL DEFAULT 0,
     PRIMARY KEY (id)
 );
 
+CREATE INDEX games_state ON games (state);
+-- For finding the games changed since some time (see backend/dashboard.py)
+CREATE INDEX games_updated_at ON games (updated_at);
+
+-- Changes to the list of games waiting for players, in order. Each entry
+-- holds the usernames in the game after the change, so that clients can
+-- apply it without asking for anything else.
+CREATE TABLE IF NOT EXISTS lobby_log (
+    version int UNSIGNED NOT NULL AUTO_INCREMENT,
+    game_id int UNSIGNED NOT NULL,
+    kind ENUM('created', 'filled', 'started', 'removed') NOT NULL,
+    players varchar(4096) CHARACTER SET utf8mb4 NOT NULL DEFAULT '[]',
+    created_at int UNSIGNED NOT NULL DEFAULT 0,
+    PRIMARY KEY (version)
+);
+
 CREATE TABLE IF NOT EXISTS playing_in (
     player_id int UNSIGNED NOT NULL,
     game_id int UNSIGNED NOT NULL,
@@ -31,6 +52,15 @@ CREATE TABLE IF NOT EXISTS playing_in (
     FOREIGN KEY (game_id) REFERENCES games(id)
 );
 
+-- The players taken out of a game (when they go bankrupt), who are no longer
+-- in playing_in but are archived along with it (see backend/archive.py)
+CREATE TABLE IF NOT EXISTS departures (
+    player_id int UNSIGNED NOT NULL,
+    game_id int UNSIGNED NOT NULL,
+    FOREIGN KEY (player_id) REFERENCES players(id),
+    FOREIGN KEY (game_id) REFERENCES games(id)
+);
+
 -- Note that only 'tax' uses the value field in this table
 CREATE TABLE IF NOT EXISTS miscellaneous (
     board_position tinyint UNSIGNED NOT NULL,
@@ -66,6 +96,19 @@ CREATE TABLE IF NOT EXISTS properties (
     FOREIGN KEY (property_position) REFERENCES property_values(property_position)
 );
 
+-- Each player's cash, the value of their properties and buildings, their
+-- net worth and their place in their game, kept up to date by every write
+-- to them (see backend/standings.py)
+CREATE TABLE IF NOT EXISTS standings (
+    game_id int UNSIGNED NOT NULL,
+    player_id int UNSIGNED NOT NULL,
+    cash int NOT NULL DEFAULT 0,
+    assets int NOT NULL DEFAULT 0,
+    net_worth int NOT NULL DEFAULT 0,
+    place tinyint UNSIGNED NOT NULL DEFAULT 1,
+    PRIMARY KEY (game_id, player_id)
+);
+
 CREATE TABLE IF NOT EXISTS cards (
     unique_id tinyint UNSIGNED NOT NULL AUTO_INCREMENT,
     card_type ENUM('chance','chest') NOT NULL,